@@ -17,6 +17,9 @@ import pandas as pd
 import plotly.graph_objs as go
 import numpy as np
 
+import perf_trace
+from downsample import downsample_trend_frame
+
 @dataclass
 class TrendOptions:
     start_date: str
@@ -28,6 +31,10 @@ class TrendOptions:
     kph_ratio: float = 0.40 # 價平和佔 Y 軸比例 (40%)
     # 【新增】增加 Y 軸基準點參數
     ft_base_price: Optional[float] = None
+    # 快速繪圖模式：向量化映射/Hover 格式化，並以 WebGL (Scattergl) 輸出
+    fast_render: bool = False
+    # 繪圖點數上限 (LTTB 降採樣，保留每日高低點)；None 表示不降採樣
+    max_points: Optional[int] = None
 
 WEEK = "一二三四五六日"
 
@@ -85,8 +92,96 @@ def map_y(y, y_min, y_max, t_min, t_max):
     if y_max - y_min == 0: return (t_max + t_min) / 2
     return (y - y_min) / (y_max - y_min) * (t_max - t_min) + t_min
 
+# --- 快速繪圖模式 (向量化) 輔助函數 ---
+
+COLOR_PALETTE = ["#1f77b4","#ff7f0e","#2ca02c","#d62728","#9467bd","#8c564b","#e377c2","#7f7f7f","#bcbd22","#17becf"]
+
+def _map_y_array(values: np.ndarray, y_min, y_max, t_min, t_max) -> np.ndarray:
+    """map_y 的向量化版本"""
+    values = np.asarray(values, dtype=np.float64)
+    if y_max - y_min == 0: return np.full(values.shape, (t_max + t_min) / 2)
+    return (values - y_min) / (y_max - y_min) * (t_max - t_min) + t_min
+
+def _fmt_thousands(values: np.ndarray) -> np.ndarray:
+    """向量化的 f"{x:,.0f}"；NaN 回傳空字串"""
+    values = np.asarray(values, dtype=np.float64)
+    nan = np.isnan(values)
+    rounded = np.round(np.where(nan, 0.0, values))
+    mag = np.abs(rounded).astype(np.int64)
+    n_groups = max(1, (len(str(int(mag.max()))) + 2) // 3) if mag.size else 1
+    groups = [np.char.zfill((mag // 1000 ** g % 1000).astype(str), 3) for g in range(n_groups - 1, -1, -1)]
+    txt = groups[0]
+    for grp in groups[1:]: txt = np.char.add(np.char.add(txt, ","), grp)
+    txt = np.char.lstrip(txt, "0,")
+    txt = np.where(txt == "", "0", txt)
+    txt = np.where(np.signbit(rounded), np.char.add("-", txt), txt)
+    return np.where(nan, "", txt)
+
+def _fmt_signed(values: np.ndarray) -> np.ndarray:
+    """向量化的 f"{x:+.0f}"；NaN 回傳空字串"""
+    values = np.asarray(values, dtype=np.float64)
+    nan = np.isnan(values)
+    rounded = np.round(np.where(nan, 0.0, values))
+    txt = np.char.add(np.where(np.signbit(rounded), "-", "+"), np.abs(rounded).astype(np.int64).astype(str))
+    return np.where(nan, "", txt)
+
+def _value_text_fast(value: pd.Series, change: Optional[pd.Series]) -> np.ndarray:
+    """與 _ft_text_with_change / _kph_text_with_change 相同的格式：價格 (+/-漲跌)"""
+    val = pd.to_numeric(value, errors="coerce").to_numpy(dtype=np.float64)
+    txt = _fmt_thousands(val)
+    if change is None: return txt
+    chg = pd.to_numeric(change, errors="coerce").to_numpy(dtype=np.float64)
+    with_chg = np.char.add(np.char.add(np.char.add(txt, " ("), _fmt_signed(chg)), ")")
+    return np.where(np.isnan(val) | np.isnan(chg), txt, with_chg)
+
+def _time_text_fast(series_dt: pd.Series) -> np.ndarray:
+    """與 _fmt_dt_with_week 相同的格式：YYYY-MM-DD (週) HH:MM"""
+    dt = pd.to_datetime(series_dt, errors="coerce")
+    nat = dt.isna().to_numpy()
+    iso = np.datetime_as_string(dt.to_numpy().astype("datetime64[m]"), unit="m").astype("U16")  # YYYY-MM-DDTHH:MM
+    chars = iso.view("U1").reshape(-1, 16)
+    date_part, hm_part = chars[:, :10].copy().view("U10").ravel(), chars[:, 11:16].copy().view("U5").ravel()
+    week = np.array(list(WEEK))[dt.dt.weekday.fillna(6).astype(int).to_numpy()]
+    txt = np.char.add(np.char.add(np.char.add(np.char.add(date_part, " ("), week), ") "), hm_part)
+    return np.where(nat, "", txt)
+
+def _nan_separated(x: np.ndarray, y: np.ndarray, day_codes: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """在每個交易日之間插入一個 NaN 點，讓同色的多日資料 (超過 COLOR_PALETTE 的天數時) 可放進同一條線而不相連"""
+    breaks = np.flatnonzero(day_codes[1:] != day_codes[:-1]) + 1
+    if len(breaks) == 0: return x, y
+    x_out = np.insert(x, breaks, x[breaks - 1])
+    y_out = np.insert(y.astype(np.float64), breaks, np.nan)
+    return x_out, y_out
+
+def _add_fast_traces(fig: go.Figure, dff: pd.DataFrame, opts: TrendOptions, kph_cols_valid: List[str]):
+    """以單一 factorize 的日期鍵分組，每種顏色一條 Scattergl (日與日之間以 NaN 斷開)，另加一條統一 Hover 線。
+
+    線的顏色只能整條指定，無法逐點換色；頁面最多 10 天、調色盤也是 10 色，因此線數與舊版相同 (每日每序列一條)，
+    只有天數超過調色盤時才會合併。加速來自 Scattergl (WebGL) 與向量化產生的 Hover 文字，而非減少線數。"""
+    x = dff[opts.time_col].to_numpy()
+    day_codes, _ = pd.factorize(dff[opts.time_col].dt.normalize(), sort=True)
+    color_codes = day_codes % len(COLOR_PALETTE)
+    series = [(f'{opts.ft_col}_mapped', 'FT價格', 'FT_Group', dict(width=1.0))]
+    if kph_cols_valid:
+        series.append((f'{kph_cols_valid[0]}_mapped', kph_cols_valid[0], 'KPH_Group', dict(width=0.8, dash="dot")))
+    for col, name, group, line in series:
+        y = dff[col].to_numpy()
+        for color_idx in np.unique(color_codes):
+            sel = color_codes == color_idx
+            xs, ys = _nan_separated(x[sel], y[sel], day_codes[sel])
+            fig.add_trace(go.Scattergl(
+                x=xs, y=ys, mode="lines", line=dict(color=COLOR_PALETTE[color_idx], **line),
+                name=name, legendgroup=group, showlegend=bool(color_idx == color_codes[0]), hoverinfo='skip', connectgaps=False,
+            ))
+    fig.add_trace(go.Scattergl(
+        x=x, y=dff[f'{opts.ft_col}_mapped'].to_numpy(), mode='lines',
+        line=dict(width=0, color='rgba(0,0,0,0)'), name='統一查價線', showlegend=False,
+        hoverinfo='text', hovertemplate='%{text}<extra></extra>', text=dff['unified_hover'].to_numpy(),
+    ))
+
 # --- 核心繪圖函數 ---
 
+@perf_trace.traced("make_trend")
 def make_trend(df: pd.DataFrame, opts: TrendOptions) -> go.Figure:
 
     dff = df.copy()
@@ -96,6 +191,8 @@ def make_trend(df: pd.DataFrame, opts: TrendOptions) -> go.Figure:
     dff = dff.dropna(subset=[opts.time_col]).sort_values(opts.time_col).reset_index(drop=True)
 
     if dff.empty: raise ValueError("DataFrame 為空或關鍵欄位值為空，無法繪製趨勢圖。")
+    if opts.max_points:
+        dff = downsample_trend_frame(dff, opts.time_col, [opts.ft_col] + [c for c in opts.kph_cols if c in dff.columns], opts.max_points).reset_index(drop=True)
 
     # 數據範圍計算
     kph_cols_valid = [c for c in opts.kph_cols if c in dff.columns]
@@ -125,82 +222,93 @@ def make_trend(df: pd.DataFrame, opts: TrendOptions) -> go.Figure:
     kph_seg = (0, opts.kph_ratio) # 0 to 0.4
     ft_seg = (opts.kph_ratio, 1) # 0.4 to 1.0
 
-    # 數據映射
-    for c in kph_cols_valid:
-        dff[f'{c}_mapped'] = dff[c].apply(lambda y: map_y(y, kph_min, kph_max, kph_seg[0], kph_seg[1]))
-    dff[f'{opts.ft_col}_mapped'] = dff[opts.ft_col].apply(lambda y: map_y(y, ft_min, ft_max, ft_seg[0], ft_seg[1]))
-
-    # --- 準備統一 Hover 數據 ---
-    dff['ft_text_hover'] = _ft_text_with_change(dff, opts.ft_col, opts.ft_chg_col_candidates)
-    dff['kph_text_hover'] = _kph_text_with_change(dff, kph_cols_valid[0])
-    dff['time_text_hover'] = _fmt_dt_with_week(dff[opts.time_col])
-
-    # 建立統一 Hover 提示框的內容
-    dff['unified_hover'] = (
-        dff['time_text_hover'] + '<br>' +
-        'FT價格：' + dff['ft_text_hover'] + '<br>' +
-        '價平和：' + dff['kph_text_hover']
-    )
-    # --- 統一 Hover 數據準備完畢 ---
-
-
-    # 繪圖
-    fig = go.Figure()
-    # 定義用於線條分段的顏色
-    color_palette = ["#1f77b4","#ff7f0e","#2ca02c","#d62728","#9467bd","#8c564b","#e377c2","#7f7f7f","#bcbd22","#17becf"]
-
-    unique_dates = sorted(dff[opts.time_col].dt.strftime("%Y-%m-%d").unique().tolist())
-
-    # ------------------- 按日分段繪圖 (換日換色 & 單一圖例 & 忽略 Hover) -------------------
-
-    for i, d in enumerate(unique_dates):
-        sub = dff[dff[opts.time_col].dt.strftime("%Y-%m-%d")==d].copy()
-        if sub.empty: continue
-        is_first_day = (i == 0)
-
-        day_color = color_palette[i % len(color_palette)]
-
-        # 1. FT 價格線
-        if opts.ft_col in sub.columns:
-            fig.add_trace(go.Scatter(
-                x=sub[opts.time_col], y=sub[f'{opts.ft_col}_mapped'],
-                mode="lines",
-                # FT 線徑 1.0
-                line=dict(color=day_color, width=1.0),
-                name='FT價格',
-                legendgroup='FT_Group',
-                showlegend=is_first_day,
-                hoverinfo='skip',
-            ))
-
-        # 2. 價平和線
-        if kph_cols_valid:
-            kcol = kph_cols_valid[0]
-            fig.add_trace(go.Scatter(
-                x=sub[opts.time_col], y=sub[f'{kcol}_mapped'],
-                mode="lines",
-                # 價平和線徑 0.8
-                line=dict(color=day_color, width=0.8, dash="dot"),
-                name=kcol,
-                legendgroup='KPH_Group',
-                showlegend=is_first_day,
-                hoverinfo='skip',
-            ))
-
-    # ------------------- 統一 Hover 追蹤 (Invisible Trace) -------------------
-
-    # 新增一個完全透明的追蹤，它負責提供所有統一的 Hover 資訊
-    fig.add_trace(go.Scatter(
-        x=dff[opts.time_col],
-        y=dff[f'{opts.ft_col}_mapped'],
-        mode='lines',
-        line=dict(width=0, color='rgba(0,0,0,0)'),
-        name='統一查價線',
-        showlegend=False,
-        hoverinfo='text',
-        hovertemplate='%{text}<extra></extra>',
-        text=dff['unified_hover'],
-    ))
+    if opts.fast_render:
+        # 數據映射與 Hover 文字全部向量化
+        for c in kph_cols_valid:
+            dff[f'{c}_mapped'] = _map_y_array(dff[c].to_numpy(), kph_min, kph_max, kph_seg[0], kph_seg[1])
+        dff[f'{opts.ft_col}_mapped'] = _map_y_array(dff[opts.ft_col].to_numpy(), ft_min, ft_max, ft_seg[0], ft_seg[1])
+        chg_col = _pick_first_column(dff, opts.ft_chg_col_candidates)
+        ft_text = _value_text_fast(dff[opts.ft_col], dff[chg_col] if chg_col else None)
+        kph_text = _value_text_fast(dff[kph_cols_valid[0]], dff["價平和漲跌(價平)"] if "價平和漲跌(價平)" in dff.columns else None) if kph_cols_valid else np.full(len(dff), "")
+        dff['unified_hover'] = np.char.add(np.char.add(np.char.add(np.char.add(_time_text_fast(dff[opts.time_col]), '<br>FT價格：'), ft_text), '<br>價平和：'), kph_text)
+        fig = go.Figure()
+        _add_fast_traces(fig, dff, opts, kph_cols_valid)
+        unique_dates = np.unique(dff[opts.time_col].dt.normalize().to_numpy())
+    else:
+        # 數據映射
+        for c in kph_cols_valid:
+            dff[f'{c}_mapped'] = dff[c].apply(lambda y: map_y(y, kph_min, kph_max, kph_seg[0], kph_seg[1]))
+        dff[f'{opts.ft_col}_mapped'] = dff[opts.ft_col].apply(lambda y: map_y(y, ft_min, ft_max, ft_seg[0], ft_seg[1]))
+
+        # --- 準備統一 Hover 數據 ---
+        dff['ft_text_hover'] = _ft_text_with_change(dff, opts.ft_col, opts.ft_chg_col_candidates)
+        dff['kph_text_hover'] = _kph_text_with_change(dff, kph_cols_valid[0])
+        dff['time_text_hover'] = _fmt_dt_with_week(dff[opts.time_col])
+
+        # 建立統一 Hover 提示框的內容
+        dff['unified_hover'] = (
+            dff['time_text_hover'] + '<br>' +
+            'FT價格：' + dff['ft_text_hover'] + '<br>' +
+            '價平和：' + dff['kph_text_hover']
+        )
+        # --- 統一 Hover 數據準備完畢 ---
+
+
+        # 繪圖
+        fig = go.Figure()
+
+        unique_dates = sorted(dff[opts.time_col].dt.strftime("%Y-%m-%d").unique().tolist())
+
+        # ------------------- 按日分段繪圖 (換日換色 & 單一圖例 & 忽略 Hover) -------------------
+
+        for i, d in enumerate(unique_dates):
+            sub = dff[dff[opts.time_col].dt.strftime("%Y-%m-%d")==d].copy()
+            if sub.empty: continue
+            is_first_day = (i == 0)
+
+            day_color = COLOR_PALETTE[i % len(COLOR_PALETTE)]
+
+            # 1. FT 價格線
+            if opts.ft_col in sub.columns:
+                fig.add_trace(go.Scatter(
+                    x=sub[opts.time_col], y=sub[f'{opts.ft_col}_mapped'],
+                    mode="lines",
+                    # FT 線徑 1.0
+                    line=dict(color=day_color, width=1.0),
+                    name='FT價格',
+                    legendgroup='FT_Group',
+                    showlegend=is_first_day,
+                    hoverinfo='skip',
+                ))
+
+            # 2. 價平和線
+            if kph_cols_valid:
+                kcol = kph_cols_valid[0]
+                fig.add_trace(go.Scatter(
+                    x=sub[opts.time_col], y=sub[f'{kcol}_mapped'],
+                    mode="lines",
+                    # 價平和線徑 0.8
+                    line=dict(color=day_color, width=0.8, dash="dot"),
+                    name=kcol,
+                    legendgroup='KPH_Group',
+                    showlegend=is_first_day,
+                    hoverinfo='skip',
+                ))
+
+        # ------------------- 統一 Hover 追蹤 (Invisible Trace) -------------------
+
+        # 新增一個完全透明的追蹤，它負責提供所有統一的 Hover 資訊
+        fig.add_trace(go.Scatter(
+            x=dff[opts.time_col],
+            y=dff[f'{opts.ft_col}_mapped'],
+            mode='lines',
+            line=dict(width=0, color='rgba(0,0,0,0)'),
+            name='統一查價線',
+            showlegend=False,
+            hoverinfo='text',
+            hovertemplate='%{text}<extra></extra>',
+            text=dff['unified_hover'],
+        ))
 
     # ------------------- 軸線和佈局設定 -------------------
 
@@ -255,7 +363,7 @@ def make_trend(df: pd.DataFrame, opts: TrendOptions) -> go.Figure:
 
     # 調整 Hover Label 樣式，並設定 Hovermode
     fig.update_layout(
-        title=f"趨勢圖：從 {opts.start_date} 起連續 {len(unique_dates)} 個交易日",
+        title=f"趨勢圖：從 {opts.start_date} 起連續 {opts.days or len(unique_dates)} 個交易日",
         height=700,
         hovermode="x",
         hoverlabel=dict(
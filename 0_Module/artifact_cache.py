@@ -0,0 +1,117 @@
+# 檔案：artifact_cache.py (衍生產物快取：以小型 token 為鍵)
+"""整理後的交易時段資料、正規化序列、趨勢圖等衍生產物的行程內快取。
+
+st.cache_data 以函式參數計算快取鍵，參數含整個 DataFrame / 特徵矩陣時每次呼叫都要先雜湊全部資料；
+這裡改以 ArtifactToken (種類, 後端, 資料表, mode, 起迄, 欄位, 參數) 為鍵、資料版本 (data_version) 為版本，
+查詢成本與資料量無關，也不複製輸入。產物放在獨立的 ResultCache (上限 ATM_ARTIFACT_CACHE_MB，預設 128 MB)，
+只涵蓋歷史曆日的產物永不失效，涵蓋最新一天的產物在該 mode 有新資料時失效；無法取得版本時不快取。
+
+    token = artifact_token("trend_figure", TABLE, DATE_COL, mode, start, end, columns, params=(max_points,))
+    fig = ARTIFACT_CACHE.get_or_build(token, lambda: make_trend(rows_df, opts))
+
+每一種產物分別記錄命中 / 未命中、建構耗時，以及命中時省下的時間 (該產物的建構耗時 − 查詢耗時)。
+"""
+import os
+import threading
+import time
+from dataclasses import dataclass, field
+from typing import Any, Callable, Dict, Sequence, Tuple
+
+import perf_trace
+from data_version import get_data_version
+from query_builder import normalize_mode
+from repository import get_repository
+from result_cache import ResultCache
+
+__all__ = ["ArtifactToken", "ArtifactStats", "ArtifactCache", "artifact_token", "ARTIFACT_CACHE"]
+
+
+@dataclass(frozen=True)
+class ArtifactToken:
+    kind: str                      # 產物種類，例如 "seamless" / "window_series" / "trend_figure"
+    backend: str
+    table: str
+    mode: str                      # normalize_mode 之後
+    start: str                     # 日期或時間戳記範圍
+    end: str
+    columns: Tuple[str, ...] = ()
+    params: Tuple[Any, ...] = ()   # 其他影響結果的參數 (需可雜湊)
+    watermark: Any = field(default=None, compare=False)
+
+    @property
+    def key(self) -> tuple:
+        """快取鍵 (不含水位；水位作為版本另外比對)"""
+        return (self.kind, self.backend, self.table, self.mode, self.start, self.end, self.columns, self.params)
+
+
+def artifact_token(kind: str, table: str, date_col: str, mode, start, end, columns: Sequence[str] = (), params: Sequence[Any] = (),
+                   watermark: Any = None) -> ArtifactToken:
+    """建立 token；watermark 未指定時為涵蓋到 end 的資料版本 (DataVersion.for_range，無法取得時為 None，不快取)"""
+    repo = get_repository(table, date_col)
+    if watermark is None: watermark = get_data_version(repo).for_range(end, mode)
+    return ArtifactToken(kind, repo.name, table, normalize_mode(mode), str(start), str(end), tuple(columns), tuple(params), watermark)
+
+
+@dataclass
+class ArtifactStats:
+    hits: int = 0
+    misses: int = 0
+    build_seconds: float = 0.0     # 未命中時建構產物的總耗時
+    lookup_seconds: float = 0.0    # 命中時查詢快取的總耗時
+    saved_seconds: float = 0.0     # 命中時省下的時間 (建構耗時 − 查詢耗時)
+
+    @property
+    def hit_rate(self) -> float:
+        total = self.hits + self.misses
+        return self.hits / total if total else 0.0
+
+    def merge(self, other: "ArtifactStats") -> "ArtifactStats":
+        return ArtifactStats(*(getattr(self, f) + getattr(other, f) for f in ("hits", "misses", "build_seconds", "lookup_seconds", "saved_seconds")))
+
+
+class ArtifactCache:
+    def __init__(self, max_bytes: int):
+        self._cache = ResultCache(max_bytes)
+        self._lock = threading.Lock()
+        self._stats: Dict[str, ArtifactStats] = {}
+
+    def get_or_build(self, token: ArtifactToken, build: Callable[[], Any]) -> Any:
+        """命中時直接回傳快取的產物 (呼叫端不可修改)；否則呼叫 build() 並以 token 存入"""
+        with perf_trace.span(f"artifact:{token.kind}") as sp:
+            started = time.perf_counter()
+            entry = self._cache.get(token.key, token.watermark) if token.watermark is not None else None
+            lookup = time.perf_counter() - started
+            if entry is not None:
+                value, build_seconds = entry
+                sp.cache = "hit"
+                self._record(token.kind, hits=1, lookup_seconds=lookup, saved_seconds=max(build_seconds - lookup, 0.0))
+                return value
+            sp.cache = "miss"
+            started = time.perf_counter()
+            value = build()
+            build_seconds = time.perf_counter() - started
+            if token.watermark is not None: self._cache.put(token.key, token.watermark, (value, build_seconds))
+            self._record(token.kind, misses=1, build_seconds=build_seconds)
+            return value
+
+    def stats(self) -> Dict[str, ArtifactStats]:
+        """各產物種類的統計"""
+        with self._lock:
+            return {kind: ArtifactStats(**s.__dict__) for kind, s in self._stats.items()}
+
+    def total(self) -> ArtifactStats:
+        total = ArtifactStats()
+        for s in self.stats().values(): total = total.merge(s)
+        return total
+
+    def clear(self):
+        self._cache.clear()
+        with self._lock: self._stats.clear()
+
+    def _record(self, kind: str, **delta):
+        with self._lock:
+            s = self._stats.setdefault(kind, ArtifactStats())
+            for name, value in delta.items(): setattr(s, name, getattr(s, name) + value)
+
+
+ARTIFACT_CACHE = ArtifactCache(int(float(os.environ.get("ATM_ARTIFACT_CACHE_MB", "128")) * 1024 * 1024))
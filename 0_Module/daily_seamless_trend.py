@@ -4,9 +4,13 @@ import pandas as pd
 import numpy as np
 import plotly.graph_objs as go
 import streamlit as st
-from typing import List
+from typing import List, Optional
 from datetime import time, timedelta
 
+from artifact_cache import ARTIFACT_CACHE, ArtifactToken
+from downsample import downsample_trend_frame
+from repository import get_repository, _parse_timestamps
+
 # --- 設定與常量 ---
 TABLE   = "atm"
 DATE_COL= "時間戳記"
@@ -19,171 +23,179 @@ TARGET_END_TIME_DAY = time(13, 46)
 
 # --- 1. 數據獲取與清理 ---
 
-def _fetch_intraday_data(table, date_col, mode, date_list: List[str]) -> pd.DataFrame:
-    """【雲端版 v2】獲取特定日期列表的分時數據 (修正 IN clause 語法)"""
-    if not date_list:
-        return pd.DataFrame()
+PRICE_COLS = [FT_COL, KPH_COL, "FT漲跌", "價平和漲跌(價平)"]
+_INT32_MAX = np.iinfo(np.int32).max
+
 
-    conn = st.connection("mysql", type="sql")
+def _compact_numeric(values: pd.Series) -> pd.Series:
+    """價格欄位：全為整數且無缺值時轉 int32，否則 float32 (顯示時只取到整數位)"""
+    num = pd.to_numeric(values, errors="coerce")
+    arr = num.to_numpy(dtype=np.float64)
+    if len(arr) and np.isfinite(arr).all() and (arr == np.round(arr)).all() and np.abs(arr).max() <= _INT32_MAX:
+        return num.astype(np.int32)
+    return num.astype(np.float32)
 
-    # --- 【核心修正】---
-    # 1. 產生與 date_list 長度相符的參數佔位符，例如 ( :date_0, :date_1, ... )
-    date_placeholders = ", ".join([f":date_{i}" for i in range(len(date_list))])
 
-    # 2. 準備 SQL 查詢，將佔位符直接放入 SQL 字串
-    sql_query = f"""
-        SELECT *
-        FROM `{table}`
-        WHERE LOWER(TRIM(mode)) = LOWER(TRIM(:mode))
-          AND DATE(`{date_col}`) IN ( {date_placeholders} )
-        ORDER BY `{date_col}`
+def _compact_intraday(rows_df: pd.DataFrame, date_col: str) -> pd.DataFrame:
+    """分時資料轉型：dt (與 date_col) 為 datetime64、價格為 int32 / float32、mode 為 category；去除無效列並依 dt 排序。
+    不修改 rows_df (repository 的查詢結果可能由快取共用)"""
+    dt = _parse_timestamps(rows_df[date_col])
+    rows_df = rows_df.assign(**{date_col: dt, "dt": dt})
+    rows_df = rows_df.dropna(subset=["dt", FT_COL]).sort_values("dt", kind="stable").reset_index(drop=True)
+    for c in PRICE_COLS:
+        if c in rows_df.columns:
+            rows_df[c] = _compact_numeric(rows_df[c])
+    if "mode" in rows_df.columns:
+        rows_df["mode"] = rows_df["mode"].astype("category")
+    return rows_df
+
+
+def _fetch_intraday_data(table, date_col, mode, date_list: List[str], columns: Optional[List[str]] = None) -> pd.DataFrame:
+    """獲取特定日期列表的分時數據 (經 repository，依設定的後端讀取)。
+
+    只取回 columns 指定的欄位 (預設為時間戳記與 FT價格)，轉型規則見 _compact_intraday。
     """
-    
-    # 3. 建立參數字典，包含 mode 和所有 date_list 裡的值
-    params = {"mode": mode}
-    for i, date_val in enumerate(date_list):
-        params[f"date_{i}"] = date_val
-    # --- 【修正結束】---
+    if not date_list:
+        return pd.DataFrame()
 
-    rows_df = conn.query(sql_query, params=params, ttl=600)
+    rows_df = get_repository(table, date_col).fetch_intraday(mode, dates=list(date_list), columns=list(columns or [FT_COL]))
 
     if rows_df.empty:
         return rows_df
+    return _compact_intraday(rows_df, date_col)
 
-    rows_df["dt"] = pd.to_datetime(rows_df[DATE_COL], errors="coerce")
-    for c in [FT_COL, KPH_COL, "FT漲跌", "價平和漲跌(價平)"]:
-        if c in rows_df.columns:
-            rows_df[c] = pd.to_numeric(rows_df[c], errors="coerce")
-    rows_df = rows_df.dropna(subset=["dt", FT_COL]).sort_values("dt").reset_index(drop=True)
-    return rows_df
 
+def _fetch_intraday_range(table, date_col, mode, start_date: str, end_date: str,
+                          start_time: time = time(0, 0), end_time: time = time(23, 59, 59),
+                          columns: Optional[List[str]] = None) -> pd.DataFrame:
+    """以時間戳記範圍條件取回 [start_date, end_date] 每日 start_time ~ end_time 的分時數據。
 
-@st.cache_data
-def _get_all_unique_dates(table, date_col, mode):
-    """【雲端版】從數據庫獲取所有不重複的交易日"""
-    conn = st.connection("mysql", type="sql")
-    sql = f"""
-        SELECT DISTINCT DATE(`{date_col}`) AS d
-        FROM `{table}`
-        WHERE LOWER(TRIM(mode)) = LOWER(TRIM(:mode))
-        ORDER BY d
+    只取回 columns 指定的欄位 (預設為時間戳記與 FT價格)。回傳依 dt 排序、已轉型的單一 DataFrame。
     """
-    df = conn.query(sql, params={'mode': mode}, ttl=3600)
-    # 確保返回的是字串格式 'YYYY-MM-DD'
-    return df['d'].dt.strftime('%Y-%m-%d').tolist() if not df.empty else []
+    start_ts, end_ts = pd.to_datetime(start_date, errors="coerce"), pd.to_datetime(end_date, errors="coerce")
+    if pd.isna(start_ts) or pd.isna(end_ts) or start_ts > end_ts:
+        return pd.DataFrame()
+    rows_df = get_repository(table, date_col).fetch_intraday(
+        mode, start_date=start_ts.strftime("%Y-%m-%d"), end_date=end_ts.strftime("%Y-%m-%d"),
+        start_time=start_time, end_time=end_time, columns=list(columns or [FT_COL]))
+    if rows_df.empty:
+        return pd.DataFrame()
+    return _compact_intraday(rows_df, date_col)
+
+
+def _fetch_intraday_between(table, date_col, mode, start_ts: str, end_ts: str, columns: Optional[List[str]] = None) -> pd.DataFrame:
+    """以單一連續時間戳記範圍 [start_ts, end_ts) 取回分時數據 (例如 TradingCalendar.session_bounds 的 N 個交易日)。
+
+    只取回 columns 指定的欄位 (預設為時間戳記與 FT價格)，轉型規則見 _compact_intraday。
+    """
+    rows_df = get_repository(table, date_col).fetch_between(mode, start_ts, end_ts, columns=list(columns or [FT_COL]))
+    if rows_df.empty:
+        return pd.DataFrame()
+    return _compact_intraday(rows_df, date_col)
+
+
+@st.cache_data(max_entries=16)
+def _get_all_unique_dates(table, date_col, mode, watermark=None, session_start: Optional[time] = None):
+    """獲取所有不重複的交易日 ('YYYY-MM-DD')；watermark (data_version.version_for 的資料版本) 只作為快取鍵，
+    版本改變時重新查詢。session_start 見 Repository.unique_dates"""
+    return get_repository(table, date_col).unique_dates(mode, session_start=session_start)
 
 
 # --- 2. 核心：數據縫合與斷層處理 ---
 
-@st.cache_data
-def _prepare_seamless_data(df: pd.DataFrame, start_date_str: str, end_date_str: str) -> pd.DataFrame:
+def _insert_gap_rows(dff: pd.DataFrame, nan_cols: List[str], max_gap_sec: int) -> pd.DataFrame:
+    """以 diff 偵測超過 max_gap_sec 的斷層，在斷層前插入一筆 NaN 列 (複製前一列、dt + 1 分鐘)，並重編 x_sequence"""
+    dt = dff['dt']
+    is_gap = (dt.diff().dt.total_seconds() > max_gap_sec).to_numpy()
+    x_seq = np.arange(len(dff)) + np.cumsum(is_gap)
+    dff = dff.assign(x_sequence=x_seq)
+    if not is_gap.any():
+        return dff
+    gap_pos = np.flatnonzero(is_gap)
+    gap_rows = dff.iloc[gap_pos - 1].copy()
+    gap_rows[nan_cols] = np.nan
+    gap_rows['dt'] = dt.iloc[gap_pos - 1].to_numpy() + np.timedelta64(1, 'm')
+    gap_rows['x_sequence'] = x_seq[gap_pos] - 1
+    return pd.concat([dff, gap_rows]).sort_values('x_sequence', kind='stable').reset_index(drop=True)
+
+
+def _prepare_seamless_data(df: pd.DataFrame, start_date_str: str, end_date_str: str, token: Optional[ArtifactToken] = None) -> pd.DataFrame:
+    """夜盤 (start_date 15:00 ~ end_date 05:01) 的連續 x 軸資料；不修改 df。
+    token (artifact_cache) 指定時以 token 為快取鍵，不雜湊 df"""
+    if token is not None:
+        return ARTIFACT_CACHE.get_or_build(token, lambda: _prepare_seamless_data(df, start_date_str, end_date_str))
     if df.empty: return df
     MAX_TRADING_GAP_SEC = 10 * 60
-    df['dt_date'] = df['dt'].dt.strftime('%Y-%m-%d')
-    df['dt_time'] = df['dt'].dt.time
-    start_date = start_date_str
-    end_date = end_date_str
-    cond1 = (df['dt_date'] == start_date) & (df['dt_time'] >= time(15, 0))
-    cond2 = (df['dt_date'] == end_date) & (df['dt_time'] < T_PLUS_1_CUTOFF)
-    dff = df[cond1 | cond2].copy()
+    dt_date = df['dt'].dt.strftime('%Y-%m-%d')
+    dt_time = df['dt'].dt.time
+    mask = ((dt_date == start_date_str) & (dt_time >= time(15, 0))) | ((dt_date == end_date_str) & (dt_time < T_PLUS_1_CUTOFF))
+    # 先切片再以同一遮罩取欄位：空結果時 assign 整欄 Series 會改用 Series 的索引 (變成全部列)
+    dff = df[mask].assign(dt_date=dt_date[mask], dt_time=dt_time[mask])
     if dff.empty: return dff
     dff['x_sequence'] = dff.index
     dff = dff.sort_values('dt').reset_index(drop=True)
-    new_data_list = []
-    x_counter = 0
-    for i in range(len(dff)):
-        current_row = dff.iloc[i].copy()
-        current_dt = current_row['dt']
-        if i > 0:
-            prev_dt = dff.iloc[i-1]['dt']
-            time_diff = (current_dt - prev_dt).total_seconds()
-            if time_diff > MAX_TRADING_GAP_SEC:
-                nan_row = dff.iloc[i-1].copy()
-                nan_row[[FT_COL, KPH_COL]] = np.nan
-                nan_row['dt'] = prev_dt + timedelta(minutes=1)
-                nan_row['x_sequence'] = x_counter
-                new_data_list.append(nan_row)
-                x_counter += 1
-        current_row['x_sequence'] = x_counter
-        new_data_list.append(current_row)
-        x_counter += 1
-    final_df = pd.DataFrame(new_data_list).reset_index(drop=True)
-    return final_df
-
-
-@st.cache_data
-def _prepare_day_session_data(df: pd.DataFrame) -> pd.DataFrame:
+    return _insert_gap_rows(dff, [FT_COL, KPH_COL], MAX_TRADING_GAP_SEC)
+
+
+def _prepare_day_session_data(df: pd.DataFrame, token: Optional[ArtifactToken] = None) -> pd.DataFrame:
+    """日盤 (08:45 ~ 13:46) 的連續 x 軸資料；不修改 df。token 的用法同 _prepare_seamless_data"""
+    if token is not None:
+        return ARTIFACT_CACHE.get_or_build(token, lambda: _prepare_day_session_data(df))
     if df.empty: return df
     MAX_TRADING_GAP_SEC = 10 * 60
-    df['dt_date'] = df['dt'].dt.strftime('%Y-%m-%d')
-    df['dt_time'] = df['dt'].dt.time
-    is_time_range = (df['dt_time'] >= time(8, 45)) & (df['dt_time'] <= TARGET_END_TIME_DAY)
-    dff = df[is_time_range].copy()
+    dt_time = df['dt'].dt.time
+    is_time_range = (dt_time >= time(8, 45)) & (dt_time <= TARGET_END_TIME_DAY)
+    dff = df[is_time_range]
+    dff = dff.assign(dt_date=dff['dt'].dt.strftime('%Y-%m-%d'), dt_time=dt_time[is_time_range])
     if dff.empty: return dff
     dff['x_sequence'] = np.arange(len(dff))
     dff = dff.sort_values('dt').reset_index(drop=True)
-    new_data_list = []
-    x_counter = 0
-    for i in range(len(dff)):
-        current_row = dff.iloc[i].copy()
-        current_dt = current_row['dt']
-        if i > 0:
-            prev_dt = dff.iloc[i-1]['dt']
-            time_diff = (current_dt - prev_dt).total_seconds()
-            if time_diff > MAX_TRADING_GAP_SEC:
-                nan_row = dff.iloc[i-1].copy()
-                nan_row[FT_COL] = np.nan
-                nan_row['dt'] = prev_dt + timedelta(minutes=1)
-                nan_row['x_sequence'] = x_counter
-                new_data_list.append(nan_row)
-                x_counter += 1
-        current_row['x_sequence'] = x_counter
-        new_data_list.append(current_row)
-        x_counter += 1
-    final_df = pd.DataFrame(new_data_list).reset_index(drop=True)
-    return final_df
+    return _insert_gap_rows(dff, [FT_COL], MAX_TRADING_GAP_SEC)
 
 
 # --- 3. 繪圖核心 ---
 
-def make_seamless_daily_trend(df: pd.DataFrame, y_range: List[float], y_ticks: List[float], session_type: str) -> go.Figure:
+def make_seamless_daily_trend(df: pd.DataFrame, y_range: List[float], y_ticks: List[float], session_type: str,
+                              max_points: Optional[int] = None) -> go.Figure:
     if df.empty:
         return go.Figure().update_layout(title="無數據")
     x_col = 'x_sequence'
     is_night_session = (session_type == "Night")
     fig = go.Figure()
     line_color = '#FF8C00' if is_night_session else '#1E90FF'
+    # 只對線條降採樣 (保留每日高低點與斷層 NaN 列)，刻度仍以完整資料計算
+    plot_df = downsample_trend_frame(df, 'dt', [FT_COL], max_points, x_col=x_col)
     fig.add_trace(go.Scatter(
-        x=df[x_col],
-        y=df[FT_COL],
+        x=plot_df[x_col],
+        y=plot_df[FT_COL],
         mode='lines',
         name='台指期價格',
         line=dict(color=line_color, width=1.0),
         connectgaps=False,
-        customdata=[d.strftime("%Y-%m-%d %H:%M") for d in df['dt']],
+        customdata=plot_df['dt'].dt.strftime("%Y-%m-%d %H:%M").tolist(),
         hovertemplate='日期時間: %{customdata}<br>價格: %{y:,.0f}<extra></extra>'
     ))
-    df['dt_date'] = df['dt'].dt.date
-    df['dt_time'] = df['dt'].dt.time
-    unique_dates = sorted(df['dt_date'].unique())
+    # 依 dt 排序後以 searchsorted 一次定位每個刻度時間之後的第一筆
+    ordered = df.sort_values('dt')
+    dt_values = ordered['dt'].to_numpy()
+    x_values = ordered[x_col].to_numpy()
+    day_values = dt_values.astype('datetime64[D]')
+    unique_dates = np.unique(day_values)
     target_times_str = ['16:00', '18:00', '20:00', '22:00', '00:00', '02:00', '04:00'] if is_night_session else ['09:00', '11:00', '13:00']
     tick_indices = []
     tick_labels = []
     for t_str in target_times_str:
         h, m = map(int, t_str.split(':'))
-        target_time_obj = time(h, m)
         if h >= 15:
             target_date = unique_dates[0]
         elif len(unique_dates) > 1:
             target_date = unique_dates[1]
         else:
             target_date = unique_dates[0]
-        is_target_date = (df['dt_date'] == target_date)
-        is_target_time_or_after = (df['dt_time'] >= target_time_obj)
-        valid_points = df[is_target_date & is_target_time_or_after].sort_values('dt')
-        if not valid_points.empty:
-            x_val = valid_points['x_sequence'].iloc[0]
-            dt_val = valid_points['dt'].iloc[0]
+        pos = np.searchsorted(dt_values, target_date + np.timedelta64(h * 60 + m, 'm'), side='left')
+        if pos < len(dt_values) and day_values[pos] == target_date:
+            x_val = x_values[pos]
+            dt_val = pd.Timestamp(dt_values[pos])
             if x_val not in tick_indices:
                 tick_indices.append(x_val)
                 date_part = dt_val.strftime("%Y-%m-%d")
@@ -0,0 +1,182 @@
+# 檔案：daily_summary.py (每日彙總表：收盤價 / 夜盤收盤 / 區間漲跌極值)
+"""在資料庫中維護 `{table}_daily_summary`，每個 (mode, 交易日) 一列，預先算好
+render_output 大型 CTE 每次都要重算的欄位：
+
+    d, last_ts                      曆日與當日最後一筆時間戳記 (增量更新的水位)
+    day_close_ts / ft_day_close ... 日盤收盤 (TIME <= 13:44:59 的最後一筆)
+    night_close_ts / ft_night_close ...
+                                    夜盤收盤 (當日 15:00 後至次一曆日 05:00 前的最後一筆)
+    night_eve_close_ts / ft_night_eve_close ...
+                                    只看當日 15:00 後的夜盤收盤；原查詢的資料範圍截止於 end_date 當天，
+                                    因此 end_date 那一天的夜盤收盤要用這組欄位才會與原結果一致
+    MaxUp / MaxDown / KphMaxUp / KphMaxDown
+                                    當日 FT漲跌 / 價平和漲跌(價平) 的最大正值 / 最小負值 (無則 0)
+
+收盤相關欄位直接沿用原始資料表的欄位型別 (由 information_schema 讀取)，查詢結果的型別與原 CTE 相同。
+彙總表由寫入端 (ingest.py) 維護：ensure_summary_table() 建表，新資料寫入後呼叫 refresh_daily_summary()，
+只重算最後一個已彙總日的前一天起的資料 (前一天的夜盤會延續到次一曆日凌晨)；補寫歷史資料時以 from_day
+指定最早寫入的曆日。查詢端只以 summary_watermark() 比對水位，不執行 DDL 或重算。
+"""
+import threading
+from datetime import timedelta
+from typing import Dict, List, Optional
+
+import pandas as pd
+import streamlit as st
+from sqlalchemy import text
+
+import perf_trace
+import query_builder
+
+__all__ = ["summary_table_name", "ensure_summary_table", "refresh_daily_summary", "summary_watermark", "build_summary_query"]
+
+_LOCK = threading.Lock()
+# 收盤欄位沿用的原始欄位
+_CLOSE_SOURCES = [("ft", "FT價格"), ("ft_chg", "FT漲跌"), ("kph", "價平和(價平)")]
+_SESSIONS = ["day", "night", "night_eve"]
+
+
+def summary_table_name(table: str) -> str:
+    return f"{table}_daily_summary"
+
+
+def _close_cols(session: str) -> List[str]:
+    """某一盤別的收盤欄位名稱 (時間戳記, FT價格, FT漲跌, 價平和)"""
+    return [f"{session}_close_ts", f"ft_{session}_close", f"ft_{session}_chg", f"kph_{session}_close"]
+
+
+# --- 1. 建表 ---
+
+def _source_column_types(session, table: str) -> Dict[str, str]:
+    rows = session.execute(text("""
+        SELECT COLUMN_NAME, COLUMN_TYPE FROM information_schema.COLUMNS
+        WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = :table
+    """), {"table": table}).fetchall()
+    return {name: col_type for name, col_type in rows}
+
+
+def ensure_summary_table(conn, table: str = "atm", date_col: str = "時間戳記"):
+    """建立彙總表 (已存在時不變更)；需要 CREATE 權限，只由寫入端呼叫"""
+    with conn.session as s:
+        _create_table(s, table, date_col)
+        s.commit()
+
+
+def _create_table(session, table: str, date_col: str):
+    types = _source_column_types(session, table)
+    ts_type = types.get(date_col, "TEXT")
+    col_defs = ["`mode_key` VARCHAR(64) NOT NULL", "`d` DATE NOT NULL", f"`last_ts` {ts_type} NULL"]
+    for s in _SESSIONS:
+        ts_col, *value_cols = _close_cols(s)
+        col_defs.append(f"`{ts_col}` {ts_type} NULL")
+        col_defs += [f"`{c}` {types.get(src, 'TEXT')} NULL" for c, (_, src) in zip(value_cols, _CLOSE_SOURCES)]
+    col_defs += [f"`{c}` DECIMAL(10,2) NOT NULL DEFAULT 0.0" for c in ("MaxUp", "MaxDown", "KphMaxUp", "KphMaxDown")]
+    session.execute(text(f"""
+        CREATE TABLE IF NOT EXISTS `{summary_table_name(table)}` (
+            {", ".join(col_defs)},
+            PRIMARY KEY (`mode_key`, `d`)
+        )
+    """))
+
+
+# --- 2. 增量更新 ---
+
+def _refresh_sql(schema: query_builder.TableSchema) -> str:
+    """重算 ts >= :since 的所有曆日並寫入彙總表 (計算方式與 render_output 原 CTE 相同)"""
+    table, date_col = schema.table, schema.date_col
+    close_joins, close_selects = [], []
+    for i, (s, cte) in enumerate(zip(_SESSIONS, ["day_close", "night_close", "night_eve_close"])):
+        close_joins.append(f"LEFT JOIN {cte} c{i} ON c{i}.d = dd.d LEFT JOIN base b{i} ON b{i}.ts = c{i}.ts")
+        close_selects.append(f"c{i}.ts, b{i}.`FT價格`, b{i}.`FT漲跌`, b{i}.`價平和(價平)`")
+    insert_cols = ["mode_key", "d", "last_ts"] + [c for s in _SESSIONS for c in _close_cols(s)] + ["MaxUp", "MaxDown", "KphMaxUp", "KphMaxDown"]
+    # 同一時間戳記重複時原查詢會產生重複列；彙總表以主鍵保留一列
+    return f"""
+        INSERT IGNORE INTO `{summary_table_name(table)}` ({", ".join(f"`{c}`" for c in insert_cols)})
+        WITH base AS (
+            SELECT DATE(`{date_col}`) AS d, `{date_col}` AS ts, {schema.time_of_day()} AS tod, `FT價格`, `FT漲跌`, `價平和(價平)`,
+                   {schema.price("FT漲跌")} AS ft_chg, {schema.price("價平和漲跌(價平)")} AS kph_chg
+            FROM `{table}`
+            WHERE `{date_col}` >= :since AND {schema.mode_predicate()}
+        ), days AS (
+            SELECT d, MAX(ts) AS last_ts,
+            COALESCE(MAX(CASE WHEN ft_chg > 0 THEN ft_chg ELSE NULL END), 0.0) AS MaxUp, COALESCE(MIN(CASE WHEN ft_chg < 0 THEN ft_chg ELSE NULL END), 0.0) AS MaxDown,
+            COALESCE(MAX(CASE WHEN kph_chg > 0 THEN kph_chg ELSE NULL END), 0.0) AS KphMaxUp, COALESCE(MIN(CASE WHEN kph_chg < 0 THEN kph_chg ELSE NULL END), 0.0) AS KphMaxDown
+            FROM base GROUP BY d
+        ), day_close AS (SELECT d, MAX(ts) AS ts FROM base WHERE tod <= '13:44:59' GROUP BY d
+        ), night_close AS (
+            SELECT x.d, MAX(x.ts) AS ts FROM (
+                SELECT DATE(CASE WHEN tod < '05:00:00' THEN DATE_SUB(ts, INTERVAL 1 DAY) ELSE ts END) AS d, ts
+                FROM base WHERE tod >= '15:00:00' OR tod < '05:00:00'
+            ) x GROUP BY x.d
+        ), night_eve_close AS (SELECT d, MAX(ts) AS ts FROM base WHERE tod >= '15:00:00' GROUP BY d
+        )
+        SELECT :mode, dd.d, dd.last_ts, {", ".join(close_selects)}, dd.MaxUp, dd.MaxDown, dd.KphMaxUp, dd.KphMaxDown
+        FROM days dd {" ".join(close_joins)}
+    """
+
+
+@perf_trace.traced("mysql:refresh_daily_summary", kind="db")
+def refresh_daily_summary(table: str = "atm", date_col: str = "時間戳記", mode: str = "1344", conn=None,
+                          from_day: Optional[str] = None) -> bool:
+    """若原始表有比彙總表水位更新的資料，重算最後一個已彙總日的前一天起的所有曆日。回傳是否有更新。
+    彙總表需先以 ensure_summary_table 建立。
+
+    from_day ('YYYY-MM-DD') 指定時一律重算，且至少從 from_day 的前一天起 (例如 ingest 補寫了較早曆日的資料)。
+    """
+    conn = conn or st.connection("mysql", type="sql")
+    summary = summary_table_name(table)
+    schema = query_builder.table_schema(conn.engine, table, date_col)
+    mode = query_builder.normalize_mode(mode)
+    with _LOCK, conn.session as s:
+        wm, max_d = s.execute(text(f"SELECT MAX(last_ts), MAX(d) FROM `{summary}` WHERE mode_key = :mode"), {"mode": mode}).one()
+        # 只掃描水位之後的資料 (時間戳記索引可用)
+        src_max = s.execute(text(f"""
+            SELECT MAX(`{date_col}`) FROM `{table}`
+            WHERE `{date_col}` >= :wm AND {schema.mode_predicate()}
+        """), {"wm": wm if wm is not None else "", "mode": mode}).scalar()
+        if from_day is None and (src_max is None or (wm is not None and str(src_max) <= str(wm))):
+            return False
+        since = "" if max_d is None else str(max_d - timedelta(days=1))
+        if from_day is not None and since:
+            since = min(since, str(pd.Timestamp(from_day).date() - timedelta(days=1)))
+        s.execute(text(f"DELETE FROM `{summary}` WHERE mode_key = :mode AND d >= :since"), {"mode": mode, "since": since or "0001-01-01"})
+        s.execute(text(_refresh_sql(schema)), {"mode": mode, "since": since})
+        s.commit()
+    return True
+
+
+# --- 3. 查詢 ---
+
+@perf_trace.traced("mysql:summary_watermark", kind="db")
+def summary_watermark(conn, table: str = "atm", mode: str = "1344") -> Optional[str]:
+    """彙總表中 mode 最後一個曆日的 last_ts (以主鍵取一列)；尚未彙總時為 None，彙總表不存在時拋出例外"""
+    with conn.session as s:
+        value = s.execute(text(f"SELECT last_ts FROM `{summary_table_name(table)}` WHERE mode_key = :mode ORDER BY d DESC LIMIT 1"),
+                          {"mode": query_builder.normalize_mode(mode)}).scalar()
+    return None if value is None else str(value)
+
+
+def build_summary_query(table: str, wk_sql: str, target_filter_sql: str = "1=1", kph_filter_sql: str = "1=1") -> str:
+    """由彙總表產生與 render_output 原 CTE 相同欄位 / 排序的查詢；參數 :start_date, :end_date, :mode"""
+    summary = summary_table_name(table)
+
+    def night(alias: str, col: str) -> str:
+        return f"CASE WHEN {alias}.d = :end_date THEN {alias}.`{col.replace('night', 'night_eve')}` ELSE {alias}.`{col}` END"
+
+    return f"""
+        WITH s AS (
+            SELECT x.*, LEAD(x.d, 1) OVER (ORDER BY x.d) AS d_next_trade
+            FROM `{summary}` x
+            WHERE x.mode_key = LOWER(TRIM(:mode)) AND x.d >= :start_date AND x.d <= :end_date
+        ), t AS (SELECT * FROM s WHERE day_close_ts IS NOT NULL AND ({target_filter_sql}) AND ({kph_filter_sql})
+        )
+        SELECT
+            t.d AS 日期,
+            CASE DAYOFWEEK(t.d) WHEN 1 THEN '日' WHEN 2 THEN '一' WHEN 3 THEN '二' WHEN 4 THEN '三' WHEN 5 THEN '四' WHEN 6 THEN '五' WHEN 7 THEN '六' END AS 星期,
+            t.ft_day_close AS `FT日盤收盤`, t.ft_day_chg AS `FT漲跌(日盤)`, {night('t', 'ft_night_close')} AS `FT夜盤收盤`, {night('t', 'ft_night_chg')} AS `FT漲跌(夜盤)`,
+            t.kph_day_close AS `日盤收盤的價平和(價平)`, {night('t', 'kph_night_close')} AS `夜盤收盤的價平和(價平)`,
+            n.ft_day_close AS `FT次交易日日盤收盤`, n.ft_day_chg AS `FT次交易日(FT漲跌-日盤)`, {night('n', 'ft_night_close')} AS `FT次交易日夜盤收盤`, {night('n', 'ft_night_chg')} AS `FT次交易日(FT漲跌-夜盤)`,
+            n.kph_day_close AS `次交易日日盤收盤的價平和(價平)`, {night('n', 'kph_night_close')} AS `次交易日夜盤收盤的價平和(價平)`
+        FROM t LEFT JOIN s n ON n.d = t.d_next_trade
+        WHERE DAYOFWEEK(t.d) IN ({wk_sql}) ORDER BY t.d DESC;
+    """
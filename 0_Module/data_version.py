@@ -0,0 +1,102 @@
+# 檔案：data_version.py (資料版本服務：取代固定 TTL 的快取失效依據)
+"""低成本輪詢資料表的版本，讓快取依「涵蓋的資料是否還會變動」決定是否失效，不再使用固定 TTL：
+
+    DataVersion.watermark  MAX(時間戳記)
+    DataVersion.since      水位所在的曆日；分時資料只會往後追加，早於此日的曆日視為不再變動的歷史資料
+    DataVersion.tail       各 mode 在 since 之後的 (列數, 最大時間戳記)
+
+for_range(end, mode) 回傳快取版本：結果涵蓋的最後一個曆日早於 since 時為固定的 HISTORICAL (永不失效)，
+否則為該 mode 在最新曆日的 (列數, 水位)，只有最新一天的資料增加時才改變；end 為 None 代表涵蓋整個資料表。
+
+輪詢 (Repository.tail_stats) 只掃描 since 之後的資料 (時間戳記索引範圍)；同一後端 / 資料表在
+ATM_DATA_VERSION_POLL_SECONDS 秒 (預設 5) 內共用上一次的結果，輪詢失敗時沿用上一版。
+"""
+import os
+import threading
+import time
+from dataclasses import dataclass
+from typing import Dict, Hashable, Optional, Tuple
+
+import pandas as pd
+
+from query_builder import normalize_mode
+
+__all__ = ["DataVersion", "get_data_version", "version_for", "HISTORICAL", "POLL_SECONDS"]
+
+HISTORICAL = ("historical",)
+POLL_SECONDS = float(os.environ.get("ATM_DATA_VERSION_POLL_SECONDS", "5"))
+
+_LOCK = threading.Lock()
+_VERSIONS: Dict[tuple, Tuple[float, "DataVersion"]] = {}   # (後端, 資料表, 時間戳記欄位) → (輪詢時刻, 版本)
+
+
+@dataclass(frozen=True)
+class DataVersion:
+    watermark: Optional[str] = None
+    since: Optional[str] = None                                   # 'YYYY-MM-DD'
+    tail: Tuple[Tuple[Optional[str], int, Optional[str]], ...] = ()  # (mode, 列數, 最大時間戳記)；mode 為 None 代表後端只提供整表水位
+
+    def for_range(self, end=None, mode=None) -> Optional[Hashable]:
+        """涵蓋到 end (日期或時間戳記) 的結果的快取版本；無法取得版本時為 None (呼叫端不快取)"""
+        if self.watermark is None: return None
+        if end is not None and pd.Timestamp(end).strftime("%Y-%m-%d") < self.since: return HISTORICAL
+        if mode is None or all(m is None for m, _, _ in self.tail): return ("live", self.since, self.tail)
+        key = normalize_mode(mode)
+        return ("live", self.since) + next(((n, wm) for m, n, wm in self.tail if m == key), (0, None))
+
+    def mode_watermark(self, mode) -> Optional[str]:
+        """mode 的最大時間戳記；該 mode 在 since 之後沒有資料時為 None，後端只提供整表水位時為 watermark"""
+        if all(m is None for m, _, _ in self.tail): return self.watermark
+        key = normalize_mode(mode)
+        return next((wm for m, _, wm in self.tail if m == key), None)
+
+
+def _tail(repo, since: str) -> Tuple[Tuple[Optional[str], int, Optional[str]], ...]:
+    """各 mode (正規化後合併) 在 since 之後的列數與最大時間戳記"""
+    merged: Dict[Optional[str], Tuple[int, Optional[str]]] = {}
+    for mode, n, wm in repo.tail_stats(since)[["mode", "n", "wm"]].itertuples(index=False):
+        key = None if mode is None or pd.isna(mode) else normalize_mode(mode)
+        count, last = merged.get(key, (0, None))
+        wm = None if wm is None or pd.isna(wm) else str(wm)
+        merged[key] = (count + int(n or 0), max([v for v in (last, wm) if v], default=None))
+    return tuple(sorted(((m, n, wm) for m, (n, wm) in merged.items()), key=lambda t: str(t[0])))
+
+
+def _poll(repo, previous: Optional[DataVersion]) -> DataVersion:
+    since = previous.since if previous is not None else None
+    if since is None:
+        wm = repo.data_watermark()
+        if wm is None: return DataVersion()
+        since = str(wm)[:10]
+    tail = _tail(repo, since)
+    watermark = max((wm for _, _, wm in tail if wm), default=None)
+    if watermark is None:  # since 之後沒有資料 (例如資料被刪除)：從整表水位重新開始
+        return _poll(repo, None) if previous is not None else DataVersion()
+    if watermark[:10] != since:  # 已進入新的曆日：以新的一天重新計數
+        since = watermark[:10]
+        tail = _tail(repo, since)
+    return DataVersion(watermark, since, tail)
+
+
+def get_data_version(repo, max_age: Optional[float] = None) -> DataVersion:
+    """repo 目前的資料版本；距上次輪詢未滿 max_age 秒 (預設 POLL_SECONDS) 時直接沿用"""
+    key = (repo.name, repo.table, repo.date_col)
+    max_age = POLL_SECONDS if max_age is None else max_age
+    now = time.monotonic()
+    with _LOCK:
+        cached = _VERSIONS.get(key)
+    if cached is not None and now - cached[0] < max_age:
+        return cached[1]
+    try:
+        version = _poll(repo, cached[1] if cached is not None else None)
+    except Exception:
+        return cached[1] if cached is not None else DataVersion()
+    with _LOCK:
+        _VERSIONS[key] = (now, version)
+    return version
+
+
+def version_for(table: str, date_col: str, end=None, mode=None) -> Optional[Hashable]:
+    """get_repository(table, date_col) 目前的資料版本中，涵蓋到 end 的結果的快取版本 (見 DataVersion.for_range)"""
+    from repository import get_repository  # repository 本身也依賴本模組
+    return get_data_version(get_repository(table, date_col)).for_range(end, mode)
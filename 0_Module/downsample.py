@@ -0,0 +1,81 @@
+# 檔案：downsample.py (長區間趨勢圖降採樣)
+"""繪圖前的降採樣階段：以 Largest-Triangle-Three-Buckets (LTTB) 或每桶最高/最低點，
+把分時資料縮減到指定點數上限，同時保留每日最高/最低點、每日首尾點以及斷層用的 NaN 列。"""
+from typing import List, Optional
+
+import numpy as np
+import pandas as pd
+
+__all__ = ["lttb_indices", "minmax_indices", "downsample_trend_frame"]
+
+
+def lttb_indices(x: np.ndarray, y: np.ndarray, n_out: int) -> np.ndarray:
+    """Largest-Triangle-Three-Buckets：回傳保留點的索引 (含首尾)，x 需遞增且 y 不含 NaN"""
+    n = len(x)
+    if n_out >= n or n_out < 3: return np.arange(n)
+    x, y = np.asarray(x, dtype=np.float64), np.asarray(y, dtype=np.float64)
+    every = (n - 2) / (n_out - 2)
+    edges = (np.floor(np.arange(n_out - 1) * every) + 1).astype(np.int64)
+    edges[-1] = n - 1
+    edges = np.append(edges, n)  # 最後一個「下一桶」只含最後一點
+    idx = np.empty(n_out, dtype=np.int64)
+    idx[0], idx[-1] = 0, n - 1
+    a = 0
+    for i in range(n_out - 2):
+        lo, hi, nhi = edges[i], edges[i + 1], edges[i + 2]
+        avg_x, avg_y = x[hi:nhi].mean(), y[hi:nhi].mean()
+        area = np.abs((x[a] - avg_x) * (y[lo:hi] - y[a]) - (x[a] - x[lo:hi]) * (avg_y - y[a]))
+        a = lo + int(np.argmax(area))
+        idx[i + 1] = a
+    return idx
+
+
+def minmax_indices(y: np.ndarray, n_out: int) -> np.ndarray:
+    """每桶保留最高與最低點 (約 n_out 點)，y 不含 NaN"""
+    n = len(y)
+    if n_out >= n or n_out < 4: return np.arange(n)
+    y = np.asarray(y, dtype=np.float64)
+    n_buckets = n_out // 2
+    edges = np.linspace(0, n, n_buckets + 1).astype(np.int64)[:-1]
+    sizes = np.diff(np.append(edges, n))
+    bucket_of = np.repeat(np.arange(n_buckets), sizes)
+    order_max = np.lexsort((-y, bucket_of))  # 桶內由大到小
+    order_min = np.lexsort((y, bucket_of))
+    return np.unique(np.concatenate(([0, n - 1], order_max[edges], order_min[edges])))
+
+
+def downsample_trend_frame(df: pd.DataFrame, time_col: str, value_cols: List[str], max_points: Optional[int],
+                           x_col: Optional[str] = None, method: str = "lttb") -> pd.DataFrame:
+    """把 df 縮減到約 max_points 列 (max_points 為 None 或資料量未超過時原樣回傳)。
+
+    以 value_cols[0] 做 LTTB / min-max 取點，x 軸為 x_col (預設 time_col)；另外一律保留
+    每日 (依 time_col 分日) 各 value_cols 的最高/最低點、每日首尾列，以及 value_cols[0] 為 NaN 的斷層列。
+    """
+    if not max_points or len(df) <= max_points or df.empty: return df
+    x_col = x_col or time_col
+    main = pd.to_numeric(df[value_cols[0]], errors="coerce").to_numpy(dtype=np.float64)
+    finite = np.flatnonzero(~np.isnan(main))
+    x = df[x_col].to_numpy()
+    x = x.astype("datetime64[ns]").astype(np.int64) if np.issubdtype(x.dtype, np.datetime64) else x.astype(np.float64)
+    if method == "minmax":
+        picked = finite[minmax_indices(main[finite], max_points)]
+    else:
+        picked = finite[lttb_indices(x[finite], main[finite], max_points)]
+
+    keep = [picked, np.flatnonzero(np.isnan(main))]
+    day_codes, _ = pd.factorize(pd.to_datetime(df[time_col]).dt.normalize())
+    keep += _group_extreme_positions(np.arange(len(df), dtype=np.float64), day_codes)  # 每日首尾列
+    for col in value_cols:
+        if col in df.columns:
+            keep += _group_extreme_positions(pd.to_numeric(df[col], errors="coerce").to_numpy(dtype=np.float64), day_codes)
+    return df.iloc[np.unique(np.concatenate(keep))]
+
+
+def _group_extreme_positions(values: np.ndarray, group_codes: np.ndarray) -> List[np.ndarray]:
+    """每組最小值與最大值所在的位置 (忽略 NaN)"""
+    pos = np.flatnonzero(~np.isnan(values))
+    if len(pos) == 0: return []
+    order = np.lexsort((values[pos], group_codes[pos]))
+    codes = group_codes[pos][order]
+    change = codes[1:] != codes[:-1]
+    return [pos[order[np.r_[True, change]]], pos[order[np.r_[change, True]]]]
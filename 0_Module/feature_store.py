@@ -0,0 +1,213 @@
+# 檔案：feature_store.py (每日分鐘網格特徵矩陣)
+"""將每個交易日的 FT價格 重採樣到固定的每日 1440 分鐘網格 (以曆日 00:00 ~ 23:59 為準)，
+存成可記憶體映射的 .npy 檔：
+
+    prices.npy  float32 (天數 × 1440)，無資料的分鐘為 NaN
+    valid.npy   bool    (天數 × 1440)，該分鐘是否有資料
+    dates.npy   datetime64[D] (天數,)
+
+    version.json 最後一天的資料版本 (data_version.version_for)
+
+新交易日以原地追加的方式寫入 (numpy 檔頭預留了 shape 成長空間)；最後一天可能仍在累積資料，
+資料版本改變 (當天有新資料) 時重新抓取並覆寫。任意時間窗與正規化方法都可對全部天數一次向量化切片。
+"""
+import io
+import json
+import os
+import threading
+from dataclasses import dataclass
+from datetime import time
+from typing import List, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+
+from daily_seamless_trend import _fetch_intraday_range, FT_COL
+from data_version import version_for
+
+__all__ = ["FeatureMatrix", "build_minute_grid", "get_feature_matrix", "window_series", "day_frame"]
+
+MINUTES_PER_DAY = 24 * 60
+_ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+STORE_DIR = os.environ.get("ATM_FEATURE_STORE_DIR", os.path.join(_ROOT_DIR, "3_DB", "feature_store"))
+_LOCK = threading.Lock()
+
+
+@dataclass
+class FeatureMatrix:
+    dates: np.ndarray   # datetime64[D]，遞增
+    prices: np.ndarray  # float32 (天數 × 1440)
+    valid: np.ndarray   # bool (天數 × 1440)
+
+    @property
+    def day_strings(self) -> List[str]:
+        return np.datetime_as_string(self.dates, unit="D").tolist()
+
+
+def _store_path(table: str, mode: str) -> str:
+    return os.path.join(STORE_DIR, f"{table}_{str(mode).strip().lower()}")
+
+
+# --- 1. 網格建構 ---
+
+def build_minute_grid(rows_df: pd.DataFrame, ft_col: str = FT_COL) -> FeatureMatrix:
+    """把含 dt / ft_col 欄位的分時資料轉成分鐘網格；同一分鐘有多筆時取最後一筆"""
+    if rows_df.empty:
+        return FeatureMatrix(np.array([], dtype="datetime64[D]"), np.empty((0, MINUTES_PER_DAY), np.float32), np.empty((0, MINUTES_PER_DAY), bool))
+    dt = rows_df["dt"]
+    days = dt.dt.normalize().to_numpy().astype("datetime64[D]")
+    minutes = (dt.dt.hour * 60 + dt.dt.minute).to_numpy()
+    unique_days, day_idx = np.unique(days, return_inverse=True)
+    flat = day_idx * MINUTES_PER_DAY + minutes
+    values = rows_df[ft_col].to_numpy(dtype=np.float64)
+    keep = ~np.isnan(values)
+    flat, values = flat[keep], values[keep]
+    order = np.argsort(flat, kind="stable")
+    flat, values = flat[order], values[order]
+    last = np.r_[flat[1:] != flat[:-1], True]
+    prices = np.full(len(unique_days) * MINUTES_PER_DAY, np.nan, dtype=np.float32)
+    prices[flat[last]] = values[last]
+    prices = prices.reshape(len(unique_days), MINUTES_PER_DAY)
+    return FeatureMatrix(unique_days, prices, ~np.isnan(prices))
+
+
+# --- 2. 持久化 (記憶體映射 .npy，原地追加) ---
+
+def _append_npy(path: str, rows: np.ndarray):
+    """沿第 0 軸把 rows 追加到既有 .npy；檔頭無法原地改寫時退回整檔重寫"""
+    if not os.path.exists(path):
+        np.save(path, rows); return
+    with open(path, "r+b") as f:
+        version = np.lib.format.read_magic(f)
+        read_header, write_header = {(1, 0): (np.lib.format.read_array_header_1_0, np.lib.format.write_array_header_1_0),
+                                     (2, 0): (np.lib.format.read_array_header_2_0, np.lib.format.write_array_header_2_0)}.get(version, (None, None))
+        if read_header is None:
+            f.close(); np.save(path, np.concatenate([np.load(path), rows])); return
+        shape, fortran_order, dtype = read_header(f)
+        header_len = f.tell()
+        new_shape = (shape[0] + rows.shape[0],) + tuple(shape[1:])
+        buf = io.BytesIO()
+        write_header(buf, {"descr": np.lib.format.dtype_to_descr(dtype), "fortran_order": fortran_order, "shape": new_shape})
+        if len(buf.getvalue()) == header_len and not fortran_order and rows.shape[1:] == tuple(shape[1:]):
+            f.seek(0, os.SEEK_END)
+            f.write(np.ascontiguousarray(rows, dtype=dtype).tobytes())
+            f.seek(0)
+            f.write(buf.getvalue())
+            return
+    merged = np.concatenate([np.load(path), rows.astype(dtype)])
+    np.save(path, merged)
+
+
+def _load(path: str) -> Optional[FeatureMatrix]:
+    files = [os.path.join(path, n) for n in ("dates.npy", "prices.npy", "valid.npy")]
+    if not all(os.path.exists(f) for f in files):
+        return None
+    dates, prices, valid = (np.load(f, mmap_mode="r") for f in files)
+    n = min(len(dates), len(prices), len(valid))  # 追加中斷時以最短者為準
+    return FeatureMatrix(np.asarray(dates[:n]), prices[:n], valid[:n])
+
+
+def _write(path: str, existing: Optional[FeatureMatrix], fresh: FeatureMatrix):
+    """以 fresh 覆寫 existing 中重疊的日期 (只會是最後一天)，其餘追加在尾端"""
+    os.makedirs(path, exist_ok=True)
+    if existing is None or len(existing.dates) == 0:
+        for name, arr in (("prices", fresh.prices), ("valid", fresh.valid), ("dates", fresh.dates)):
+            np.save(os.path.join(path, f"{name}.npy"), arr)
+        return
+    overlap = fresh.dates <= existing.dates[-1]
+    if overlap.any():
+        rows = np.searchsorted(existing.dates, fresh.dates[overlap])
+        for name, arr in (("prices", fresh.prices[overlap]), ("valid", fresh.valid[overlap])):
+            mm = np.load(os.path.join(path, f"{name}.npy"), mmap_mode="r+")
+            mm[rows] = arr; mm.flush(); del mm
+    if (~overlap).any():
+        for name, arr in (("prices", fresh.prices[~overlap]), ("valid", fresh.valid[~overlap]), ("dates", fresh.dates[~overlap])):
+            _append_npy(os.path.join(path, f"{name}.npy"), arr)
+
+
+def _read_version(path: str) -> Optional[str]:
+    try:
+        with open(os.path.join(path, "version.json"), encoding="utf-8") as f: return f.read()
+    except OSError:
+        return None
+
+
+def _write_version(path: str, version: Optional[str]):
+    """版本檔在資料寫完之後才更新；無法取得版本時移除，下次一定重新抓取最後一天"""
+    file = os.path.join(path, "version.json")
+    if version is None:
+        if os.path.exists(file): os.remove(file)
+        return
+    with open(file + ".tmp", "w", encoding="utf-8") as f: f.write(version)
+    os.replace(file + ".tmp", file)
+
+
+# --- 3. 讀取與增量更新 ---
+
+def get_feature_matrix(table: str, date_col: str, mode: str, first_day: str, latest_day: str) -> FeatureMatrix:
+    """取得 (必要時先增量更新) 特徵矩陣；first_day / latest_day 為資料庫中最早 / 最新的交易日 'YYYY-MM-DD'。
+    已涵蓋 latest_day 且其資料版本與上次寫入時相同才直接回傳，否則重新抓取最後一天起的資料"""
+    path = _store_path(table, mode)
+    version = version_for(table, date_col, latest_day, mode)
+    version = None if version is None else json.dumps(version, default=str)
+    with _LOCK:
+        fm = _load(path)
+        latest = np.datetime64(latest_day, "D")
+        if fm is not None and len(fm.dates) and fm.dates[-1] >= latest and version is not None and version == _read_version(path):
+            return fm
+        # 從既有最後一天 (可能尚未收齊) 開始重新抓取並覆寫；首次建立時抓取全部歷史
+        since = np.datetime_as_string(fm.dates[-1], unit="D") if fm is not None and len(fm.dates) else first_day
+        rows_df = _fetch_intraday_range(table, date_col, mode, since, latest_day, time(0, 0), time(23, 59, 59), [FT_COL])
+        fresh = build_minute_grid(rows_df)
+        if len(fresh.dates):
+            if fm is not None and len(fm.dates):
+                # 既有範圍內新增的日期 (極少見的補檔) 無法原地插入，整份重建
+                gaps = (fresh.dates < fm.dates[-1]) & ~np.isin(fresh.dates, fm.dates)
+                if gaps.any():
+                    rows_df = _fetch_intraday_range(table, date_col, mode, first_day, latest_day, time(0, 0), time(23, 59, 59), [FT_COL])
+                    fm, fresh = None, build_minute_grid(rows_df)
+            _write(path, fm, fresh)
+        _write_version(path, version)
+        return _load(path) or fresh
+
+
+# --- 4. 向量化時間窗切片 ---
+
+def _minute_of(t: time) -> int:
+    return t.hour * 60 + t.minute
+
+
+def window_series(fm: FeatureMatrix, start_time: time, end_time: time, method: str) -> Tuple[List[np.ndarray], np.ndarray]:
+    """對所有交易日一次切出 [start_time, end_time] 的時間窗並正規化。
+
+    回傳 (每日正規化後的序列 (僅含有效分鐘), 每日有效分鐘數)。正規化規則：
+    "Relative Magnitude" 除以時間窗第一筆；"Pure Shape" 做 min-max，常數序列為全 0；有效分鐘少於 2 筆時為空序列。
+    """
+    lo, hi = _minute_of(start_time), _minute_of(end_time) + 1
+    vals = np.asarray(fm.prices[:, lo:hi], dtype=np.float64)
+    mask = np.asarray(fm.valid[:, lo:hi])
+    counts = mask.sum(axis=1)
+    has_data = counts >= 2
+    norm = np.full_like(vals, np.nan)
+    if has_data.any():
+        v = vals[has_data]
+        with np.errstate(invalid="ignore", divide="ignore"):
+            if method == "Relative Magnitude":
+                first = v[np.arange(len(v)), np.asarray(fm.valid[has_data, lo:hi]).argmax(axis=1)]
+                norm[has_data] = v / first[:, None]
+            elif method == "Pure Shape":
+                vmin, vmax = np.nanmin(v, axis=1), np.nanmax(v, axis=1)
+                span = vmax - vmin
+                norm[has_data] = np.where(span[:, None] == 0, np.where(np.isnan(v), np.nan, 0.0), (v - vmin[:, None]) / np.where(span == 0, 1, span)[:, None])
+    counts = np.where(has_data, counts, 0)
+    flat = norm[mask & has_data[:, None]]
+    return np.split(flat, np.cumsum(counts)[:-1]), counts
+
+
+def day_frame(fm: FeatureMatrix, day_index: int, start_time: time, end_time: time, ft_col: str = FT_COL) -> pd.DataFrame:
+    """由網格還原單日時間窗的 DataFrame (dt / ft_col)，供繪圖使用"""
+    lo, hi = _minute_of(start_time), _minute_of(end_time) + 1
+    mask = np.asarray(fm.valid[day_index, lo:hi])
+    minutes = np.arange(lo, hi)[mask]
+    dt = fm.dates[day_index].astype("datetime64[m]") + minutes.astype("timedelta64[m]")
+    return pd.DataFrame({"dt": pd.to_datetime(dt), ft_col: np.asarray(fm.prices[day_index, lo:hi], dtype=np.float64)[mask]})
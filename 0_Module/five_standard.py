@@ -3,6 +3,10 @@ import os, calendar
 import pandas as pd
 import streamlit as st
 
+import perf_trace
+from data_version import version_for
+from repository import get_repository
+
 __all__ = ["render"]
 __version__ = "v1.3.4-tight-gap-04"
 
@@ -11,27 +15,16 @@ def _set_weekdays(val: bool):
     for i in range(1,7):
         st.session_state[f"fs_w{i}"] = val
 
-@st.cache_data(show_spinner=False)
-def _get_date_bounds(table, date_col):
-    conn = st.connection("mysql", type="sql")
-    q = f'SELECT MIN(DATE(`{date_col}`)) AS min_d, MAX(DATE(`{date_col}`)) AS max_d FROM `{table}`'
-    s = conn.query(q, ttl=3600)
-    if s.empty: return "2020-01-01", "2025-12-31"
-    return str(s.at[0,"min_d"]), str(s.at[0,"max_d"])
+# version 為 data_version.version_for(table, date_col) 的資料版本，只作為快取鍵：有新資料時重新查詢
+@st.cache_data(show_spinner=False, max_entries=16)
+def _get_date_bounds(table, date_col, version=None):
+    min_d, max_d = get_repository(table, date_col).date_bounds()
+    if min_d is None: return "2020-01-01", "2025-12-31"
+    return min_d, max_d
 
-@st.cache_data(show_spinner=False)
-def _get_years(table, date_col):
-    conn = st.connection("mysql", type="sql")
-    q = f'SELECT DISTINCT SUBSTR(`{date_col}`,1,4) AS y FROM `{table}` WHERE `{date_col}` IS NOT NULL ORDER BY 1'
-    ser = conn.query(q, ttl=3600)["y"]
-    years = []
-    for v in ser:
-        if pd.isna(v): continue
-        s = str(v).strip()
-        if s.isdigit():
-            y = int(s)
-            if 1900 <= y <= 2100: years.append(str(y))
-    return sorted(set(years))
+@st.cache_data(show_spinner=False, max_entries=16)
+def _get_years(table, date_col, version=None):
+    return get_repository(table, date_col).years()
 
 def _last_day_of_month(y:int, m:int)->int:
     return calendar.monthrange(y, m)[1]
@@ -44,6 +37,7 @@ def _clamp_day(y:str, m:str, d:str)->str:
     di = max(1, min(di, dmax))
     return f"{di:02d}"
 
+@perf_trace.traced("render_five")
 def render(table:str, date_col:str="時間戳記", default_mode:str="1344"):
     st.markdown(
         """
@@ -64,8 +58,9 @@ def render(table:str, date_col:str="時間戳記", default_mode:str="1344"):
         unsafe_allow_html=True,
     )
 
-    min_d, max_d = _get_date_bounds(table, date_col)
-    years = _get_years(table, date_col)
+    version = version_for(table, date_col)
+    min_d, max_d = _get_date_bounds(table, date_col, version)
+    years = _get_years(table, date_col, version)
     if not years:
         years = [str(pd.to_datetime(min_d).year), str(pd.to_datetime(max_d).year)]
         years = sorted(set(years))
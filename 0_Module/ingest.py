@@ -0,0 +1,259 @@
+# 檔案：ingest.py (新分鐘資料的批次增量匯入)
+"""把本機 SQLite 檔 (3_DB/ATM_merge.db) 或 CSV 匯出檔的新資料分批寫入 atm 資料表，取代手動的 DBeaver 匯出 / 匯入：
+
+    讀取        SQLite 依時間戳記索引由舊到新串流讀取，CSV 以 chunksize 分段讀取；每次只保留一個分段 (預設 50,000 列)
+    增量        預設只讀取目標表各 mode 最新時間戳記中最早者 (含) 之後的資料；--full 重新比對全部資料 (補寫歷史資料)
+    正規化      mode 經 normalize_mode、時間戳記統一為 'YYYY-MM-DD HH:MM:SS'、價格欄位轉為數值；無法解析的列略過
+    去重        以 (mode, 時間戳記) 為鍵：分段內保留最後一筆，並以時間戳記索引範圍查出目標表在該分段區間內已有的鍵
+    寫入        每個分段一個交易，每批 --batch-rows 列以 DB-API executemany 寫入 (MySQL 驅動程式改寫為多列 INSERT)
+    衍生表      目標為 MySQL 時，建立 (不存在時) 並更新有新資料的 mode 的每日彙總表 (daily_summary)；應用程式只讀取此表
+
+目標表不存在時以第一個分段建立，並建立時間戳記 / (mode, 時間戳記) 索引。每個分段與結束時印出讀取 / 寫入列數與每秒列數。
+
+用法：
+    python 0_Module/ingest.py --sqlite 3_DB/ATM_merge.db                                 # 寫入 secrets.toml 的 [connections.mysql]
+    python 0_Module/ingest.py --csv exports/atm_*.csv --url mysql+pymysql://user:pw@host/ali2088
+    python 0_Module/ingest.py --sqlite 2_Benchmark/data/synthetic_1y_seed2088.db --url sqlite:///3_DB/ingest_test.db   # 本機測試
+"""
+import argparse
+import glob
+import os
+import sys
+import time
+import tomllib
+from dataclasses import dataclass, field
+from typing import Callable, Dict, Iterator, List, Optional, Sequence, Tuple
+
+import numpy as np
+import pandas as pd
+from sqlalchemy import create_engine, inspect, text
+from sqlalchemy.engine import URL
+from sqlalchemy.orm import Session
+
+import query_builder
+from query_builder import PRICE_COLUMNS, normalize_mode
+
+__all__ = ["IngestStats", "read_sqlite_chunks", "read_csv_chunks", "normalize_chunk", "target_since", "ingest"]
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+CHUNK_ROWS = 50000
+BATCH_ROWS = 10000
+
+
+@dataclass
+class IngestStats:
+    read: int = 0          # 自來源讀取的列數
+    invalid: int = 0       # mode / 時間戳記無法解析而略過的列數
+    skipped: int = 0       # 早於增量起點而略過的列數 (CSV 來源)
+    duplicates: int = 0    # 分段內重複或目標表已有的列數
+    inserted: int = 0
+    seconds: float = 0.0
+    modes: Dict[str, Tuple[str, str]] = field(default_factory=dict)  # mode → 寫入的 (最早, 最晚) 時間戳記
+    summaries: List[str] = field(default_factory=list)              # 已更新每日彙總表的 mode
+    mirror_from: Optional[str] = None                                # 本地鏡像自此曆日起改為重新同步
+
+    @property
+    def rows_per_second(self) -> float:
+        return self.read / self.seconds if self.seconds else 0.0
+
+    def line(self) -> str:
+        return (f"讀取 {self.read:,} 列，寫入 {self.inserted:,} 列 (重複 {self.duplicates:,}、較舊 {self.skipped:,}、無效 {self.invalid:,})，"
+                f"{self.seconds:.1f} 秒，{self.rows_per_second:,.0f} 列/秒")
+
+
+class _EngineConnection:
+    """提供 daily_summary 需要的 engine / session (與 st.connection 的 SQLConnection 相同介面)"""
+
+    def __init__(self, engine):
+        self.engine = engine
+
+    @property
+    def session(self) -> Session:
+        return Session(self.engine)
+
+
+# --- 1. 讀取 ---
+
+def read_sqlite_chunks(path: str, table: str = "atm", date_col: str = "時間戳記", since: Optional[str] = None,
+                       chunk_rows: int = CHUNK_ROWS) -> Iterator[pd.DataFrame]:
+    """依時間戳記由舊到新串流讀取 SQLite 檔中 since (含) 之後的資料 (不含遷移新增的產生欄位)"""
+    engine = create_engine(f"sqlite:///{os.path.abspath(path)}")
+    try:
+        schema = query_builder.table_schema(engine, table, date_col)
+        ts = schema.q(date_col)
+        sql = f"SELECT {schema.select_list()} FROM {schema.q(table)} WHERE {ts} >= :since ORDER BY {ts}"
+        with engine.connect() as c:
+            c = c.execution_options(stream_results=True)
+            yield from pd.read_sql(text(sql), c, params={"since": since or ""}, chunksize=chunk_rows)
+    finally:
+        engine.dispose()
+
+
+def read_csv_chunks(paths: Sequence[str], chunk_rows: int = CHUNK_ROWS) -> Iterator[pd.DataFrame]:
+    """依序分段讀取 CSV 檔 (全部欄位先讀成字串，由 normalize_chunk 統一轉換；可含 BOM)"""
+    for path in paths:
+        yield from pd.read_csv(path, dtype=str, encoding="utf-8-sig", chunksize=chunk_rows)
+
+
+# --- 2. 正規化 / 去重 ---
+
+def _ts_strings(ts: pd.Series) -> pd.Series:
+    """datetime64 → 'YYYY-MM-DD HH:MM:SS' (以 numpy 整批轉換，比 dt.strftime 快)"""
+    values = np.datetime_as_string(ts.to_numpy("datetime64[s]"), unit="s")
+    return pd.Series(values, index=ts.index).str.replace("T", " ", regex=False)
+
+
+def normalize_chunk(df: pd.DataFrame, date_col: str = "時間戳記") -> pd.DataFrame:
+    """mode 正規化、時間戳記轉為 'YYYY-MM-DD HH:MM:SS'、價格欄位轉數值；略過 mode 為空或時間戳記無法解析的列"""
+    from repository import _parse_timestamps
+    missing = [c for c in ("mode", date_col) if c not in df.columns]
+    if missing: raise ValueError(f"來源資料缺少欄位：{', '.join(missing)}")
+    modes = df["mode"].map({m: normalize_mode(m) for m in df["mode"].dropna().unique()})  # 每種寫法只正規化一次
+    out = df.assign(mode=modes, **{date_col: _parse_timestamps(df[date_col])})
+    out = out[out["mode"].notna() & (out["mode"] != "") & out[date_col].notna()]
+    prices = {c: pd.to_numeric(out[c], errors="coerce") for c in PRICE_COLUMNS if c in out.columns}
+    return out.assign(**{date_col: _ts_strings(out[date_col])}, **prices)
+
+
+def _existing_keys(c, schema: query_builder.TableSchema, lo: str, hi: str) -> pd.MultiIndex:
+    """目標表在 [lo, hi] 之間已有的 (mode, 時間戳記)；以時間戳記索引做範圍掃描"""
+    from repository import _parse_timestamps
+    ts, mode = schema.q(schema.date_col), "mode" if schema.migrated else "LOWER(TRIM(mode))"
+    keys = pd.read_sql(text(f"SELECT {mode} AS mode, {ts} AS ts FROM {schema.q(schema.table)} WHERE {ts} >= :lo AND {ts} <= :hi"),
+                       c, params={"lo": lo, "hi": hi})
+    return pd.MultiIndex.from_arrays([keys["mode"].astype(str), _parse_timestamps(keys["ts"]).dt.strftime("%Y-%m-%d %H:%M:%S")])
+
+
+def target_since(engine, table: str = "atm", date_col: str = "時間戳記") -> Optional[str]:
+    """增量起點：目標表各 mode 最新時間戳記中最早者 (落後的 mode 從自己的水位補起)；目標表不存在或為空時為 None"""
+    if not inspect(engine).has_table(table): return None
+    schema = query_builder.table_schema(engine, table, date_col, refresh=True)
+    with engine.connect() as c:  # (mode, 時間戳記) 索引的覆蓋掃描
+        marks = c.execute(text(f"SELECT MAX({schema.q(date_col)}) FROM {schema.q(table)} GROUP BY mode")).scalars().all()
+    marks = [str(m) for m in marks if m is not None]
+    return min(marks) if marks else None
+
+
+# --- 3. 寫入 ---
+
+def _executemany(pd_table, conn, keys: List[str], data_iter):
+    """to_sql 的寫入方法：整批參數直接交給 DB-API executemany，略過 SQLAlchemy 逐列編譯參數。
+    PyMySQL / mysql-connector 會把 INSERT ... VALUES 的 executemany 改寫為多列 INSERT (依封包大小分批)"""
+    quote = conn.dialect.identifier_preparer.quote
+    mark = "?" if conn.dialect.paramstyle == "qmark" else "%s"
+    sql = f"INSERT INTO {quote(pd_table.name)} ({', '.join(quote(k) for k in keys)}) VALUES ({', '.join([mark] * len(keys))})"
+    rows = list(data_iter)
+    conn.exec_driver_sql(sql, rows)
+    return len(rows)
+
+
+def _create_indexes(engine, table: str, date_col: str):
+    """新建的目標表：時間戳記索引與 (mode, 時間戳記) 複合索引 (與 synthetic_atm.load_sql 相同)"""
+    mysql = engine.dialect.name == "mysql"
+    ts_index = (f"CREATE INDEX idx_timestamp ON `{table}` (`{date_col}`(20))" if mysql
+                else f'CREATE INDEX IF NOT EXISTS idx_{table}_timestamp ON "{table}" ("{date_col}")')
+    with engine.begin() as c:
+        c.execute(text(ts_index))
+        c.execute(text(query_builder.recommended_index_sql(engine.dialect.name, table, date_col)))
+
+
+def ingest(chunks: Iterator[pd.DataFrame], engine, table: str = "atm", date_col: str = "時間戳記", since: Optional[str] = None,
+           batch_rows: int = BATCH_ROWS, refresh_summary: bool = True, dry_run: bool = False,
+           log: Optional[Callable[[str], None]] = print) -> IngestStats:
+    """把 chunks 正規化、去重後寫入 engine 的 table，回傳統計；since 指定時略過較早的列 (SQLite 來源已在查詢時過濾)。
+    dry_run 不寫入 (也不建表)，因此分段之間的重複不會被計入"""
+    stats, started = IngestStats(), time.perf_counter()
+    mysql = engine.dialect.name == "mysql"
+    schema = query_builder.table_schema(engine, table, date_col, refresh=True) if inspect(engine).has_table(table) else None
+    for raw in chunks:
+        valid = normalize_chunk(raw, date_col)
+        stats.read += len(raw); stats.invalid += len(raw) - len(valid)
+        if since:
+            stats.skipped += int((valid[date_col] < since).sum())
+            valid = valid[valid[date_col] >= since]
+        chunk = valid.drop_duplicates(["mode", date_col], keep="last")
+        if schema is not None: chunk = chunk[[c for c in schema.source_columns if c in chunk.columns]]  # 目標表沒有的欄位不寫入
+        with engine.begin() as c:
+            if schema is not None and not chunk.empty:
+                existing = _existing_keys(c, schema, chunk[date_col].min(), chunk[date_col].max())
+                chunk = chunk[~pd.MultiIndex.from_arrays([chunk["mode"], chunk[date_col]]).isin(existing)]
+            if not chunk.empty and not dry_run:
+                chunk.to_sql(table, c, if_exists="append", index=False, chunksize=batch_rows, method=_executemany)
+        stats.duplicates += len(valid) - len(chunk); stats.inserted += len(chunk)
+        if schema is None and not chunk.empty and not dry_run:
+            _create_indexes(engine, table, date_col)
+            schema = query_builder.table_schema(engine, table, date_col, refresh=True)
+        for mode, (lo, hi) in chunk.groupby("mode")[date_col].agg(["min", "max"]).iterrows():
+            first, last = stats.modes.get(mode, (lo, hi))
+            stats.modes[mode] = (min(first, lo), max(last, hi))
+        stats.seconds = time.perf_counter() - started
+        if log: log(stats.line())
+    # 衍生的每日彙總表：從各 mode 最早寫入的曆日前一天起重算
+    if mysql and refresh_summary and not dry_run and stats.modes:
+        from daily_summary import ensure_summary_table, refresh_daily_summary
+        conn = _EngineConnection(engine)
+        ensure_summary_table(conn, table, date_col)
+        for mode, (first, _) in sorted(stats.modes.items()):
+            refresh_daily_summary(table, date_col, mode, conn, from_day=first[:10])
+            stats.summaries.append(mode)
+    # 本地鏡像 (local_mirror)：寫入的最早曆日起不再視為完整，下次同步重新取回 (只追加新資料時不會改變)
+    if mysql and not dry_run and stats.modes:
+        import local_mirror
+        first_day = min(first for first, _ in stats.modes.values())[:10]
+        if local_mirror.mirror_enabled() and local_mirror.invalidate_mirror(table, first_day): stats.mirror_from = first_day
+    stats.seconds = time.perf_counter() - started
+    return stats
+
+
+# --- 4. 命令列 ---
+
+def secrets_url(path: str = os.path.join(ROOT_DIR, ".streamlit", "secrets.toml")) -> URL:
+    """.streamlit/secrets.toml 的 [connections.mysql] (與 st.connection("mysql") 相同的資料庫)"""
+    with open(path, "rb") as f:
+        cfg = tomllib.load(f)["connections"]["mysql"]
+    return URL.create(f"{cfg.get('dialect', 'mysql')}+{cfg['driver']}" if cfg.get("driver") else cfg.get("dialect", "mysql"),
+                      username=cfg.get("username", cfg.get("user")), password=cfg.get("password"),
+                      host=cfg.get("host"), port=cfg.get("port"), database=cfg.get("database"))
+
+
+def _main(argv: Optional[Sequence[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="把 SQLite / CSV 的新分鐘資料增量匯入 atm 資料表")
+    source = parser.add_mutually_exclusive_group(required=True)
+    source.add_argument("--sqlite", help="來源 SQLite 檔 (例如 3_DB/ATM_merge.db)")
+    source.add_argument("--csv", nargs="+", help="來源 CSV 檔 (可用萬用字元，依檔名排序讀取)")
+    parser.add_argument("--url", help="目標 SQLAlchemy 連線字串；未指定時使用 .streamlit/secrets.toml 的 [connections.mysql]")
+    parser.add_argument("--table", default="atm", help="目標資料表")
+    parser.add_argument("--source-table", default="atm", help="來源 SQLite 的資料表")
+    parser.add_argument("--date-col", default="時間戳記")
+    parser.add_argument("--since", help="只匯入此時間戳記 (含) 之後的資料；預設為目標表的增量起點")
+    parser.add_argument("--full", action="store_true", help="比對來源的全部資料 (補寫歷史資料；已有的列仍會略過)")
+    parser.add_argument("--chunk-rows", type=int, default=CHUNK_ROWS, help="每個分段的列數 (記憶體用量上限)")
+    parser.add_argument("--batch-rows", type=int, default=BATCH_ROWS, help="每次 executemany 的列數")
+    parser.add_argument("--no-summary", action="store_true", help="不更新每日彙總表")
+    parser.add_argument("--dry-run", action="store_true", help="只讀取、正規化與比對，不寫入")
+    args = parser.parse_args(argv)
+
+    engine = create_engine(args.url or secrets_url())
+    previous = target_since(engine, args.table, args.date_col)
+    since = None if args.full else (args.since or previous)
+    print(f"目標 {engine.url.render_as_string(hide_password=True)} / {args.table}，增量起點 {since or '(全部)'}")
+    if args.sqlite:
+        chunks = read_sqlite_chunks(args.sqlite, args.source_table, args.date_col, since, args.chunk_rows)
+    else:
+        chunks = read_csv_chunks(sorted(p for pattern in args.csv for p in (glob.glob(pattern) or [pattern])), args.chunk_rows)
+    stats = ingest(chunks, engine, args.table, args.date_col, since, args.batch_rows, not args.no_summary, args.dry_run)
+    print(f"完成：{stats.line()}")
+    for mode, (first, last) in sorted(stats.modes.items()):
+        print(f"  {mode}: {first} ~ {last}{' (已更新每日彙總表)' if mode in stats.summaries else ''}")
+    # 寫入早於原本最新曆日的資料時，應用程式把歷史曆日視為不再變動 (data_version)，需重新啟動才會看到
+    first = min((f for f, _ in stats.modes.values()), default=None)
+    if previous and first and first[:10] < previous[:10] and not args.dry_run:
+        print(f"注意：寫入了 {previous[:10]} 之前的曆日；執行中的應用程式需重新啟動以清除歷史資料快取。", file=sys.stderr)
+    if stats.mirror_from:
+        print(f"本地鏡像自 {stats.mirror_from} 起改查雲端，下次同步時重新取回。")
+    engine.dispose()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(_main())
@@ -0,0 +1,247 @@
+# 檔案：local_mirror.py (atm 資料表的本地 Parquet 鏡像)
+"""離線優先的本地欄式鏡像：把雲端資料表以 Parquet 存在 3_DB/mirror/<table>/ 底下，
+依 mode (LOWER(TRIM(mode))) 與月份分區 (hive 目錄格式)：
+
+    mode_key=1344/month=2024-03/data.parquet
+
+每一列保留原始資料表的所有欄位 (型別照 MySQL 回傳的原樣)，另加 `_d` ('YYYY-MM-DD') 供日期條件下推。
+_meta.json 記錄各 mode 已鏡像的最大時間戳記 (水位)；各 mode 水位中最早的那一天 (complete_before) 之前
+的日期視為完整，該日 (含) 之後一律回到 MySQL 查詢，因此落後的 mode 補上的資料不會遺漏。
+補寫了更早曆日的資料時 (例如 ingest --full)，以 invalidate_mirror 把 complete_before 提前，下次同步重新取回。
+
+啟用條件：設定環境變數 ATM_MIRROR_DIR，或預設目錄 3_DB/mirror 已存在 (首次建立請執行
+`python 0_Module/local_mirror.py sync`)。啟用後讀取端每 ATM_MIRROR_SYNC_SECONDS 秒 (預設 600)
+最多排程一次增量同步，在 prefetch 的背景執行緒池執行 (讀取端不等待；ATM_PREFETCH_WORKERS=0 時只能以命令列同步)；
+同步失敗 (例如離線) 時照樣使用本地資料。
+"""
+import json
+import logging
+import os
+import sys
+import threading
+import time as _time
+from datetime import time
+from typing import Dict, List, Optional, Tuple
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.dataset as ds
+import pyarrow.parquet as pq
+import streamlit as st
+from sqlalchemy import text
+
+import perf_trace
+import query_builder
+
+__all__ = ["mirror_enabled", "mirror_boundary", "mirror_watermark", "sync_mirror", "invalidate_mirror", "read_rows", "distinct_dates",
+           "date_bounds", "years"]
+
+_ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+MIRROR_DIR = os.environ.get("ATM_MIRROR_DIR", os.path.join(_ROOT_DIR, "3_DB", "mirror"))
+SYNC_SECONDS = float(os.environ.get("ATM_MIRROR_SYNC_SECONDS", "600"))
+_PARTITION_SCHEMA = pa.schema([("mode_key", pa.string()), ("month", pa.string())])
+_PARTITIONING = ds.partitioning(_PARTITION_SCHEMA, flavor="hive")
+_LOG = logging.getLogger("atm.mirror")
+_LOCK = threading.Lock()
+_LAST_SYNC: Dict[str, float] = {}
+_DATASETS: Dict[str, Tuple[Optional[tuple], Optional[ds.Dataset]]] = {}  # 資料表 → (_meta.json 的狀態, 合併後的 dataset)
+
+
+def _table_dir(table: str) -> str:
+    return os.path.join(MIRROR_DIR, table)
+
+
+def _mode_key(mode) -> str:
+    return query_builder.normalize_mode(mode)
+
+
+def mirror_enabled() -> bool:
+    return "ATM_MIRROR_DIR" in os.environ or os.path.isdir(MIRROR_DIR)
+
+
+# --- 1. 水位 ---
+
+def _read_meta(table: str) -> dict:
+    path = os.path.join(_table_dir(table), "_meta.json")
+    if not os.path.exists(path): return {}
+    with open(path, "r", encoding="utf-8") as f: return json.load(f)
+
+
+def _meta_stamp(table: str) -> Optional[tuple]:
+    """_meta.json 的 (修改時間, 大小)；每次同步 / 失效最後都會改寫 _meta.json，可作為鏡像內容的版本"""
+    try: info = os.stat(os.path.join(_table_dir(table), "_meta.json"))
+    except OSError: return None
+    return info.st_mtime_ns, info.st_size
+
+
+def _write_meta(table: str, meta: dict):
+    path = os.path.join(_table_dir(table), "_meta.json")
+    with open(path + ".tmp", "w", encoding="utf-8") as f: json.dump(meta, f, ensure_ascii=False)
+    os.replace(path + ".tmp", path)
+
+
+def mirror_boundary(table: str, date_col: str) -> Optional[str]:
+    """回傳 'YYYY-MM-DD'：此日期之前的資料已完整鏡像 (此日 (含) 之後需查 MySQL)；未啟用或尚無鏡像時回傳 None。
+    距上次同步超過 SYNC_SECONDS 時在背景排程增量同步，本次仍以目前的鏡像回答"""
+    if not mirror_enabled(): return None
+    now = _time.monotonic()
+    if now - _LAST_SYNC.get(table, float("-inf")) >= SYNC_SECONDS:
+        _LAST_SYNC[table] = now
+        import prefetch  # prefetch → repository → 本模組
+        prefetch.submit_background(("mirror_sync", table), _sync_quietly, table, date_col)
+    return _read_meta(table).get("complete_before")
+
+
+def _sync_quietly(table: str, date_col: str):
+    try: sync_mirror(table, date_col)
+    except Exception: _LOG.warning("mirror sync of %s failed; keeping the existing mirror", table, exc_info=True)
+
+
+def mirror_watermark(table: str) -> Optional[str]:
+    """鏡像中的最大時間戳記 (不觸發同步)"""
+    return _read_meta(table).get("max_ts")
+
+
+# --- 2. 增量同步 ---
+
+def _query(conn, sql: str, params: dict) -> pd.DataFrame:
+    """不經 st.cache_data 的查詢 (同步需要最新資料)"""
+    with conn.session as s:
+        return pd.read_sql(text(sql), s.connection(), params=params)
+
+
+def _day_strings(ts: pd.Series) -> pd.Series:
+    return pd.to_datetime(ts, errors="coerce").dt.strftime("%Y-%m-%d")
+
+
+def _write_partition(path: str, new_rows: pd.DataFrame, replace_from: str, replace_until: str):
+    """以 new_rows 取代分區檔中 _d 落在 [replace_from, replace_until) 的列"""
+    frames = []
+    if os.path.exists(path):
+        old = pq.ParquetFile(path).read().to_pandas()
+        frames.append(old[(old["_d"] < replace_from) | (old["_d"] >= replace_until)])
+    frames.append(new_rows)
+    merged = pd.concat(frames, ignore_index=True).sort_values("_d", kind="stable")
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    pq.write_table(pa.Table.from_pandas(merged, preserve_index=False), path + ".tmp")
+    os.replace(path + ".tmp", path)
+
+
+@perf_trace.traced("mirror:sync", kind="db")
+def sync_mirror(table: str, date_col: str, conn=None, chunk_days: int = 31, from_day: Optional[str] = None) -> int:
+    """從 MySQL 取回 complete_before (或更早的 from_day) 當天 (含) 之後的資料寫入鏡像，回傳寫入列數"""
+    conn = conn or st.connection("mysql", type="sql")
+    with _LOCK:
+        meta = _read_meta(table)
+        since = min([d for d in (meta.get("complete_before"), from_day) if d], default=None)
+        bounds = _query(conn, f"SELECT MIN(`{date_col}`) AS lo, MAX(`{date_col}`) AS hi FROM `{table}` WHERE `{date_col}` >= :since", {"since": since or ""})
+        if bounds.empty or pd.isna(bounds.at[0, "hi"]): return 0
+        lo = pd.Timestamp(since) if since else pd.to_datetime(bounds.at[0, "lo"]).normalize()
+        last_day = pd.to_datetime(bounds.at[0, "hi"]).normalize()
+        written, mode_marks = 0, dict(meta.get("modes", {}))
+        select_sql = query_builder.table_schema(conn.engine, table, date_col).select_list()  # 不含遷移新增的產生欄位
+        while lo <= last_day:
+            hi = min(lo + pd.Timedelta(days=chunk_days), last_day + pd.Timedelta(days=1))
+            lo_s, hi_s = lo.strftime("%Y-%m-%d"), hi.strftime("%Y-%m-%d")
+            part = _query(conn, f"SELECT {select_sql} FROM `{table}` WHERE `{date_col}` >= :lo AND `{date_col}` < :hi", {"lo": lo_s, "hi": hi_s})
+            if not part.empty:
+                part["_d"] = _day_strings(part[date_col])
+                part = part.dropna(subset=["_d"])
+                mode_keys = part["mode"].map({m: _mode_key(m) for m in part["mode"].dropna().unique()})
+                keys = pd.DataFrame({"mode_key": mode_keys, "month": part["_d"].str[:7]})
+                for (mode_key, month), idx in keys.groupby(["mode_key", "month"]).groups.items():
+                    path = os.path.join(_table_dir(table), f"mode_key={mode_key}", f"month={month}", "data.parquet")
+                    _write_partition(path, part.loc[idx], lo_s, hi_s)
+                written += len(part)
+                for mode_key, part_max in part.groupby(mode_keys)[date_col].max().items():
+                    mode_marks[mode_key] = max(str(part_max), mode_marks.get(mode_key, ""))
+            lo = hi
+        if mode_marks:
+            # 落後的 mode 之後還會補上資料：以各 mode 水位中最早的一天作為完整鏡像的界線
+            _write_meta(table, {"max_ts": max(mode_marks.values()), "complete_before": min(mode_marks.values())[:10], "modes": mode_marks})
+    return written
+
+
+def invalidate_mirror(table: str, from_day: str) -> bool:
+    """from_day ('YYYY-MM-DD') 起的鏡像資料不再視為完整 (改查 MySQL)，下次同步時重新取回；回傳是否有變更"""
+    with _LOCK:
+        meta = _read_meta(table)
+        if not meta.get("complete_before") or meta["complete_before"] <= from_day: return False
+        _write_meta(table, {**meta, "complete_before": from_day})
+    return True
+
+
+# --- 3. 讀取 (欄位投影 + 條件下推) ---
+
+def _dataset(table: str) -> Optional[ds.Dataset]:
+    """合併所有分區檔的 dataset；沿用到 _meta.json 改變 (同步或失效) 為止，不必每次讀取都走訪目錄、讀取檔尾"""
+    stamp = _meta_stamp(table)
+    cached = _DATASETS.get(table)
+    if cached is not None and cached[0] == stamp and stamp is not None: return cached[1]
+    root = _table_dir(table)
+    files = [os.path.join(d, f) for d, _, fs in os.walk(root) for f in fs if f.endswith(".parquet")]
+    dset = None
+    if files:
+        schema = pa.unify_schemas([pq.ParquetFile(f).schema_arrow for f in files] + [_PARTITION_SCHEMA])
+        dset = ds.dataset(files, schema=schema, format="parquet", partitioning=_PARTITIONING, partition_base_dir=root)
+    _DATASETS[table] = (stamp, dset)
+    return dset
+
+
+@perf_trace.traced("mirror:read_rows", kind="local")
+def read_rows(table: str, mode, dates: Optional[List[str]] = None, start_date: Optional[str] = None,
+              end_date: Optional[str] = None, columns: Optional[List[str]] = None) -> pd.DataFrame:
+    """讀取指定 mode 的鏡像資料；dates 為日期清單，或以 [start_date, end_date] 指定範圍；columns 為 None 時取回全部原始欄位"""
+    dset = _dataset(table)
+    if dset is None: return pd.DataFrame()
+    flt = ds.field("mode_key") == _mode_key(mode)
+    if dates is not None:
+        flt &= ds.field("month").isin(sorted({d[:7] for d in dates})) & ds.field("_d").isin(list(dates))
+    else:
+        if start_date: flt &= (ds.field("month") >= start_date[:7]) & (ds.field("_d") >= start_date)
+        if end_date: flt &= (ds.field("month") <= end_date[:7]) & (ds.field("_d") <= end_date)
+    raw_cols = [n for n in dset.schema.names if n not in ("_d", "mode_key", "month")]
+    cols = raw_cols if columns is None else [c for c in columns if c in raw_cols]
+    return dset.to_table(columns=cols, filter=flt).to_pandas()
+
+
+def distinct_dates(table: str, mode, date_col: str = "時間戳記", session_start: Optional[time] = None) -> List[str]:
+    """鏡像中有資料的日期；指定 session_start 時只列出該時刻之後仍有資料的日期"""
+    dset = _dataset(table)
+    if dset is None: return []
+    mode_filter = ds.field("mode_key") == _mode_key(mode)
+    if session_start is None:
+        col = dset.to_table(columns=["_d"], filter=mode_filter).column("_d")
+        return sorted(set(col.unique().to_pylist()))
+    df = dset.to_table(columns=["_d", date_col], filter=mode_filter).to_pandas()
+    ts = pd.to_datetime(df[date_col], errors="coerce")
+    keep = (ts - ts.dt.normalize()) >= pd.Timedelta(hours=session_start.hour, minutes=session_start.minute, seconds=session_start.second)
+    return sorted(set(df.loc[keep, "_d"]))
+
+
+def date_bounds(table: str) -> Tuple[Optional[str], Optional[str]]:
+    dset = _dataset(table)
+    if dset is None: return None, None
+    col = dset.to_table(columns=["_d"]).column("_d")
+    if len(col) == 0: return None, None
+    mm = pc.min_max(col)
+    return mm["min"].as_py(), mm["max"].as_py()
+
+
+def years(table: str) -> List[str]:
+    """由月份分區目錄名稱取得年份，不需讀檔"""
+    root = _table_dir(table)
+    if not os.path.isdir(root): return []
+    return sorted({m[len("month="):][:4] for _, dirs, _ in os.walk(root) for m in dirs if m.startswith("month=")})
+
+
+if __name__ == "__main__":
+    # 用法：python 0_Module/local_mirror.py sync [table] [date_col]
+    if len(sys.argv) >= 2 and sys.argv[1] == "sync":
+        tbl = sys.argv[2] if len(sys.argv) > 2 else "atm"
+        dcol = sys.argv[3] if len(sys.argv) > 3 else "時間戳記"
+        os.makedirs(_table_dir(tbl), exist_ok=True)
+        print(f"已同步 {sync_mirror(tbl, dcol)} 列至 {_table_dir(tbl)}")
+    else:
+        print(__doc__)
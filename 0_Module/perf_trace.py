@@ -0,0 +1,155 @@
+# 檔案：perf_trace.py (查詢與各階段耗時記錄)
+"""記錄每次頁面執行中各資料庫查詢與主要階段的耗時，供側欄效能面板與結構化日誌使用。
+
+    with perf_trace.span("mysql:unique_dates", kind="db") as sp:
+        df = sp.observe(conn.query(...))          # 記錄列數與資料量
+
+    @perf_trace.traced("make_trend")               # 函式層級的階段
+    def make_trend(...): ...
+
+每個 span 記錄：耗時、列數、資料量 (DataFrame 記憶體大小，作為傳輸量的估計)、快取命中 / 未命中。
+kind="db" 的 span 若期間沒有任何 SQL 實際送到資料庫 (watch_engine 監看的 engine)，即視為快取命中。
+
+記錄範圍為一次 Streamlit 頁面執行 (start_run 開始)；不在任何 run 中時 span 照常計時但不保存。
+設定環境變數 ATM_PERF_LOG 時，每個 span 結束即寫出一行 JSON (值為檔案路徑，或 "-" 代表 stderr)，
+可跨 session 彙整 (以 run / session 欄位區分)。
+"""
+import contextvars
+import functools
+import json
+import logging
+import os
+import sys
+import time
+import uuid
+from contextlib import contextmanager
+from dataclasses import dataclass, field
+from datetime import datetime
+from typing import Any, Dict, List, Optional
+
+import pandas as pd
+
+__all__ = ["Span", "start_run", "current_spans", "span", "traced", "watch_engine", "spans_frame"]
+
+_LOG = logging.getLogger("atm.perf")
+_CURRENT: contextvars.ContextVar = contextvars.ContextVar("atm_perf_run", default=None)
+_WATCHED_ENGINES = set()
+
+
+@dataclass
+class Span:
+    name: str
+    kind: str = "stage"                 # "db" / "stage"
+    seconds: float = 0.0
+    rows: Optional[int] = None
+    bytes: Optional[int] = None
+    cache: Optional[str] = None         # "hit" / "miss"
+    depth: int = 0
+    extra: Dict[str, Any] = field(default_factory=dict)
+
+    def observe(self, value):
+        """由回傳值記錄列數與資料量 (DataFrame / Series / plotly Figure / 序列)，原樣回傳 value"""
+        if isinstance(value, (pd.DataFrame, pd.Series)):
+            self.rows = len(value)
+            self.bytes = int(value.memory_usage(index=False).sum()) if isinstance(value, pd.DataFrame) else int(value.memory_usage(index=False))
+        elif hasattr(value, "data") and isinstance(getattr(value, "data"), tuple):  # plotly Figure：以繪圖點數計
+            self.rows = sum(len(t.x) for t in value.data if getattr(t, "x", None) is not None)
+        elif isinstance(value, (list, tuple)):
+            self.rows = len(value)
+        return value
+
+
+@dataclass
+class _Run:
+    run_id: str
+    page: str
+    session: Optional[str]
+    spans: List[Span] = field(default_factory=list)
+    depth: int = 0
+    db_executions: int = 0
+
+
+# --- 1. 記錄範圍 ---
+
+def _configure_log():
+    target = os.environ.get("ATM_PERF_LOG")
+    if not target or _LOG.handlers: return
+    handler = logging.StreamHandler(sys.stderr) if target == "-" else logging.FileHandler(target, encoding="utf-8")
+    handler.setFormatter(logging.Formatter("%(message)s"))
+    _LOG.addHandler(handler); _LOG.setLevel(logging.INFO); _LOG.propagate = False
+
+
+def start_run(page: str = "", session: Optional[str] = None) -> _Run:
+    """開始新的一次頁面執行記錄 (取代同一執行緒中前一次的記錄)"""
+    _configure_log()
+    run = _Run(run_id=uuid.uuid4().hex[:12], page=page, session=session)
+    _CURRENT.set(run)
+    return run
+
+
+def current_spans() -> List[Span]:
+    run = _CURRENT.get()
+    return list(run.spans) if run else []
+
+
+def _emit(run: Optional[_Run], sp: Span):
+    if not _LOG.handlers: return
+    record = {"ts": datetime.now().isoformat(timespec="milliseconds"), "run": run.run_id if run else None,
+              "session": run.session if run else None, "page": run.page if run else None,
+              "name": sp.name, "kind": sp.kind, "seconds": round(sp.seconds, 6), "rows": sp.rows, "bytes": sp.bytes, "cache": sp.cache}
+    record.update(sp.extra)
+    _LOG.info(json.dumps(record, ensure_ascii=False, default=str))
+
+
+# --- 2. span / 裝飾器 ---
+
+@contextmanager
+def span(name: str, kind: str = "stage", **extra):
+    run = _CURRENT.get()
+    sp = Span(name=name, kind=kind, depth=run.depth if run else 0, extra=extra)
+    if run: run.spans.append(sp); run.depth += 1  # 以開始順序排列，巢狀階段以 depth 縮排
+    executions_before = run.db_executions if run else 0
+    t0 = time.perf_counter()
+    try:
+        yield sp
+    finally:
+        sp.seconds = time.perf_counter() - t0
+        if run:
+            run.depth -= 1
+            if kind == "db" and sp.cache is None: sp.cache = "hit" if run.db_executions == executions_before else "miss"
+        _emit(run, sp)
+
+
+def traced(name: Optional[str] = None, kind: str = "stage"):
+    """以 span 包住整個函式，並由回傳值記錄列數與資料量"""
+    def decorator(fn):
+        label = name or fn.__name__
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            with span(label, kind=kind) as sp:
+                return sp.observe(fn(*args, **kwargs))
+        return wrapper
+    return decorator
+
+
+def watch_engine(engine):
+    """監看 SQLAlchemy engine 實際送出的 SQL，用來判斷 db span 是否命中快取 (同一 engine 只註冊一次)"""
+    if engine is None or id(engine) in _WATCHED_ENGINES: return
+    from sqlalchemy import event
+
+    def _count(*_args, **_kwargs):
+        run = _CURRENT.get()
+        if run: run.db_executions += 1
+
+    event.listen(engine, "before_cursor_execute", _count)
+    _WATCHED_ENGINES.add(id(engine))
+
+
+# --- 3. 面板用的彙整 ---
+
+def spans_frame(spans: List[Span]) -> pd.DataFrame:
+    """面板表格：階段 (依巢狀縮排) / 類型 / 耗時 / 列數 / 資料量 / 快取"""
+    return pd.DataFrame([{
+        "階段": "　" * sp.depth + sp.name, "類型": sp.kind, "耗時(ms)": round(sp.seconds * 1000, 1),
+        "列數": sp.rows, "資料量(KB)": None if sp.bytes is None else round(sp.bytes / 1024, 1), "快取": sp.cache or "",
+    } for sp in spans], columns=["階段", "類型", "耗時(ms)", "列數", "資料量(KB)", "快取"])
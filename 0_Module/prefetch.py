@@ -0,0 +1,154 @@
+# 檔案：prefetch.py (趨勢圖資料的背景預取與啟動暖機)
+"""以背景執行緒池預先取回使用者接下來可能要看的資料：
+
+    trend_window          頁面取趨勢圖資料的入口：先查 RESULT_CACHE，預取仍在進行時等待其結果，否則同步取回並放入快取
+    prefetch_neighbors    依篩選結果清單 (date_choices) 預取目前起始日前後各 radius 個日期、同樣天數的趨勢圖資料
+    warm_up               每個行程只執行一次：預先建立交易日曆並暖機 _get_all_unique_dates、_get_date_bounds、_get_years
+    submit_background     在同一個執行緒池執行其他背景工作 (例如 local_mirror 的增量同步)
+
+趨勢圖資料以 (後端, 資料表, mode, 時間戳記範圍, 欄位) 為鍵放在 result_cache，版本為該範圍的資料版本 (data_version)，
+因此所有 session 共用同一份預取結果。執行緒數由 ATM_PREFETCH_WORKERS 設定 (預設 2，0 為停用預取與暖機)，
+預取半徑由 ATM_PREFETCH_RADIUS 設定 (預設 2)。預取失敗只記錄 log，頁面屆時再同步查詢。
+"""
+import logging
+import os
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Dict, Hashable, List, Optional, Sequence
+
+import pandas as pd
+
+import perf_trace
+from data_version import version_for
+from query_builder import normalize_mode
+from repository import get_repository
+from result_cache import RESULT_CACHE
+
+__all__ = ["trend_window", "prefetch_neighbors", "warm_up", "submit_background", "PREFETCH_WORKERS", "PREFETCH_RADIUS"]
+
+_LOG = logging.getLogger("atm.prefetch")
+
+
+def _env_int(name: str, default: int) -> int:
+    try: return max(int(os.environ.get(name, default)), 0)
+    except ValueError: return default
+
+
+PREFETCH_WORKERS = _env_int("ATM_PREFETCH_WORKERS", 2)
+PREFETCH_RADIUS = _env_int("ATM_PREFETCH_RADIUS", 2)
+
+_LOCK = threading.Lock()
+_EXECUTOR: Optional[ThreadPoolExecutor] = None
+_INFLIGHT: Dict[Hashable, Future] = {}   # 進行中的預取 (同一個鍵只送出一次)
+_WARMED = set()                          # 已暖機的 (資料表, 時間戳記欄位, mode)
+_THREAD_PREFIX = "atm-prefetch"
+
+# 背景執行緒沒有 ScriptRunContext (不屬於任何 session)，st.cache_data 每次查詢都會警告；只略過本模組執行緒的這則警告
+logging.getLogger("streamlit.runtime.scriptrunner_utils.script_run_context").addFilter(
+    lambda record: not record.threadName.startswith(_THREAD_PREFIX))
+
+
+def _executor() -> Optional[ThreadPoolExecutor]:
+    global _EXECUTOR
+    if PREFETCH_WORKERS == 0: return None
+    with _LOCK:
+        if _EXECUTOR is None: _EXECUTOR = ThreadPoolExecutor(max_workers=PREFETCH_WORKERS, thread_name_prefix=_THREAD_PREFIX)
+        return _EXECUTOR
+
+
+def _submit(key: Hashable, fn, *args) -> Optional[Future]:
+    """送出背景工作；同一個鍵已在進行中時沿用既有的 Future"""
+    pool = _executor()
+    if pool is None: return None
+    with _LOCK:
+        future = _INFLIGHT.get(key)
+        if future is not None: return future
+        future = _INFLIGHT[key] = pool.submit(fn, *args)
+    future.add_done_callback(lambda f: _finish(key, f))
+    return future
+
+
+def submit_background(key: Hashable, fn, *args) -> Optional[Future]:
+    """在背景執行 fn(*args)；同一個鍵同時只執行一次，停用預取 (ATM_PREFETCH_WORKERS=0) 時不執行並回傳 None"""
+    return _submit(key, fn, *args)
+
+
+def _finish(key: Hashable, future: Future):
+    with _LOCK:
+        if _INFLIGHT.get(key) is future: del _INFLIGHT[key]
+    if not future.cancelled() and future.exception() is not None:
+        _LOG.warning("prefetch %s failed: %s", key[:2] if isinstance(key, tuple) else key, future.exception())
+
+
+# --- 1. 趨勢圖資料 (result_cache) ---
+
+def _window_key(table, date_col, mode, bounds, columns) -> tuple:
+    return ("trend_window", get_repository(table, date_col).name, table, normalize_mode(mode), *bounds, tuple(columns))
+
+
+def _load_window(key, table, date_col, mode, bounds, columns, version) -> pd.DataFrame:
+    from daily_seamless_trend import _fetch_intraday_between
+    df = _fetch_intraday_between(table, date_col, mode, *bounds, columns=list(columns))
+    if version is not None: RESULT_CACHE.put(key, version, df)
+    return df
+
+
+def trend_window(table: str, date_col: str, mode, days: Sequence[str], columns: Sequence[str], calendar) -> pd.DataFrame:
+    """連續交易日 days 的趨勢圖資料 (_fetch_intraday_between 的結果)；calendar 為 get_trading_calendar 的日曆"""
+    bounds = calendar.session_bounds(days)
+    if bounds is None: return pd.DataFrame()
+    key, version = _window_key(table, date_col, mode, bounds, columns), version_for(table, date_col, bounds[1], mode)
+    with perf_trace.span("trend_window", days=len(days)) as sp:
+        df = RESULT_CACHE.get(key, version) if version is not None else None
+        if df is None:
+            with _LOCK: pending = _INFLIGHT.get(key)
+            if pending is not None:
+                try: df = pending.result(); sp.cache = "prefetch"
+                except Exception: df = None  # 預取失敗時改為同步查詢
+        else:
+            sp.cache = "hit"
+        if df is None:
+            sp.cache = "miss"
+            df = _load_window(key, table, date_col, mode, bounds, columns, version)
+        return sp.observe(df)
+
+
+def prefetch_neighbors(table: str, date_col: str, mode, date_choices: Sequence, base_day, n_days: int, columns: Sequence[str],
+                       calendar, radius: Optional[int] = None) -> List[Future]:
+    """在背景預取 date_choices 中 base_day 前後各 radius 個日期 (由近到遠) 的 n_days 天趨勢圖資料；已在快取中的略過"""
+    radius = PREFETCH_RADIUS if radius is None else radius
+    if radius == 0 or base_day not in date_choices: return []
+    i = list(date_choices).index(base_day)
+    neighbors = [date_choices[j] for step in range(1, radius + 1) for j in (i + step, i - step) if 0 <= j < len(date_choices)]
+    futures = []
+    for day in neighbors:
+        first = calendar.session_day(day)
+        bounds = calendar.session_bounds(calendar.n_trading_days(first, n_days)) if first else None
+        if bounds is None: continue
+        key, version = _window_key(table, date_col, mode, bounds, columns), version_for(table, date_col, bounds[1], mode)
+        if version is None or RESULT_CACHE.contains(key, version): continue
+        future = _submit(key, _load_window, key, table, date_col, mode, bounds, tuple(columns), version)
+        if future is not None: futures.append(future)
+    return futures
+
+
+# --- 2. 啟動暖機 ---
+
+def _warm(table: str, date_col: str, mode):
+    from five_standard import _get_date_bounds, _get_years
+    from trading_calendar import get_trading_calendar
+    from daily_seamless_trend import _get_all_unique_dates
+    get_trading_calendar(table, date_col, mode)                                     # 多條件篩選頁的交易日曆
+    _get_all_unique_dates(table, date_col, mode, version_for(table, date_col, mode=mode))  # 相似度分析頁的日期清單 (同樣的快取鍵)
+    version = version_for(table, date_col)
+    _get_date_bounds(table, date_col, version)
+    _get_years(table, date_col, version)
+
+
+def warm_up(table: str = "atm", date_col: str = "時間戳記", mode="1344") -> Optional[Future]:
+    """行程內第一次呼叫時在背景暖機 (之後的呼叫直接回傳 None)；頁面同時查詢相同資料時由 st.cache_data 的鎖等待暖機結果"""
+    key = (table, date_col, normalize_mode(mode))
+    with _LOCK:
+        if key in _WARMED: return None
+        _WARMED.add(key)
+    return _submit(("warm_up", *key), _warm, table, date_col, mode)
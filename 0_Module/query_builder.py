@@ -0,0 +1,161 @@
+# 檔案：query_builder.py (可使用索引的 SQL 條件產生器)
+"""各後端對 atm 資料表的查詢條件都由這裡產生，讓 MySQL / SQLite 能以 (mode, 時間戳記) 複合索引做範圍掃描：
+
+    mode        以 mode = :mode 比對 (參數先經 normalize_mode)；資料表已遷移 (migrate_table) 時 mode 在寫入時即正規化，
+                未遷移時退回 LOWER(TRIM(mode)) = :mode (無法使用索引，但結果相同)
+    日期        DATE(ts) IN (...) 改為半開區間 ts >= 'YYYY-MM-DD' AND ts < '次日'，連續日期合併為一段
+    時段 / 價格 遷移後改用產生欄位 tod (TIME(ts))、ft_price_num 等 (DECIMAL(10,2))，未遷移時退回函式運算式
+
+時間戳記欄位為 'YYYY-MM-DD HH:MM:SS' 字串 (或 DATETIME)，字串比較與時間先後一致，半開區間對兩者都成立。
+建議索引見 RECOMMENDED_INDEX；2_Benchmark/explain_plans.py 會印出遷移前後的 EXPLAIN 結果。
+"""
+import threading
+from dataclasses import dataclass
+from datetime import time, timedelta
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import pandas as pd
+from sqlalchemy import inspect, text
+
+__all__ = ["TableSchema", "table_schema", "normalize_mode", "day_ranges", "migrate_table", "recommended_index_sql",
+           "RECOMMENDED_INDEX", "GENERATED_COLUMNS", "PRICE_COLUMNS"]
+
+RECOMMENDED_INDEX = "idx_mode_timestamp"
+# 原始價格欄位 → 產生欄位
+PRICE_COLUMNS = {"FT價格": "ft_price_num", "FT漲跌": "ft_chg_num", "價平和(價平)": "kph_num", "價平和漲跌(價平)": "kph_chg_num"}
+GENERATED_COLUMNS = ["tod"] + list(PRICE_COLUMNS.values())
+
+_LOCK = threading.Lock()
+_SCHEMAS: Dict[Tuple[str, str], "TableSchema"] = {}
+
+
+def normalize_mode(mode) -> str:
+    """mode 的正規化形式 (寫入與查詢一致)：去除前後空白並轉小寫"""
+    return str(mode).strip().lower()
+
+
+def day_ranges(dates: Sequence[str]) -> List[Tuple[str, str]]:
+    """日期清單 → 合併連續日期後的半開區間 [(起日, 迄日次日), ...]"""
+    days = sorted({pd.Timestamp(d).normalize() for d in dates})
+    ranges: List[List[pd.Timestamp]] = []
+    for d in days:
+        if ranges and ranges[-1][1] == d: ranges[-1][1] = d + timedelta(days=1)
+        else: ranges.append([d, d + timedelta(days=1)])
+    return [(lo.strftime("%Y-%m-%d"), hi.strftime("%Y-%m-%d")) for lo, hi in ranges]
+
+
+@dataclass(frozen=True)
+class TableSchema:
+    table: str
+    date_col: str
+    dialect: str              # "mysql" / "sqlite"
+    columns: Tuple[str, ...]  # 資料表目前的所有欄位 (含產生欄位)
+
+    def q(self, name: str) -> str:
+        return f"`{name}`" if self.dialect == "mysql" else f'"{name}"'
+
+    @property
+    def migrated(self) -> bool:
+        """是否已執行 migrate_table (產生欄位都存在，mode 已正規化)"""
+        return all(c in self.columns for c in GENERATED_COLUMNS)
+
+    @property
+    def source_columns(self) -> List[str]:
+        """原始欄位 (不含產生欄位)；取代 SELECT * 使用"""
+        return [c for c in self.columns if c not in GENERATED_COLUMNS]
+
+    def select_list(self, columns: Optional[Sequence[str]] = None) -> str:
+        return ", ".join(self.q(c) for c in (self.source_columns if columns is None else columns))
+
+    def mode_predicate(self, param: str = "mode") -> str:
+        """mode 條件；參數值請用 normalize_mode(mode)"""
+        return f"mode = :{param}" if self.migrated else f"LOWER(TRIM(mode)) = :{param}"
+
+    def days_predicate(self, dates: Sequence[str], mode_param: str = "mode", prefix: str = "day") -> Tuple[str, dict]:
+        """mode 與日期清單條件，回傳 (SQL, 參數)：每段連續日期一個 (mode AND 半開區間)。
+
+        mode 條件放進每一段 OR 中，SQLite / MySQL 才會對每一段各做一次複合索引範圍掃描。
+        """
+        ts, mode_sql, parts, params = self.q(self.date_col), self.mode_predicate(mode_param), [], {}
+        for i, (lo, hi) in enumerate(day_ranges(dates)):
+            parts.append(f"({mode_sql} AND {ts} >= :{prefix}_lo_{i} AND {ts} < :{prefix}_hi_{i})")
+            params.update({f"{prefix}_lo_{i}": lo, f"{prefix}_hi_{i}": hi})
+        return ("(" + " OR ".join(parts) + ")" if parts else "1=0"), params
+
+    def bounds_select(self) -> str:
+        """最早 / 最晚日期 (min_d, max_d)：各以子查詢取 MIN / MAX，只讀時間戳記索引的兩端"""
+        ts, table = self.q(self.date_col), self.q(self.table)
+        return f"SELECT DATE((SELECT MIN({ts}) FROM {table})) AS min_d, DATE((SELECT MAX({ts}) FROM {table})) AS max_d"
+
+    def tail_stats_select(self, since_param: str = "since") -> str:
+        """各 mode 在 :since 之後的列數與最大時間戳記 (mode, n, wm)；以時間戳記索引做範圍掃描 (供 data_version 輪詢)。
+        SQLite 的 GROUP BY +mode 避免規劃器改用 (mode, 時間戳記) 索引掃描全表"""
+        ts = self.q(self.date_col)
+        group = "+mode" if self.dialect == "sqlite" else "mode"
+        return f"SELECT mode, COUNT(*) AS n, MAX({ts}) AS wm FROM {self.q(self.table)} WHERE {ts} >= :{since_param} GROUP BY {group}"
+
+    def range_predicate(self, lo_param: str = "start", hi_param: str = "end") -> str:
+        """時間戳記半開區間 [:lo, :hi)"""
+        ts = self.q(self.date_col)
+        return f"{ts} >= :{lo_param} AND {ts} < :{hi_param}"
+
+    def time_of_day(self, ts_expr: Optional[str] = None) -> str:
+        """當日時間 (HH:MM:SS) 的運算式；ts_expr 指定時 (例如 CTE 內的別名) 一律以函式計算"""
+        if ts_expr is None and "tod" in self.columns: return "tod"
+        return f"TIME({ts_expr or self.q(self.date_col)})"
+
+    def time_window_predicate(self, start_time: time, end_time: time, start_param: str = "start_time", end_param: str = "end_time") -> Tuple[str, dict]:
+        """每日時段條件；涵蓋整天時不加條件"""
+        if start_time == time(0, 0) and end_time >= time(23, 59, 59): return "1=1", {}
+        return (f"{self.time_of_day()} BETWEEN :{start_param} AND :{end_param}",
+                {start_param: start_time.strftime("%H:%M:%S"), end_param: end_time.strftime("%H:%M:%S")})
+
+    def price(self, column: str) -> str:
+        """價格欄位的數值運算式 (DECIMAL(10,2) 或產生欄位)"""
+        generated = PRICE_COLUMNS.get(column)
+        if generated and generated in self.columns: return self.q(generated)
+        return f"CAST({self.q(column)} AS {'DECIMAL(10,2)' if self.dialect == 'mysql' else 'REAL'})"
+
+
+def table_schema(engine, table: str, date_col: str = "時間戳記", refresh: bool = False) -> TableSchema:
+    """讀取資料表欄位 (依連線與資料表快取；migrate_table 後自動更新)"""
+    key = (str(engine.url), table)
+    with _LOCK:
+        if refresh or key not in _SCHEMAS:
+            cols = tuple(c["name"] for c in inspect(engine).get_columns(table))
+            _SCHEMAS[key] = TableSchema(table, date_col, "mysql" if engine.dialect.name == "mysql" else "sqlite", cols)
+        return _SCHEMAS[key]
+
+
+def recommended_index_sql(dialect: str, table: str, date_col: str = "時間戳記") -> str:
+    """建議的 (mode, 時間戳記) 複合索引；MySQL 的 TEXT 欄位需指定前綴長度"""
+    if dialect == "mysql":
+        return f"CREATE INDEX {RECOMMENDED_INDEX} ON `{table}` (mode(20), `{date_col}`(20))"
+    return f'CREATE INDEX IF NOT EXISTS {RECOMMENDED_INDEX} ON "{table}" (mode, "{date_col}")'
+
+
+def migrate_table(engine, table: str, date_col: str = "時間戳記") -> List[str]:
+    """把既有資料表改為可使用索引的結構，回傳執行的 SQL：
+
+    1. mode 正規化為 normalize_mode 的形式 (之後寫入的資料也必須先正規化)
+    2. 新增產生欄位 tod 與 *_num (MySQL 為 STORED；SQLite 只能以 ALTER 新增 VIRTUAL)
+    3. 沒有 (mode, 時間戳記) 複合索引時建立 RECOMMENDED_INDEX
+    """
+    schema = table_schema(engine, table, date_col, refresh=True)
+    mysql, q = schema.dialect == "mysql", schema.q
+    binary = "BINARY " if mysql else ""
+    statements = [f"UPDATE {q(table)} SET mode = LOWER(TRIM(mode)) WHERE {binary}mode <> LOWER(TRIM(mode))"]
+    if "tod" not in schema.columns:
+        statements.append(f"ALTER TABLE {q(table)} ADD COLUMN tod TIME AS (TIME({q(date_col)})) STORED" if mysql
+                          else f'ALTER TABLE {q(table)} ADD COLUMN tod TEXT GENERATED ALWAYS AS (TIME({q(date_col)})) VIRTUAL')
+    for src, col in PRICE_COLUMNS.items():
+        if col in schema.columns or src not in schema.columns: continue
+        statements.append(f"ALTER TABLE {q(table)} ADD COLUMN {col} DECIMAL(10,2) AS (CAST({q(src)} AS DECIMAL(10,2))) STORED" if mysql
+                          else f'ALTER TABLE {q(table)} ADD COLUMN {col} REAL GENERATED ALWAYS AS (ROUND(CAST({q(src)} AS REAL), 2)) VIRTUAL')
+    # 已有以 (mode, 時間戳記) 開頭的索引 (名稱不限) 時不重複建立
+    if not any(list(ix["column_names"][:2]) == ["mode", date_col] for ix in inspect(engine).get_indexes(table)):
+        statements.append(recommended_index_sql(schema.dialect, table, date_col))
+    with engine.begin() as c:
+        for sql in statements: c.execute(text(sql))
+    table_schema(engine, table, date_col, refresh=True)
+    return statements
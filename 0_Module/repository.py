@@ -0,0 +1,602 @@
+# 檔案：repository.py (資料存取層：MySQL / SQLite / 本地 Arrow 後端)
+"""所有頁面與模組對 atm 資料表的讀取都經過這裡。後端由設定決定：
+
+    環境變數 ATM_DATA_BACKEND (或 secrets.toml 的 data_backend)：
+        mysql   (預設) 雲端 Cloud SQL，經 st.connection("mysql")；已啟用本地鏡像時只查未鏡像的部分
+        sqlite  本地 3_DB/ATM_merge.db (路徑可用 ATM_SQLITE_PATH 覆寫)
+        arrow   只讀本地 Parquet 鏡像 (local_mirror)，以 pyarrow / pandas 向量化計算，完全離線
+
+各後端回傳的 fetch_intraday 為原始欄位 (未轉型)，轉型與排序由呼叫端處理；daily_filter 回傳
+render_output 表格所需的欄位與排序。SQLite / Arrow 後端的 daily_filter 以 pandas 實作與 MySQL CTE
+相同的規則 (_daily_filter_frame)。
+"""
+import os
+from abc import ABC, abstractmethod
+from dataclasses import dataclass, field
+from datetime import time, timedelta
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+import streamlit as st
+from sqlalchemy import text
+
+import local_mirror
+import perf_trace
+import query_builder
+from daily_summary import build_summary_query, summary_watermark
+from data_version import get_data_version
+from result_cache import RESULT_CACHE
+
+__all__ = ["DailyFilter", "Repository", "MySQLRepository", "SQLiteRepository", "ArrowRepository", "get_repository", "DAILY_FILTER_COLUMNS"]
+
+_ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SQLITE_PATH = os.environ.get("ATM_SQLITE_PATH", os.path.join(_ROOT_DIR, "3_DB", "ATM_merge.db"))
+
+DAILY_FILTER_COLUMNS = [
+    "日期", "星期", "FT日盤收盤", "FT漲跌(日盤)", "FT夜盤收盤", "FT漲跌(夜盤)", "日盤收盤的價平和(價平)", "夜盤收盤的價平和(價平)",
+    "FT次交易日日盤收盤", "FT次交易日(FT漲跌-日盤)", "FT次交易日夜盤收盤", "FT次交易日(FT漲跌-夜盤)",
+    "次交易日日盤收盤的價平和(價平)", "次交易日夜盤收盤的價平和(價平)",
+]
+_SOURCE_COLUMNS = ["FT價格", "FT漲跌", "價平和(價平)", "價平和漲跌(價平)"]
+_WEEKDAY_CH = ['一', '二', '三', '四', '五', '六', '日']
+
+
+@dataclass
+class DailyFilter:
+    """render_output 的篩選條件；weekdays 為 1(一) ~ 6(六)，空清單代表週一至週六"""
+    start_date: str
+    end_date: str
+    mode: str = "1344"
+    weekdays: List[int] = field(default_factory=list)
+    time_range: Optional[Tuple[str, str]] = None          # ("HH:MM", "HH:MM")
+    ft_price_range: Optional[Tuple[float, float]] = None
+    kph_range: Optional[Tuple[float, float]] = None
+    ft_change_target: Optional[str] = None                # "MaxUp" / "MaxDown"
+    ft_change_range: Tuple[float, float] = (0.0, 0.0)
+    kph_change_target: Optional[str] = None               # "KphMaxUp" / "KphMaxDown"
+    kph_change_range: Tuple[float, float] = (0.0, 0.0)
+
+    @property
+    def has_minute_filters(self) -> bool:
+        return any(r is not None for r in (self.time_range, self.ft_price_range, self.kph_range))
+
+    def cache_key(self) -> tuple:
+        """正規化後的篩選條件 (日期格式、mode 大小寫、星期順序、未啟用目標的數值都不影響)"""
+        day = lambda v: pd.to_datetime(v).strftime("%Y-%m-%d")
+        span = lambda r: None if r is None else (float(r[0]), float(r[1]))
+        return (
+            day(self.start_date), day(self.end_date), str(self.mode).strip().lower(),
+            tuple(sorted(set(self.weekdays))) or (1, 2, 3, 4, 5, 6),
+            None if self.time_range is None else (_seconds(self.time_range[0]), _seconds(self.time_range[1])),
+            span(self.ft_price_range), span(self.kph_range),
+            self.ft_change_target, span(self.ft_change_range) if self.ft_change_target else None,
+            self.kph_change_target, span(self.kph_change_range) if self.kph_change_target else None,
+        )
+
+
+class Repository(ABC):
+    """資料存取介面；後端必須實作所有 abstractmethod (缺少時在建立實例時就失敗)。
+    fetch_between、tail_stats、daily_filter 有共用的預設實作，後端可視需要覆寫"""
+    name = "base"
+
+    def __init__(self, table: str = "atm", date_col: str = "時間戳記"):
+        self.table, self.date_col = table, date_col
+
+    @abstractmethod
+    def fetch_intraday(self, mode, dates: Optional[List[str]] = None, start_date: Optional[str] = None, end_date: Optional[str] = None,
+                       start_time: time = time(0, 0), end_time: time = time(23, 59, 59), columns: Optional[List[str]] = None) -> pd.DataFrame:
+        """取回分時原始資料：dates 為日期清單，或以 [start_date, end_date] 每日 start_time ~ end_time 指定；columns 為 None 時取回全部欄位"""
+
+    def fetch_between(self, mode, start_ts: str, end_ts: str, columns: Optional[List[str]] = None) -> pd.DataFrame:
+        """取回時間戳記在 [start_ts, end_ts) ('YYYY-MM-DD HH:MM:SS') 的分時原始資料；預設依日期範圍取回後在記憶體中裁切"""
+        last_day = (pd.Timestamp(end_ts) - pd.Timedelta(seconds=1)).strftime("%Y-%m-%d")
+        rows = self.fetch_intraday(mode, start_date=str(start_ts)[:10], end_date=last_day, columns=columns)
+        if rows.empty: return rows
+        ts = _parse_timestamps(rows[self.date_col])
+        return rows[(ts >= pd.Timestamp(start_ts)) & (ts < pd.Timestamp(end_ts))].reset_index(drop=True)
+
+    @abstractmethod
+    def unique_dates(self, mode, session_start: Optional[time] = None) -> List[str]:
+        """有資料的曆日 ('YYYY-MM-DD')；指定 session_start 時只列出該時刻之後仍有資料的日期
+        (排除只有前一交易日夜盤延續到凌晨的曆日，例如週六)"""
+
+    @abstractmethod
+    def date_bounds(self) -> Tuple[Optional[str], Optional[str]]:
+        """最早 / 最晚的日期 ('YYYY-MM-DD')"""
+
+    @abstractmethod
+    def years(self) -> List[str]:
+        """有資料的年份 ('YYYY')"""
+
+    @abstractmethod
+    def data_watermark(self):
+        """資料版本：資料表目前的最大時間戳記，供結果快取判斷是否失效"""
+
+    def tail_stats(self, since: str) -> pd.DataFrame:
+        """時間戳記 >= since 的各 mode 列數與最大時間戳記 (mode, n, wm)，供 data_version 輪詢；
+        預設只回報整表水位 (mode 為 None)"""
+        wm = self.data_watermark()
+        return pd.DataFrame({"mode": [None], "n": [0], "wm": [wm]}) if wm is not None else pd.DataFrame(columns=["mode", "n", "wm"])
+
+    def daily_filter(self, f: DailyFilter) -> pd.DataFrame:
+        """依 f 篩選交易日，回傳 DAILY_FILTER_COLUMNS (依日期遞減)"""
+        rows = self.fetch_intraday(f.mode, start_date=f.start_date, end_date=f.end_date, columns=_SOURCE_COLUMNS)
+        with perf_trace.span("pandas:daily_filter_frame") as sp:
+            return sp.observe(_daily_filter_frame(rows, self.date_col, f))
+
+    def _columns(self, columns: Optional[List[str]]) -> Optional[List[str]]:
+        return None if columns is None else list(dict.fromkeys([self.date_col] + list(columns)))
+
+
+# --- 1. MySQL (雲端) ---
+
+def _weekday_mysql(weekdays: List[int]) -> str:
+    if not weekdays: return "2,3,4,5,6,7"
+    mapping = {1:2, 2:3, 3:4, 4:5, 5:6, 6:7}
+    return ",".join(str(mapping.get(d, 0)) for d in sorted(weekdays))
+
+
+def _query_remote_or_empty(query, boundary) -> pd.DataFrame:
+    """查詢尚未鏡像的資料；已有本地鏡像 (boundary 不為 None) 而雲端連不上時，只用本地資料"""
+    try:
+        return query()
+    except Exception as e:
+        if boundary is None:
+            raise
+        st.caption(f"⚠️ 無法連線雲端資料庫，僅顯示 {boundary} 之前的本地鏡像資料：{e}")
+        return pd.DataFrame()
+
+
+def _parse_timestamps(values: pd.Series) -> pd.Series:
+    """時間戳記轉為 datetime64；後端已回傳 datetime 時不重新解析，字串先以 ISO 8601 快速解析，失敗才逐筆推斷"""
+    if pd.api.types.is_datetime64_any_dtype(values):
+        return values
+    try:
+        return pd.to_datetime(values, format="ISO8601")
+    except (ValueError, TypeError):
+        return pd.to_datetime(values, errors="coerce")
+
+
+def _filter_time_of_day(rows: pd.DataFrame, date_col: str, start_time: time, end_time: time) -> pd.DataFrame:
+    """等同 TIME(ts) BETWEEN start_time AND end_time"""
+    if start_time == time(0, 0) and end_time >= time(23, 59, 59): return rows
+    dt = _parse_timestamps(rows[date_col])
+    tod = (dt - dt.dt.normalize()).dt.total_seconds()
+    lo_sec, hi_sec = (t.hour * 3600 + t.minute * 60 + t.second for t in (start_time, end_time))
+    return rows[(tod >= lo_sec) & (tod <= hi_sec)]
+
+
+class MySQLRepository(Repository):
+    """雲端 MySQL；啟用 local_mirror 時，鏡像水位之前的日期從本地 Parquet 讀取"""
+    name = "mysql"
+
+    def __init__(self, table: str = "atm", date_col: str = "時間戳記", chunk_days: int = 366):
+        super().__init__(table, date_col)
+        self.chunk_days = chunk_days
+        self._last_watermark: Optional[str] = None
+
+    @property
+    def conn(self):
+        conn = st.connection("mysql", type="sql")
+        perf_trace.watch_engine(conn.engine)
+        return conn
+
+    @property
+    def schema(self) -> query_builder.TableSchema:
+        return query_builder.table_schema(self.conn.engine, self.table, self.date_col)
+
+    def _cached_query(self, label: str, sql: str, params: Optional[dict] = None, end=None, mode=None) -> pd.DataFrame:
+        """依資料版本快取的查詢 (result_cache，見 data_version)：結果只涵蓋歷史曆日 (end 早於最新曆日) 時永不失效，
+        涵蓋最新一天 (或 end 為 None 的整表查詢) 時在該 mode 有新資料後失效；無法取得版本時直接查詢。
+        回傳的 DataFrame 由所有 session 共用，呼叫端不可原地修改"""
+        version = get_data_version(self).for_range(end, mode)
+        key = ("mysql", self.table, label, sql, tuple(sorted((params or {}).items())))
+        with perf_trace.span(f"mysql:{label}", kind="db") as sp:
+            df = RESULT_CACHE.get(key, version) if version is not None else None
+            if df is None:
+                with self.conn.session as s:
+                    df = pd.read_sql(text(sql), s.connection(), params=params or {})
+                if version is not None: RESULT_CACHE.put(key, version, df)
+            return sp.observe(df)
+
+    def _read_uncached(self, label: str, sql: str, params: dict) -> pd.DataFrame:
+        """不經 st.cache_data 的查詢；每日篩選結果改由 result_cache 依資料水位快取"""
+        with perf_trace.span(f"mysql:{label}", kind="db") as sp, self.conn.session as s:
+            return sp.observe(pd.read_sql(text(sql), s.connection(), params=params))
+
+    def fetch_intraday(self, mode, dates=None, start_date=None, end_date=None, start_time=time(0, 0), end_time=time(23, 59, 59), columns=None):
+        boundary = local_mirror.mirror_boundary(self.table, self.date_col)
+        if dates is not None:
+            local_days = [d for d in dates if boundary and d < boundary]
+            remote_days = [d for d in dates if not (boundary and d < boundary)]
+            parts = [local_mirror.read_rows(self.table, mode, dates=local_days, columns=self._columns(columns))] if local_days else []
+            if remote_days:
+                parts.append(_query_remote_or_empty(lambda: self._query_days(mode, remote_days, columns), boundary))
+        else:
+            parts = self._fetch_range(mode, start_date, end_date, start_time, end_time, columns, boundary)
+        parts = [p for p in parts if not p.empty]
+        return pd.concat(parts, ignore_index=True) if parts else pd.DataFrame()
+
+    def fetch_between(self, mode, start_ts, end_ts, columns=None):
+        boundary = local_mirror.mirror_boundary(self.table, self.date_col)
+        if boundary and str(start_ts) < boundary:
+            return super().fetch_between(mode, start_ts, end_ts, columns)  # 含鏡像日期：本地與雲端分段讀取後裁切
+
+        def query():
+            schema = self.schema
+            sql_query = f"""
+                SELECT {schema.select_list(self._columns(columns))}
+                FROM `{self.table}`
+                WHERE {schema.mode_predicate()} AND {schema.range_predicate("start_ts", "end_ts")}
+                ORDER BY `{self.date_col}`
+            """
+            return self._cached_query("fetch_between", sql_query, {"mode": query_builder.normalize_mode(mode), "start_ts": str(start_ts), "end_ts": str(end_ts)},
+                                      end=end_ts, mode=mode)
+        return _query_remote_or_empty(query, boundary)
+
+    def _query_days(self, mode, date_list: List[str], columns: Optional[List[str]]) -> pd.DataFrame:
+        schema = self.schema
+        # 每段連續日期一個時間戳記半開區間 (可使用 (mode, 時間戳記) 索引)
+        days_sql, params = schema.days_predicate(date_list)
+        sql_query = f"""
+            SELECT {schema.select_list(self._columns(columns))}
+            FROM `{self.table}`
+            WHERE {days_sql}
+            ORDER BY `{self.date_col}`
+        """
+        params["mode"] = query_builder.normalize_mode(mode)
+        return self._cached_query("fetch_days", sql_query, params, end=max(date_list), mode=mode)
+
+    def _fetch_range(self, mode, start_date, end_date, start_time, end_time, columns, boundary) -> List[pd.DataFrame]:
+        """以時間戳記範圍條件查詢，範圍過大時依 chunk_days 切段；鏡像水位之前從本地讀取 (時間窗在記憶體中篩選)"""
+        start_ts, end_ts = pd.to_datetime(start_date, errors="coerce"), pd.to_datetime(end_date, errors="coerce")
+        if pd.isna(start_ts) or pd.isna(end_ts) or start_ts > end_ts:
+            return []
+        cols = self._columns(columns)
+        chunks = []
+        chunk_start, last_day = start_ts.normalize(), end_ts.normalize()
+        if boundary and chunk_start < pd.Timestamp(boundary):
+            local_end = min(last_day, pd.Timestamp(boundary) - timedelta(days=1))
+            local = local_mirror.read_rows(self.table, mode, start_date=chunk_start.strftime("%Y-%m-%d"), end_date=local_end.strftime("%Y-%m-%d"), columns=cols)
+            if not local.empty:
+                chunks.append(_filter_time_of_day(local, self.date_col, start_time, end_time))
+            chunk_start = local_end + timedelta(days=1)
+
+        def query(chunk_start, chunk_end):
+            schema = self.schema
+            window_sql, params = schema.time_window_predicate(start_time, end_time)
+            sql_query = f"""
+                SELECT {schema.select_list(cols)}
+                FROM `{self.table}`
+                WHERE {schema.mode_predicate()}
+                  AND {schema.range_predicate("chunk_start", "chunk_end")}
+                  AND {window_sql}
+                ORDER BY `{self.date_col}`
+            """
+            params.update({"mode": query_builder.normalize_mode(mode), "chunk_start": chunk_start.strftime("%Y-%m-%d"), "chunk_end": chunk_end.strftime("%Y-%m-%d")})
+            return self._cached_query("fetch_range", sql_query, params, end=chunk_end - timedelta(days=1), mode=mode)
+
+        while chunk_start <= last_day:
+            chunk_end = min(chunk_start + timedelta(days=self.chunk_days), last_day + timedelta(days=1))
+            chunks.append(_query_remote_or_empty(lambda: query(chunk_start, chunk_end), boundary))
+            chunk_start = chunk_end
+        return chunks
+
+    def unique_dates(self, mode, session_start=None) -> List[str]:
+        boundary = local_mirror.mirror_boundary(self.table, self.date_col)
+        session_sql = lambda: f" AND {self.schema.time_of_day()} >= :session_start" if session_start else ""
+        sql = lambda: f"""
+            SELECT DISTINCT DATE(`{self.date_col}`) AS d
+            FROM `{self.table}`
+            WHERE {self.schema.mode_predicate()}{f" AND `{self.date_col}` >= :boundary" if boundary else ""}{session_sql()}
+            ORDER BY d
+        """
+        params = {'mode': query_builder.normalize_mode(mode)}
+        if boundary: params['boundary'] = boundary
+        if session_start: params['session_start'] = session_start.strftime("%H:%M:%S")
+        # 該 mode 在最新曆日有新資料時才重新查詢 (data_version)
+        df = _query_remote_or_empty(lambda: self._cached_query("trading_days" if session_start else "unique_dates", sql(), params, mode=mode), boundary)
+        days = pd.to_datetime(df['d']).dt.strftime('%Y-%m-%d').tolist() if not df.empty else []
+        if boundary:
+            days = sorted({d for d in local_mirror.distinct_dates(self.table, mode, self.date_col, session_start) if d < boundary} | set(days))
+        return days
+
+    def date_bounds(self):
+        boundary = local_mirror.mirror_boundary(self.table, self.date_col)
+        where = f' WHERE `{self.date_col}` >= :boundary' if boundary else ''
+        # DATE(MIN(ts)) 可直接由時間戳記索引的兩端取得；MIN(DATE(ts)) 需要掃描全表
+        q = f'SELECT DATE(MIN(`{self.date_col}`)) AS min_d, DATE(MAX(`{self.date_col}`)) AS max_d FROM `{self.table}`{where}'
+        s = _query_remote_or_empty(lambda: self._cached_query("date_bounds", q, {"boundary": boundary} if boundary else None), boundary)
+        bounds = [] if s.empty else [str(v) for v in (s.at[0, "min_d"], s.at[0, "max_d"]) if pd.notna(v)]
+        if boundary: bounds += [d for d in local_mirror.date_bounds(self.table) if d]
+        return (min(bounds), max(bounds)) if bounds else (None, None)
+
+    def years(self) -> List[str]:
+        boundary = local_mirror.mirror_boundary(self.table, self.date_col)
+        where = f' AND `{self.date_col}` >= :boundary' if boundary else ''
+        q = f'SELECT DISTINCT SUBSTR(`{self.date_col}`,1,4) AS y FROM `{self.table}` WHERE `{self.date_col}` IS NOT NULL{where} ORDER BY 1'
+        df = _query_remote_or_empty(lambda: self._cached_query("years", q, {"boundary": boundary} if boundary else None), boundary)
+        ser = list(df["y"]) if not df.empty else []
+        if boundary: ser += local_mirror.years(self.table)
+        return _clean_years(ser)
+
+    def data_watermark(self):
+        # 只掃描上次水位之後的資料 (時間戳記索引可用)；第一次呼叫才掃描全表
+        with perf_trace.span("mysql:data_watermark", kind="db"), self.conn.session as s:
+            value = s.execute(text(f"SELECT MAX(`{self.date_col}`) FROM `{self.table}` WHERE `{self.date_col}` >= :since"),
+                              {"since": self._last_watermark or ""}).scalar()
+        if value is not None: self._last_watermark = str(value)
+        return self._last_watermark
+
+    def tail_stats(self, since):
+        return self._read_uncached("tail_stats", self.schema.tail_stats_select(), {"since": str(since)})
+
+    def daily_filter(self, f: DailyFilter) -> pd.DataFrame:
+        params = {}
+        target_filter_sql = "1=1"
+        if f.ft_change_target: target_filter_sql = f"({f.ft_change_target} BETWEEN :min_value AND :max_value)"; params.update({"min_value": f.ft_change_range[0], "max_value": f.ft_change_range[1]})
+        kph_filter_sql = "1=1"
+        if f.kph_change_target: kph_filter_sql = f"({f.kph_change_target} BETWEEN :min_kph_value AND :max_kph_value)"; params.update({"min_kph_value": f.kph_change_range[0], "max_kph_value": f.kph_change_range[1]})
+        wk_sql = _weekday_mysql(f.weekdays or [])
+        # 無分鐘級篩選且每日彙總表已涵蓋該 mode 的最新資料 (由 ingest.py 更新) 時改查彙總表 (結果與下方 CTE 相同)，否則退回 CTE
+        if not f.has_minute_filters:
+            try:
+                done, wm = summary_watermark(self.conn, self.table, f.mode), get_data_version(self).mode_watermark(f.mode)
+                if done is not None and (wm is None or done >= wm):
+                    main_params = {"start_date": str(f.start_date), "end_date": str(f.end_date), "mode": f.mode}; main_params.update(params)
+                    return self._read_uncached("daily_summary", build_summary_query(self.table, wk_sql, target_filter_sql, kph_filter_sql), main_params)
+                st.caption("ℹ️ 每日彙總表尚未包含最新資料 (以 ingest.py 匯入後更新)，改用完整查詢")
+            except Exception as e:
+                st.caption(f"⚠️ 每日彙總表無法使用，改用完整查詢：{e}")
+        end_date_plus_one = (pd.to_datetime(f.end_date) + pd.Timedelta(days=1)).strftime('%Y-%m-%d')
+        main_params = {"start_date": f.start_date, "end_date_plus_one": end_date_plus_one, "mode": query_builder.normalize_mode(f.mode)}; main_params.update(params)
+        range_data_where_clauses = []
+        if f.time_range: range_data_where_clauses.append("tod BETWEEN :min_time AND :max_time"); main_params.update({"min_time": f.time_range[0], "max_time": f.time_range[1]})
+        if f.ft_price_range: range_data_where_clauses.append('ft_price BETWEEN :min_ft_price AND :max_ft_price'); main_params.update({"min_ft_price": f.ft_price_range[0], "max_ft_price": f.ft_price_range[1]})
+        if f.kph_range: range_data_where_clauses.append('kph_price BETWEEN :min_kph AND :max_kph'); main_params.update({"min_kph": f.kph_range[0], "max_kph": f.kph_range[1]})
+        range_data_where_sql = " AND ".join(range_data_where_clauses) if range_data_where_clauses else "1=1"
+        date_col, table, schema = self.date_col, self.table, self.schema
+        # 時段與價格在 base 中算一次 (已遷移的資料表直接讀產生欄位)；base 的時間戳記條件與 mode 條件可使用索引
+        sql = f"""
+        WITH base AS (
+            SELECT DATE(`{date_col}`) AS d, `{date_col}` AS ts, {schema.time_of_day()} AS tod, mode, `FT價格`, `FT漲跌`, `價平和(價平)`, `價平和漲跌(價平)`,
+                   {schema.price("FT價格")} AS ft_price, {schema.price("價平和(價平)")} AS kph_price,
+                   {schema.price("FT漲跌")} AS ft_chg, {schema.price("價平和漲跌(價平)")} AS kph_chg
+            FROM `{table}`
+            WHERE {schema.range_predicate("start_date", "end_date_plus_one")}
+              AND {schema.mode_predicate()}
+        ), RangeData AS (
+            SELECT d, ft_chg, kph_chg
+            FROM base WHERE {range_data_where_sql}
+        ), TargetDates AS (
+            SELECT d, COALESCE(MAX(CASE WHEN ft_chg > 0 THEN ft_chg ELSE NULL END), 0.0) AS MaxUp, COALESCE(MIN(CASE WHEN ft_chg < 0 THEN ft_chg ELSE NULL END), 0.0) AS MaxDown,
+            COALESCE(MAX(CASE WHEN kph_chg > 0 THEN kph_chg ELSE NULL END), 0.0) AS KphMaxUp, COALESCE(MIN(CASE WHEN kph_chg < 0 THEN kph_chg ELSE NULL END), 0.0) AS KphMaxDown
+            FROM RangeData GROUP BY d HAVING ({target_filter_sql}) AND ({kph_filter_sql})
+        ), FilteredBase AS (SELECT b.* FROM base b JOIN TargetDates td ON td.d = b.d
+        ), day_close AS (
+            -- 【最終修正】改為從 base 讀取，避免受到分鐘級篩選影響
+            SELECT d, MAX(ts) AS ts_day_close FROM base WHERE tod <= '13:44:59' GROUP BY d
+        ), night_close AS (
+            SELECT x.d, MAX(x.ts) AS ts_night_close FROM (
+                -- 【最終修正】改為從 base 讀取，避免受到分鐘級篩選影響
+                SELECT DATE(CASE WHEN tod < '05:00:00' THEN DATE_SUB(ts, INTERVAL 1 DAY) ELSE ts END) AS d, ts
+                FROM base WHERE tod >= '15:00:00' OR tod < '05:00:00'
+            ) x GROUP BY x.d
+        ), All_Day_Close_TS AS (SELECT d, MAX(ts) AS ts_day_close FROM base WHERE tod <= '13:44:59' GROUP BY d
+        ), All_Night_Close_TS AS (
+            SELECT x.d, MAX(x.ts) AS ts_night_close FROM (
+                SELECT DATE(CASE WHEN tod < '05:00:00' THEN DATE_SUB(ts, INTERVAL 1 DAY) ELSE ts END) AS d, ts
+                FROM base WHERE tod >= '15:00:00' OR tod < '05:00:00'
+            ) x GROUP BY x.d
+        ), AllTradeDates AS (SELECT DISTINCT d FROM base ORDER BY d
+        ), NextTradeDates AS (SELECT d AS d_today, LEAD(d, 1) OVER (ORDER BY d) AS d_next_trade FROM AllTradeDates
+        ), next_trade AS (
+            SELECT t.d AS d_today, ntd.d_next_trade FROM TargetDates t JOIN NextTradeDates ntd ON ntd.d_today = t.d WHERE ntd.d_next_trade IS NOT NULL
+        ), today_day AS (SELECT dc.d, b.`FT價格` AS ft_day_close, b.`FT漲跌` AS ft_day_chg, b.`價平和(價平)` AS kph_day_close FROM day_close dc JOIN base b ON b.ts = dc.ts_day_close
+        ), today_night AS (SELECT nc.d, b.`FT價格` AS ft_night_close, b.`FT漲跌` AS ft_night_chg, b.`價平和(價平)` AS kph_night_close FROM night_close nc JOIN base b ON b.ts = nc.ts_night_close
+        ), nd_day AS (SELECT nt.d_today AS d, b.`FT價格` AS ft_nd_day_close, b.`FT漲跌` AS ft_nd_day_chg, b.`價平和(價平)` AS kph_nd_day_close FROM next_trade nt JOIN All_Day_Close_TS d2 ON d2.d = nt.d_next_trade JOIN base b ON b.ts = d2.ts_day_close
+        ), nd_night AS (SELECT nt.d_today AS d, b.`FT價格` AS ft_nd_night_close, b.`FT漲跌` AS ft_nd_night_chg, b.`價平和(價平)` AS kph_nd_night_close FROM next_trade nt JOIN All_Night_Close_TS n2 ON n2.d = nt.d_next_trade JOIN base b ON b.ts = n2.ts_night_close
+        )
+        SELECT
+            t.d AS 日期,
+            CASE DAYOFWEEK(t.d) WHEN 1 THEN '日' WHEN 2 THEN '一' WHEN 3 THEN '二' WHEN 4 THEN '三' WHEN 5 THEN '四' WHEN 6 THEN '五' WHEN 7 THEN '六' END AS 星期,
+            t.ft_day_close AS `FT日盤收盤`, t.ft_day_chg AS `FT漲跌(日盤)`, tn.ft_night_close AS `FT夜盤收盤`, tn.ft_night_chg AS `FT漲跌(夜盤)`,
+            t.kph_day_close AS `日盤收盤的價平和(價平)`, tn.kph_night_close AS `夜盤收盤的價平和(價平)`,
+            nd.ft_nd_day_close AS `FT次交易日日盤收盤`, nd.ft_nd_day_chg AS `FT次交易日(FT漲跌-日盤)`, nn.ft_nd_night_close AS `FT次交易日夜盤收盤`, nn.ft_nd_night_chg AS `FT次交易日(FT漲跌-夜盤)`,
+            nd.kph_nd_day_close AS `次交易日日盤收盤的價平和(價平)`, nn.kph_nd_night_close AS `次交易日夜盤收盤的價平和(價平)`
+        FROM TargetDates td JOIN today_day t ON t.d = td.d
+        LEFT JOIN today_night tn ON tn.d = t.d LEFT JOIN nd_day nd ON nd.d = t.d LEFT JOIN nd_night nn ON nn.d = t.d
+        WHERE DAYOFWEEK(t.d) IN ({wk_sql}) ORDER BY t.d DESC;
+        """
+        return self._read_uncached("daily_filter_cte", sql, main_params)
+
+
+# --- 2. SQLite (本地 ATM_merge.db) ---
+
+class SQLiteRepository(Repository):
+    """本地 SQLite；查詢條件同 MySQL 由 query_builder 產生 (函式改用 SQLite 的 DATE() / TIME())，每日篩選由 pandas 計算"""
+    name = "sqlite"
+
+    def __init__(self, table: str = "atm", date_col: str = "時間戳記", path: str = SQLITE_PATH):
+        super().__init__(table, date_col)
+        self.path = path
+        from sqlalchemy import create_engine
+        self.engine = create_engine(f"sqlite:///{path}")
+        perf_trace.watch_engine(self.engine)
+
+    def _query(self, sql: str, params: Optional[dict] = None, label: str = "query") -> pd.DataFrame:
+        with perf_trace.span(f"sqlite:{label}", kind="db") as sp, self.engine.connect() as c:
+            return sp.observe(pd.read_sql(text(sql), c, params=params or {}))
+
+    @property
+    def schema(self) -> query_builder.TableSchema:
+        return query_builder.table_schema(self.engine, self.table, self.date_col)
+
+    def fetch_intraday(self, mode, dates=None, start_date=None, end_date=None, start_time=time(0, 0), end_time=time(23, 59, 59), columns=None):
+        schema = self.schema
+        if dates is not None:
+            if not dates: return pd.DataFrame()
+            where, params = schema.days_predicate(dates)
+        else:
+            end_plus_one = (pd.to_datetime(end_date) + pd.Timedelta(days=1)).strftime('%Y-%m-%d')
+            window_sql, params = schema.time_window_predicate(start_time, end_time)
+            params.update({"start": str(start_date), "end": end_plus_one})
+            where = f"{schema.mode_predicate()} AND {schema.range_predicate('start', 'end')} AND {window_sql}"
+        params["mode"] = query_builder.normalize_mode(mode)
+        sql = f'SELECT {schema.select_list(self._columns(columns))} FROM "{self.table}" WHERE {where} ORDER BY "{self.date_col}"'
+        return self._query(sql, params, label="fetch_intraday")
+
+    def fetch_between(self, mode, start_ts, end_ts, columns=None):
+        schema = self.schema
+        sql = f'SELECT {schema.select_list(self._columns(columns))} FROM "{self.table}" WHERE {schema.mode_predicate()} AND {schema.range_predicate("start_ts", "end_ts")} ORDER BY "{self.date_col}"'
+        return self._query(sql, {"mode": query_builder.normalize_mode(mode), "start_ts": str(start_ts), "end_ts": str(end_ts)}, label="fetch_between")
+
+    def unique_dates(self, mode, session_start=None) -> List[str]:
+        params = {"mode": query_builder.normalize_mode(mode)}
+        session_sql = ""
+        if session_start:
+            session_sql = f" AND {self.schema.time_of_day()} >= :session_start"; params["session_start"] = session_start.strftime("%H:%M:%S")
+        df = self._query(f'SELECT DISTINCT DATE("{self.date_col}") AS d FROM "{self.table}" WHERE {self.schema.mode_predicate()}{session_sql} ORDER BY d',
+                         params, label="unique_dates")
+        return df["d"].dropna().astype(str).tolist()
+
+    def date_bounds(self):
+        s = self._query(self.schema.bounds_select(), label="date_bounds")
+        if s.empty or pd.isna(s.at[0, "min_d"]): return None, None
+        return str(s.at[0, "min_d"]), str(s.at[0, "max_d"])
+
+    def years(self) -> List[str]:
+        df = self._query(f'SELECT DISTINCT SUBSTR("{self.date_col}",1,4) AS y FROM "{self.table}" WHERE "{self.date_col}" IS NOT NULL ORDER BY 1', label="years")
+        return _clean_years(df["y"].tolist())
+
+    def data_watermark(self):
+        return self._query(f'SELECT MAX("{self.date_col}") AS wm FROM "{self.table}"', label="data_watermark").at[0, "wm"]
+
+    def tail_stats(self, since):
+        return self._query(self.schema.tail_stats_select(), {"since": str(since)}, label="tail_stats")
+
+
+# --- 3. Arrow (本地 Parquet 鏡像，完全離線) ---
+
+class ArrowRepository(Repository):
+    """只讀 local_mirror 的 Parquet 鏡像 (不自動同步、不連線)；欄位投影與 mode / 月份 / 日期條件下推給 pyarrow，
+    tail_stats 沿用預設 (鏡像只有整表水位)"""
+    name = "arrow"
+
+    def fetch_intraday(self, mode, dates=None, start_date=None, end_date=None, start_time=time(0, 0), end_time=time(23, 59, 59), columns=None):
+        if dates is not None:
+            return local_mirror.read_rows(self.table, mode, dates=list(dates), columns=self._columns(columns)) if dates else pd.DataFrame()
+        rows = local_mirror.read_rows(self.table, mode, start_date=str(start_date), end_date=str(end_date), columns=self._columns(columns))
+        return _filter_time_of_day(rows, self.date_col, start_time, end_time) if not rows.empty else rows
+
+    def unique_dates(self, mode, session_start=None) -> List[str]:
+        return local_mirror.distinct_dates(self.table, mode, self.date_col, session_start)
+
+    def date_bounds(self):
+        return local_mirror.date_bounds(self.table)
+
+    def years(self) -> List[str]:
+        return _clean_years(local_mirror.years(self.table))
+
+    def data_watermark(self):
+        return local_mirror.mirror_watermark(self.table)
+
+
+# --- 4. 共用：年份清理與 pandas 版每日篩選 ---
+
+def _clean_years(values) -> List[str]:
+    years = []
+    for v in values:
+        if pd.isna(v): continue
+        s = str(v).strip()
+        if s.isdigit():
+            y = int(s)
+            if 1900 <= y <= 2100: years.append(str(y))
+    return sorted(set(years))
+
+
+def _seconds(t: str) -> int:
+    """'HH:MM' / 'HH:MM:SS' 轉為當日秒數 (同 MySQL TIME('HH:MM'))"""
+    parts = [int(p) for p in str(t).split(":")] + [0, 0]
+    return parts[0] * 3600 + parts[1] * 60 + parts[2]
+
+
+def _last_row_per(keys: np.ndarray, order_ts: np.ndarray, mask: np.ndarray) -> Dict:
+    """mask 內每個 key 時間戳記最大的列位置"""
+    pos = np.flatnonzero(mask)
+    if len(pos) == 0: return {}
+    s = pd.DataFrame({"k": keys[pos], "ts": order_ts[pos], "pos": pos}).sort_values(["k", "ts"], kind="stable")
+    last = s.drop_duplicates("k", keep="last")
+    return dict(zip(last["k"], last["pos"]))
+
+
+def _daily_filter_frame(rows: pd.DataFrame, date_col: str, f: DailyFilter) -> pd.DataFrame:
+    """以 pandas 計算與 MySQL CTE 相同的每日篩選結果"""
+    if rows.empty: return pd.DataFrame(columns=DAILY_FILTER_COLUMNS)
+    dt = _parse_timestamps(rows[date_col])
+    rows = rows[dt.notna()].reset_index(drop=True); dt = dt[dt.notna()].reset_index(drop=True)
+    day = dt.dt.normalize()
+    ts = dt.to_numpy()
+    tod = (dt - day).dt.total_seconds().to_numpy()
+    d = day.dt.date.to_numpy()
+    num = {c: pd.to_numeric(rows[c], errors="coerce") if c in rows.columns else pd.Series(np.nan, index=rows.index) for c in _SOURCE_COLUMNS}
+
+    # RangeData / TargetDates：分鐘級篩選後每日的漲跌極值
+    keep = np.ones(len(rows), dtype=bool)
+    if f.time_range: keep &= (tod >= _seconds(f.time_range[0])) & (tod <= _seconds(f.time_range[1]))
+    if f.ft_price_range: keep &= num["FT價格"].round(2).between(*f.ft_price_range).to_numpy()
+    if f.kph_range: keep &= num["價平和(價平)"].round(2).between(*f.kph_range).to_numpy()
+    ft_chg, kph_chg = num["FT漲跌"].round(2), num["價平和漲跌(價平)"].round(2)
+    g = pd.DataFrame({"d": d, "up": ft_chg.where(ft_chg > 0), "down": ft_chg.where(ft_chg < 0),
+                      "kup": kph_chg.where(kph_chg > 0), "kdown": kph_chg.where(kph_chg < 0)})[keep]
+    target = g.groupby("d").agg(MaxUp=("up", "max"), MaxDown=("down", "min"), KphMaxUp=("kup", "max"), KphMaxDown=("kdown", "min")).fillna(0.0)
+    if f.ft_change_target: target = target[target[f.ft_change_target].between(*f.ft_change_range)]
+    if f.kph_change_target: target = target[target[f.kph_change_target].between(*f.kph_change_range)]
+
+    # 收盤：日盤 TIME <= 13:44:59；夜盤 15:00 後至次一曆日 05:00 前 (歸屬前一曆日)
+    day_close = _last_row_per(d, ts, tod <= 13 * 3600 + 44 * 60 + 59)
+    night_d = np.where(tod < 5 * 3600, (day - pd.Timedelta(days=1)).dt.date.to_numpy(), d)
+    night_close = _last_row_per(night_d, ts, (tod >= 15 * 3600) | (tod < 5 * 3600))
+    all_days = sorted(set(d))
+    next_day = dict(zip(all_days[:-1], all_days[1:]))
+    weekdays = set(f.weekdays or [1, 2, 3, 4, 5, 6])
+
+    def values(pos):
+        if pos is None: return [None, None, None]
+        return [num["FT價格"].iat[pos], num["FT漲跌"].iat[pos], num["價平和(價平)"].iat[pos]]
+
+    out = []
+    for td in sorted(target.index, reverse=True):
+        if td not in day_close or (td.weekday() + 1) not in weekdays: continue
+        (ft_d, chg_d, kph_d), (ft_n, chg_n, kph_n) = values(day_close[td]), values(night_close.get(td))
+        nd = next_day.get(td)
+        (nft_d, nchg_d, nkph_d) = values(day_close.get(nd)) if nd else [None] * 3
+        (nft_n, nchg_n, nkph_n) = values(night_close.get(nd)) if nd else [None] * 3
+        out.append([td, _WEEKDAY_CH[td.weekday()], ft_d, chg_d, ft_n, chg_n, kph_d, kph_n, nft_d, nchg_d, nft_n, nchg_n, nkph_d, nkph_n])
+    return pd.DataFrame(out, columns=DAILY_FILTER_COLUMNS)
+
+
+# --- 5. 後端選擇 ---
+
+_BACKENDS = {"mysql": MySQLRepository, "sqlite": SQLiteRepository, "arrow": ArrowRepository}
+_INSTANCES: Dict[Tuple[str, str, str], Repository] = {}
+
+
+def _configured_backend() -> str:
+    backend = os.environ.get("ATM_DATA_BACKEND")
+    if not backend:
+        try: backend = st.secrets.get("data_backend")
+        except Exception: backend = None
+    return str(backend or "mysql").strip().lower()
+
+
+def get_repository(table: str = "atm", date_col: str = "時間戳記", backend: Optional[str] = None) -> Repository:
+    """依設定 (ATM_DATA_BACKEND / secrets data_backend，預設 mysql) 取得資料存取物件"""
+    backend = (backend or _configured_backend()).strip().lower()
+    if backend not in _BACKENDS:
+        raise ValueError(f"未知的資料後端：{backend} (可用：{', '.join(_BACKENDS)})")
+    key = (backend, table, date_col)
+    if key not in _INSTANCES:
+        _INSTANCES[key] = _BACKENDS[backend](table, date_col)
+    return _INSTANCES[key]
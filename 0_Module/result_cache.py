@@ -0,0 +1,101 @@
+# 檔案：result_cache.py (跨 session 共用的查詢結果快取)
+"""行程內共用、依記憶體大小上限做 LRU 淘汰的結果快取。
+
+每筆結果記錄建立當時的資料版本 (呼叫端傳入，通常為 data_version 的 DataVersion.for_range)；讀取時版本不同即視為失效並移除，
+因此不需要固定 TTL：只涵蓋歷史曆日的結果版本固定為 HISTORICAL、永不失效，涵蓋最新曆日的結果在該 mode 有新資料後
+第一次查詢自動重算。
+上限由環境變數 ATM_RESULT_CACHE_MB 設定 (預設 256 MB)。
+"""
+import os
+import threading
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Any, Hashable, Optional
+
+import numpy as np
+import pandas as pd
+
+__all__ = ["ResultCache", "CacheStats", "RESULT_CACHE"]
+
+
+@dataclass
+class CacheStats:
+    hits: int = 0
+    misses: int = 0
+    evictions: int = 0
+    invalidations: int = 0
+    entries: int = 0
+    bytes: int = 0
+
+    @property
+    def hit_rate(self) -> float:
+        total = self.hits + self.misses
+        return self.hits / total if total else 0.0
+
+
+def _size_of(value: Any) -> int:
+    if isinstance(value, pd.DataFrame):
+        return int(value.memory_usage(index=True, deep=True).sum())
+    if isinstance(value, pd.Series):
+        return int(value.memory_usage(index=True, deep=True))
+    if isinstance(value, np.ndarray):
+        return int(value.nbytes)
+    if isinstance(value, (list, tuple)):
+        return 64 + sum(_size_of(v) for v in value)
+    if isinstance(value, (int, float, str, type(None))):
+        return 64
+    if hasattr(value, "data") and isinstance(getattr(value, "data"), tuple):  # plotly Figure：以各軌跡的資料陣列估計
+        arrays = [getattr(t, a, None) for t in value.data for a in ("x", "y", "customdata")]
+        return 1024 + sum(_size_of(np.asarray(a)) for a in arrays if a is not None)
+    return 1024
+
+
+class ResultCache:
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        self._data: "OrderedDict[Hashable, tuple]" = OrderedDict()  # key -> (watermark, value, size)
+        self._lock = threading.Lock()
+        self._stats = CacheStats()
+
+    def get(self, key: Hashable, watermark: Any) -> Optional[Any]:
+        """命中時回傳結果並移到最近使用；未命中或水位已變時回傳 None"""
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is not None and entry[0] != watermark:
+                self._drop(key); self._stats.invalidations += 1; entry = None
+            if entry is None:
+                self._stats.misses += 1
+                return None
+            self._data.move_to_end(key)
+            self._stats.hits += 1
+            return entry[1]
+
+    def contains(self, key: Hashable, watermark: Any) -> bool:
+        """是否有水位相同的結果 (不計入命中統計、不更新使用順序)；供預取判斷是否需要查詢"""
+        with self._lock:
+            entry = self._data.get(key)
+            return entry is not None and entry[0] == watermark
+
+    def put(self, key: Hashable, watermark: Any, value: Any):
+        size = _size_of(value)
+        if size > self.max_bytes: return  # 單筆超過上限就不快取
+        with self._lock:
+            if key in self._data: self._drop(key)
+            self._data[key] = (watermark, value, size); self._stats.bytes += size
+            while self._stats.bytes > self.max_bytes:
+                self._drop(next(iter(self._data))); self._stats.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._data.clear(); self._stats.bytes = 0
+
+    def stats(self) -> CacheStats:
+        with self._lock:
+            return CacheStats(**{**self._stats.__dict__, "entries": len(self._data)})
+
+    def _drop(self, key: Hashable):
+        _, _, size = self._data.pop(key)
+        self._stats.bytes -= size
+
+
+RESULT_CACHE = ResultCache(int(float(os.environ.get("ATM_RESULT_CACHE_MB", "256")) * 1024 * 1024))
@@ -0,0 +1,147 @@
+# 檔案：similarity_batch.py (批次相似度分析：多個範本日 × 多個時間窗)
+"""不經 Streamlit 介面的批次相似度分析，規則與 5_Trend_Similarity_Analyzer 相同
+(範本與候選在時間窗內至少 5 筆資料、DTW 距離越低越相似)。
+
+特徵矩陣只載入一次；相同 (時間窗, 正規化方法) 的工作共用同一組正規化候選序列，
+候選只補齊並放入共享記憶體一次，每個範本日作為一個工作交給進程池。
+
+    python 0_Module/similarity_batch.py --jobs jobs.csv --out results.parquet
+    python 0_Module/similarity_batch.py --dates 2025-10-01 2025-10-02 --windows 09:00-10:00 13:00-13:45 \\
+        --methods "Relative Magnitude" "Pure Shape" --top-n 30 --out results.csv
+
+jobs.csv 欄位：template_date, start_time, end_time[, norm_method] (norm_method 預設 Relative Magnitude)。
+輸出依副檔名寫成 Parquet 或 CSV，每列為一個工作的一個名次：
+task_id, template_date, start_time, end_time, norm_method, rank, date, similarity_score, status
+(範本資料不足的工作只輸出一列，status 說明原因)。
+"""
+import argparse
+import itertools
+import os
+import sys
+import time as _time
+from dataclasses import dataclass
+from datetime import time
+from typing import Callable, List, Optional, Sequence
+
+import numpy as np
+import pandas as pd
+
+from feature_store import FeatureMatrix, get_feature_matrix, window_series
+from repository import get_repository
+from similarity_search import batch_top_n_dtw_search
+
+__all__ = ["SimilarityTask", "run_batch", "tasks_from_frame", "tasks_from_product", "write_results", "MIN_WINDOW_POINTS"]
+
+NORM_METHODS = ("Relative Magnitude", "Pure Shape")
+MIN_WINDOW_POINTS = 5
+RESULT_COLUMNS = ["task_id", "template_date", "start_time", "end_time", "norm_method", "rank", "date", "similarity_score", "status"]
+
+
+@dataclass(frozen=True)
+class SimilarityTask:
+    template_date: str
+    start_time: time
+    end_time: time
+    norm_method: str = "Relative Magnitude"
+
+
+def _parse_time(value) -> time:
+    if isinstance(value, time): return value
+    return pd.to_datetime(str(value).strip(), format="mixed").time()
+
+
+def tasks_from_frame(df: pd.DataFrame) -> List[SimilarityTask]:
+    """由 DataFrame (template_date, start_time, end_time[, norm_method]) 建立工作清單"""
+    missing = {"template_date", "start_time", "end_time"} - set(df.columns)
+    if missing: raise ValueError(f"工作清單缺少欄位：{', '.join(sorted(missing))}")
+    methods = df["norm_method"] if "norm_method" in df.columns else pd.Series("Relative Magnitude", index=df.index)
+    return [SimilarityTask(pd.to_datetime(d).strftime("%Y-%m-%d"), _parse_time(s), _parse_time(e), str(m) if pd.notna(m) and str(m).strip() else "Relative Magnitude")
+            for d, s, e, m in zip(df["template_date"], df["start_time"], df["end_time"], methods)]
+
+
+def tasks_from_product(dates: Sequence[str], windows: Sequence[str], methods: Sequence[str] = ("Relative Magnitude",)) -> List[SimilarityTask]:
+    """日期 × 時間窗 ('HH:MM-HH:MM') × 正規化方法 的所有組合"""
+    spans = [tuple(_parse_time(t) for t in w.split("-", 1)) for w in windows]
+    return [SimilarityTask(pd.to_datetime(d).strftime("%Y-%m-%d"), s, e, m) for d, (s, e), m in itertools.product(dates, spans, methods)]
+
+
+def run_batch(tasks: Sequence[SimilarityTask], table: str = "atm", date_col: str = "時間戳記", mode: str = "1344",
+              top_n: Optional[int] = 15, window: Optional[int] = None, workers: Optional[int] = None,
+              fm: Optional[FeatureMatrix] = None, progress_callback: Optional[Callable[[int, int], None]] = None) -> pd.DataFrame:
+    """執行所有工作並回傳排名表 (RESULT_COLUMNS)；fm 未指定時載入 mode 全部交易日的特徵矩陣"""
+    if fm is None:
+        days = get_repository(table, date_col).unique_dates(mode)
+        if not days: return pd.DataFrame(columns=RESULT_COLUMNS)
+        fm = get_feature_matrix(table, date_col, mode, days[0], days[-1])
+    day_strs = fm.day_strings; day_pos = {d: i for i, d in enumerate(day_strs)}
+    rows, done = [], 0
+    groups = {}
+    for task_id, task in enumerate(tasks):
+        groups.setdefault((task.start_time, task.end_time, task.norm_method), []).append((task_id, task))
+
+    def status_row(task_id, task, status):
+        return [task_id, task.template_date, task.start_time.strftime("%H:%M"), task.end_time.strftime("%H:%M"), task.norm_method, None, None, None, status]
+
+    for (start_t, end_t, method), group in groups.items():
+        if method not in NORM_METHODS or start_t >= end_t:
+            reason = f"未知的正規化方法：{method}" if method not in NORM_METHODS else "開始時間必須早於結束時間"
+            rows += [status_row(i, t, reason) for i, t in group]; done += len(group); continue
+        norm, counts = window_series(fm, start_t, end_t, method)
+        valid = np.flatnonzero(counts >= MIN_WINDOW_POINTS)
+        runnable = []
+        for task_id, task in group:
+            idx = day_pos.get(task.template_date)
+            if idx is None: rows.append(status_row(task_id, task, "範本日期不是有效的交易日"))
+            elif counts[idx] < MIN_WINDOW_POINTS: rows.append(status_row(task_id, task, f"範本在時間區間內的數據少於 {MIN_WINDOW_POINTS} 筆"))
+            else: runnable.append((task_id, task, idx))
+        done += len(group) - len(runnable)
+        if not runnable: continue
+        # 候選 = 該時間窗內資料足夠的所有交易日 (各範本再排除自身)，整組只補齊一次
+        ranked = batch_top_n_dtw_search([norm[idx] for _, _, idx in runnable], [norm[i] for i in valid],
+                                        [np.flatnonzero(valid != idx) for _, _, idx in runnable], top_n=top_n, window=window, workers=workers,
+                                        progress_callback=(lambda d, _t, base=done: progress_callback(base + d, len(tasks))) if progress_callback else None)
+        for (task_id, task, _), results in zip(runnable, ranked):
+            base = status_row(task_id, task, "ok")
+            if not results: rows.append(base[:-1] + ["找不到任何可用於比對的歷史數據"])
+            rows += [base[:5] + [rank, day_strs[valid[c]], score, "ok"] for rank, (c, score) in enumerate(results, 1)]
+        done += len(runnable)
+    out = pd.DataFrame(rows, columns=RESULT_COLUMNS).sort_values(["task_id", "rank"], kind="stable", na_position="first").reset_index(drop=True)
+    out["rank"] = out["rank"].astype("Int64")
+    return out
+
+
+def write_results(df: pd.DataFrame, path: str):
+    """依副檔名寫成 Parquet (.parquet) 或 CSV (其他)"""
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    if path.lower().endswith(".parquet"): df.to_parquet(path, index=False)
+    else: df.to_csv(path, index=False, encoding="utf-8-sig")
+
+
+def _main(argv: Optional[Sequence[str]] = None):
+    parser = argparse.ArgumentParser(description="批次相似度分析 (多個範本日 × 多個時間窗)")
+    parser.add_argument("--jobs", help="工作清單 CSV：template_date, start_time, end_time[, norm_method]")
+    parser.add_argument("--dates", nargs="*", default=[], help="範本日期 (與 --windows、--methods 取所有組合)")
+    parser.add_argument("--windows", nargs="*", default=["09:00-10:00"], help="時間窗，格式 HH:MM-HH:MM")
+    parser.add_argument("--methods", nargs="*", default=["Relative Magnitude"], choices=NORM_METHODS)
+    parser.add_argument("--out", required=True, help="輸出檔 (.parquet 或 .csv)")
+    parser.add_argument("--table", default="atm")
+    parser.add_argument("--date-col", default="時間戳記")
+    parser.add_argument("--mode", default="1344")
+    parser.add_argument("--top-n", type=int, default=15, help="每個工作保留的名次數，0 表示不限制")
+    parser.add_argument("--window", type=int, default=0, help="DTW Sakoe-Chiba 視窗 (分)，0 表示不限制")
+    parser.add_argument("--workers", type=int, default=None, help="平行核心數 (預設 ATM_SIMILARITY_WORKERS 或 CPU 核心數)")
+    args = parser.parse_args(argv)
+
+    tasks = tasks_from_frame(pd.read_csv(args.jobs, dtype=str)) if args.jobs else []
+    tasks += tasks_from_product(args.dates, args.windows, args.methods)
+    if not tasks: parser.error("請以 --jobs 或 --dates 指定至少一個工作")
+    t0 = _time.perf_counter()
+    progress = lambda done, total: print(f"\r已完成 {done}/{total} 個工作", end="", file=sys.stderr)
+    df = run_batch(tasks, args.table, args.date_col, args.mode, top_n=(args.top_n or None), window=(args.window or None), workers=args.workers, progress_callback=progress)
+    write_results(df, args.out)
+    ok = df.loc[df["status"] == "ok", "task_id"].nunique()
+    print(f"\n{len(tasks)} 個工作 ({ok} 個成功)，共 {len(df):,} 列，耗時 {_time.perf_counter() - t0:.1f} 秒 → {args.out}", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    _main()
@@ -0,0 +1,85 @@
+# 檔案：similarity_index.py (相似度分析的近似最近鄰索引)
+"""快速模式：先以索引挑出候選短名單，再對短名單做精確 DTW 重新排序。
+
+每個交易日在時間窗內的正規化序列 (window_series 的輸出) 先線性重採樣為固定長度，再做 PAA
+(分段平均，預設 32 段)，以 scipy cKDTree 建立歐氏距離索引。索引依 (資料表, mode, 時間窗, 正規化方法)
+快取在行程內；特徵矩陣新增交易日時只重算新日期與最後一天 (可能仍在累積資料) 的向量後重建 KD 樹。
+
+PAA 歐氏距離不是 DTW 的下界，短名單可能漏掉少數真正的前 N 名；recall_at_n 用來與精確模式比較。
+"""
+import threading
+from dataclasses import dataclass
+from typing import Dict, List, Optional, Sequence
+
+import numpy as np
+from scipy.spatial import cKDTree
+
+__all__ = ["WindowIndex", "paa_vectors", "get_window_index", "shortlist_size", "recall_at_n", "PAA_SEGMENTS"]
+
+PAA_SEGMENTS = 32
+_RESAMPLE_PER_SEGMENT = 8
+_LOCK = threading.Lock()
+_INDEXES: Dict[tuple, "WindowIndex"] = {}
+
+
+def paa_vectors(series: Sequence[np.ndarray], segments: int = PAA_SEGMENTS) -> np.ndarray:
+    """每條序列重採樣為 segments × 8 點後取每段平均；少於 2 點的序列為全 NaN"""
+    out = np.full((len(series), segments), np.nan)
+    grid = np.linspace(0.0, 1.0, segments * _RESAMPLE_PER_SEGMENT)
+    for i, s in enumerate(series):
+        if len(s) < 2: continue
+        resampled = np.interp(grid, np.linspace(0.0, 1.0, len(s)), s)
+        out[i] = resampled.reshape(segments, _RESAMPLE_PER_SEGMENT).mean(axis=1)
+    return out
+
+
+@dataclass
+class WindowIndex:
+    dates: np.ndarray        # datetime64[D]，與特徵矩陣的列對齊
+    vectors: np.ndarray      # (天數 × PAA_SEGMENTS)，不可用的日期為 NaN
+    rows: np.ndarray         # 已放入 KD 樹的列索引 (時間窗內資料足夠的交易日)
+    tree: Optional[cKDTree]
+
+    def query(self, vector: np.ndarray, k: int, exclude: Sequence[int] = ()) -> List[int]:
+        """回傳與 vector 最接近的 k 個列索引 (依距離排序)，略過 exclude"""
+        if self.tree is None or k <= 0: return []
+        skip = set(int(i) for i in exclude)
+        want = min(len(self.rows), k + len(skip))
+        _, pos = self.tree.query(vector, k=want)
+        pos = np.atleast_1d(pos)
+        return [r for r in self.rows[pos[pos < len(self.rows)]].tolist() if r not in skip][:k]
+
+
+def _build(dates: np.ndarray, vectors: np.ndarray, eligible: np.ndarray) -> WindowIndex:
+    rows = np.flatnonzero(eligible & ~np.isnan(vectors).any(axis=1))
+    return WindowIndex(dates, vectors, rows, cKDTree(vectors[rows]) if len(rows) else None)
+
+
+def get_window_index(key: tuple, dates: np.ndarray, window_norm: Sequence[np.ndarray], counts: np.ndarray, min_points: int = 5) -> WindowIndex:
+    """取得 key (例如 (資料表, mode, 開始, 結束, 正規化方法)) 對應的索引；dates / window_norm / counts 來自同一份特徵矩陣"""
+    eligible = np.asarray(counts) >= min_points
+    with _LOCK:
+        cached = _INDEXES.get(key)
+        if cached is not None and len(cached.dates) <= len(dates) and np.array_equal(cached.dates, dates[:len(cached.dates)]):
+            # 只重算新日期與原本最後一天；都沒有變化時沿用既有索引
+            start = max(len(cached.dates) - 1, 0)
+            vectors = np.concatenate([cached.vectors[:start], paa_vectors(window_norm[start:])])
+            if len(cached.dates) == len(dates) and np.array_equal(vectors, cached.vectors, equal_nan=True) \
+                    and np.array_equal(cached.rows, np.flatnonzero(eligible & ~np.isnan(vectors).any(axis=1))):
+                return cached
+        else:
+            vectors = paa_vectors(window_norm)
+        index = _build(np.asarray(dates), vectors, eligible)
+        _INDEXES[key] = index
+        return index
+
+
+def shortlist_size(top_n: int, total: int, factor: int = 5, minimum: int = 50) -> int:
+    """快速模式的短名單大小：max(top_n × factor, minimum)，不超過候選總數"""
+    return min(total, max(int(top_n) * factor, minimum))
+
+
+def recall_at_n(fast: Sequence, exact: Sequence) -> float:
+    """快速模式前 N 名中出現在精確模式前 N 名的比例 (N = 精確結果筆數)"""
+    if not exact: return 1.0
+    return len(set(fast[:len(exact)]) & set(exact)) / len(exact)
@@ -0,0 +1,441 @@
+# 檔案：similarity_search.py (Top-N DTW 剪枝搜尋引擎)
+"""以下界剪枝 + 提前放棄的 Top-N DTW 搜尋。
+
+距離定義與 dtw-python 預設值一致：`dtw(x, y, distance_only=True).distance`
+(步進模式 symmetric2、絕對值距離、無開放端點)；指定 window 時等同
+`window_type="sakoechiba", window_args={"window_size": window}`。
+"""
+import heapq
+import multiprocessing
+import os
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, as_completed, wait
+from dataclasses import dataclass
+from multiprocessing import shared_memory
+from typing import Callable, Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+__all__ = ["lb_kim", "lb_keogh", "dtw_distance", "top_n_dtw_search", "parallel_top_n_dtw_search", "batch_top_n_dtw_search",
+           "default_worker_count", "SimilarityJob", "JobSnapshot"]
+
+ProgressCallback = Callable[[int, int], None]
+
+
+def _pad(cands: Sequence[np.ndarray]) -> Tuple[np.ndarray, np.ndarray]:
+    """將不等長序列補齊為 (筆數 × 最大長度) 的矩陣，補齊處為 NaN"""
+    lengths = np.array([len(c) for c in cands], dtype=np.int64)
+    mat = np.full((len(cands), int(lengths.max()) if len(cands) else 0), np.nan)
+    for r, c in enumerate(cands): mat[r, :len(c)] = c
+    return mat, lengths
+
+
+def _sliding_envelope(mat: np.ndarray, n: int, window: Optional[int]) -> Tuple[np.ndarray, np.ndarray]:
+    """mat 每列在索引 i 可對應範圍 [i-w, i+w] 內的上下包絡 (形狀 筆數 × n)；無可對應點時為 (-inf, +inf)"""
+    if window is None:
+        with np.errstate(invalid="ignore"):
+            upper, lower = np.nanmax(mat, axis=1, initial=-np.inf), np.nanmin(mat, axis=1, initial=np.inf)
+        return np.repeat(upper[:, None], n, axis=1), np.repeat(lower[:, None], n, axis=1)
+    w, m = int(window), mat.shape[1]
+    tail = w + max(0, n - m)
+    def _pad_with(fill):
+        padded = np.concatenate((np.full((len(mat), w), fill), np.where(np.isnan(mat), fill, mat), np.full((len(mat), tail), fill)), axis=1)
+        return np.lib.stride_tricks.sliding_window_view(padded, 2 * w + 1, axis=1)[:, :n]
+    return _pad_with(-np.inf).max(axis=2), _pad_with(np.inf).min(axis=2)
+
+
+def _lower_bounds(q: np.ndarray, mat: np.ndarray, lengths: np.ndarray, window: Optional[int]) -> np.ndarray:
+    """每個候選的 max(LB_Kim, LB_Keogh(q, c), LB_Keogh(c, q))；空序列為 inf"""
+    bounds = np.full(len(mat), np.inf)
+    valid = lengths > 0
+    if not valid.any() or len(q) == 0: return bounds
+    rows, lens = np.flatnonzero(valid), lengths[valid]
+    kim = np.abs(q[0] - mat[rows, 0]) + np.where((lens == 1) & (len(q) == 1), 0.0, np.abs(q[-1] - mat[rows, lens - 1]))
+    upper, lower = _sliding_envelope(mat[rows], len(q), window)
+    keogh_q = np.sum(np.maximum(q - upper, 0.0) + np.maximum(lower - q, 0.0), axis=1)
+    q_upper, q_lower = _sliding_envelope(q[None, :], mat.shape[1], window)
+    with np.errstate(invalid="ignore"):
+        keogh_c = np.nansum(np.maximum(mat[rows] - q_upper, 0.0) + np.maximum(q_lower - mat[rows], 0.0), axis=1)
+    bounds[rows] = np.maximum(kim, np.maximum(keogh_q, keogh_c))
+    return bounds
+
+
+def lb_kim(q: np.ndarray, c: np.ndarray) -> float:
+    """首尾兩點下界：任何路徑都必須經過 (0, 0) 與 (n-1, m-1)，且每格權重至少為 1"""
+    first = abs(q[0] - c[0])
+    if len(q) == 1 and len(c) == 1: return float(first)
+    return float(first + abs(q[-1] - c[-1]))
+
+
+def lb_keogh(q: np.ndarray, c: np.ndarray, window: Optional[int] = None) -> float:
+    """LB_Keogh：路徑經過 q 的每一列，每列成本至少為 q[i] 到 c 包絡的距離"""
+    q = np.asarray(q, dtype=np.float64)
+    upper, lower = _sliding_envelope(np.asarray(c, dtype=np.float64)[None, :], len(q), window)
+    return float(np.sum(np.maximum(q - upper[0], 0.0) + np.maximum(lower[0] - q, 0.0)))
+
+
+def _dtw_batch(q: np.ndarray, mat: np.ndarray, lengths: np.ndarray, window: Optional[int] = None, best_so_far: float = np.inf) -> np.ndarray:
+    """一次計算多個候選 (NaN 補齊矩陣) 的 symmetric2 DTW 距離，逐列推進。
+
+    每列的水平遞迴 g[j] = min(a[j], g[j-1] + d[j]) 以 cumsum + minimum.accumulate 向量化；
+    某候選整列累積成本皆超過 best_so_far 時即提前放棄 (距離記為 inf)，並自批次中移除。
+    """
+    n, total = len(q), len(mat)
+    scores = np.full(total, np.inf)
+    if total == 0 or n == 0: return scores
+    m = mat.shape[1]
+    active = np.flatnonzero((lengths > 0) & ((np.abs(lengths - n) <= window) if window is not None else True))
+    mat, lengths = np.nan_to_num(mat[active]), lengths[active]
+    col_idx = np.arange(m)
+    prev = None
+    for i in range(n):
+        if len(active) == 0: return scores
+        lo, hi = (0, m) if window is None else (max(0, i - window), min(m, i + window + 1))
+        if lo >= hi: return scores
+        d = np.abs(q[i] - mat[:, lo:hi])
+        if prev is None:
+            a = np.full(d.shape, np.inf); a[:, 0] = d[:, 0]
+        else:
+            diag = np.empty(d.shape)
+            diag[:, 0] = prev[:, lo - 1] + 2 * d[:, 0] if lo > 0 else np.inf
+            diag[:, 1:] = prev[:, lo:hi - 1] + 2 * d[:, 1:]
+            a = np.minimum(prev[:, lo:hi] + d, diag)
+        cum = np.cumsum(d, axis=1)
+        seg = cum + np.minimum.accumulate(a - cum, axis=1)
+        seg[col_idx[lo:hi] >= lengths[:, None]] = np.inf
+        row = np.full((len(active), m), np.inf); row[:, lo:hi] = seg
+        keep = row.min(axis=1) <= best_so_far
+        if not keep.all():
+            active, mat, lengths, row = active[keep], mat[keep], lengths[keep], row[keep]
+        prev = row
+    scores[active] = prev[np.arange(len(active)), lengths - 1]
+    return scores
+
+
+def dtw_distance(q: np.ndarray, c: np.ndarray, window: Optional[int] = None, best_so_far: float = np.inf) -> float:
+    """symmetric2 DTW 距離；累積成本超過 best_so_far 時提前放棄並回傳 inf"""
+    mat, lengths = _pad([np.asarray(c, dtype=np.float64)])
+    return float(_dtw_batch(np.asarray(q, dtype=np.float64), mat, lengths, window, best_so_far)[0])
+
+
+def _search_padded(q: np.ndarray, mat: np.ndarray, lengths: np.ndarray, k: int, window: Optional[int] = None,
+                   ids: Optional[np.ndarray] = None, progress_callback: Optional[ProgressCallback] = None,
+                   batch_size: int = 256) -> List[Tuple[int, float]]:
+    """在補齊矩陣上做剪枝 Top-k 搜尋；ids 為每列對應的全域索引 (同分時依全域索引排序)"""
+    total = len(mat)
+    ids = np.arange(total) if ids is None else np.asarray(ids, dtype=np.int64)
+    bounds = _lower_bounds(q, mat, lengths, window)
+    order = np.argsort(bounds, kind="stable")
+
+    heap: List[Tuple[float, int]] = []  # (-分數, -全域索引) 的最大堆積，堆頂為目前第 N 名
+    done = 0
+    while done < total:
+        worst = -heap[0][0] if len(heap) >= k else np.inf
+        chunk = order[done:done + max(batch_size, k - len(heap))]
+        done += len(chunk)
+        batch = np.array([row for row in chunk if bounds[row] <= worst and np.isfinite(bounds[row])], dtype=np.int64)
+        if len(batch) == 0: break
+        for idx, score in zip(ids[batch].tolist(), _dtw_batch(q, mat[batch], lengths[batch], window, worst)):
+            _push_top_k(heap, k, idx, score)
+        if progress_callback is not None: progress_callback(done, total)
+    if progress_callback is not None: progress_callback(total, total)
+    return _heap_results(heap)
+
+
+def _push_top_k(heap: List[Tuple[float, int]], k: int, idx: int, score: float):
+    """把 (idx, score) 放入保留最小 k 筆 (距離, 索引) 的最大堆積"""
+    if not np.isfinite(score): return
+    if len(heap) < k: heapq.heappush(heap, (-score, -idx))
+    elif (score, idx) < (-heap[0][0], -heap[0][1]): heapq.heapreplace(heap, (-score, -idx))
+
+
+def _heap_results(heap: List[Tuple[float, int]]) -> List[Tuple[int, float]]:
+    return sorted(((-neg_idx, -neg_score) for neg_score, neg_idx in heap), key=lambda r: (r[1], r[0]))
+
+
+def top_n_dtw_search(template: np.ndarray, candidates: Sequence[np.ndarray], top_n: Optional[int] = None,
+                     window: Optional[int] = None, progress_callback: Optional[ProgressCallback] = None,
+                     batch_size: int = 256) -> List[Tuple[int, float]]:
+    """在 candidates 中找出與 template DTW 距離最小的 top_n 筆，回傳 [(候選索引, 距離)]，依 (距離, 索引) 排序。
+
+    先以 max(LB_Kim, LB_Keogh 雙向) 排序候選，依下界由小到大分批計算；堆積已滿且下界超過第 N 名時即整批停止，
+    其餘候選在 DTW 計算中一旦超過第 N 名分數即提前放棄。top_n 為 None 時回傳所有可比對的候選。
+    """
+    q = np.asarray(template, dtype=np.float64)
+    total = len(candidates)
+    k = total if top_n is None else int(top_n)
+    if total == 0 or k <= 0 or len(q) == 0: return []
+    mat, lengths = _pad([np.asarray(c, dtype=np.float64) for c in candidates])
+    return _search_padded(q, mat, lengths, k, window, progress_callback=progress_callback, batch_size=batch_size)
+
+
+# --- 多核心平行評分 (ProcessPool + 共享記憶體) ---
+
+_EXECUTORS: Dict[int, ProcessPoolExecutor] = {}
+
+
+def default_worker_count() -> int:
+    """預設平行核心數：環境變數 ATM_SIMILARITY_WORKERS，未設定時為 CPU 核心數"""
+    try: return max(1, int(os.environ.get("ATM_SIMILARITY_WORKERS", "")))
+    except ValueError: return max(1, os.cpu_count() or 1)
+
+
+def _get_executor(workers: int) -> ProcessPoolExecutor:
+    """依核心數重用常駐的 spawn 進程池，避免每次分析都重新啟動子進程"""
+    executor = _EXECUTORS.get(workers)
+    if executor is None:
+        executor = ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn"))
+        _EXECUTORS[workers] = executor
+    return executor
+
+
+def _score_shard(mat_name: str, shape: Tuple[int, int], lengths_name: str, q: np.ndarray, rows: np.ndarray,
+                 k: int, window: Optional[int]) -> List[Tuple[int, float]]:
+    """子進程入口：附掛共享記憶體中的候選矩陣，只對 rows 指定的候選做剪枝搜尋"""
+    mat_shm, len_shm = shared_memory.SharedMemory(name=mat_name), shared_memory.SharedMemory(name=lengths_name)
+    try:
+        mat = np.ndarray(shape, dtype=np.float64, buffer=mat_shm.buf)
+        lengths = np.ndarray((shape[0],), dtype=np.int64, buffer=len_shm.buf)
+        shard_mat, shard_lengths = mat[rows], lengths[rows]
+        del mat, lengths
+        return _search_padded(q, shard_mat, shard_lengths, k, window, ids=rows)
+    finally:
+        mat_shm.close(); len_shm.close()
+
+
+def parallel_top_n_dtw_search(template: np.ndarray, candidates: Sequence[np.ndarray], top_n: Optional[int] = None,
+                              window: Optional[int] = None, workers: Optional[int] = None,
+                              progress_callback: Optional[ProgressCallback] = None,
+                              shards_per_worker: int = 4, min_parallel: int = 200) -> List[Tuple[int, float]]:
+    """top_n_dtw_search 的多進程版本，回傳格式與排序完全相同。
+
+    候選補齊後放入共享記憶體，依下界順序交錯切成 workers × shards_per_worker 份交給子進程各自做 Top-N 剪枝，
+    主進程合併各分片結果；每完成一份即回報進度。候選數少於 min_parallel 或 workers <= 1 時直接在本進程計算。
+    """
+    workers = default_worker_count() if workers is None else max(1, int(workers))
+    q = np.asarray(template, dtype=np.float64)
+    total = len(candidates)
+    k = total if top_n is None else int(top_n)
+    if workers <= 1 or total < min_parallel:
+        return top_n_dtw_search(q, candidates, top_n, window, progress_callback)
+    if k <= 0 or len(q) == 0: return []
+
+    mat, lengths = _pad([np.asarray(c, dtype=np.float64) for c in candidates])
+    order = np.argsort(_lower_bounds(q, mat, lengths, window), kind="stable")
+    n_shards = min(total, workers * shards_per_worker)
+    shards = [np.sort(order[s::n_shards]) for s in range(n_shards)]
+
+    mat_shm = shared_memory.SharedMemory(create=True, size=max(1, mat.nbytes))
+    len_shm = shared_memory.SharedMemory(create=True, size=max(1, lengths.nbytes))
+    try:
+        np.ndarray(mat.shape, dtype=np.float64, buffer=mat_shm.buf)[:] = mat
+        np.ndarray(lengths.shape, dtype=np.int64, buffer=len_shm.buf)[:] = lengths
+        executor = _get_executor(workers)
+        futures = {executor.submit(_score_shard, mat_shm.name, mat.shape, len_shm.name, q, rows, k, window): len(rows) for rows in shards}
+        merged: List[Tuple[int, float]] = []
+        done = 0
+        for future in as_completed(futures):
+            merged.extend(future.result())
+            done += futures[future]
+            if progress_callback is not None: progress_callback(done, total)
+    finally:
+        mat_shm.close(); mat_shm.unlink()
+        len_shm.close(); len_shm.unlink()
+    return sorted(merged, key=lambda r: (r[1], r[0]))[:k]
+
+
+def batch_top_n_dtw_search(templates: Sequence[np.ndarray], candidates: Sequence[np.ndarray], candidate_rows: Sequence[np.ndarray],
+                           top_n: Optional[int] = None, window: Optional[int] = None, workers: Optional[int] = None,
+                           progress_callback: Optional[ProgressCallback] = None) -> List[List[Tuple[int, float]]]:
+    """多個範本共用同一組候選：candidate_rows[i] 為第 i 個範本要比對的候選索引 (例如排除範本自身)。
+
+    候選只補齊一次並放入共享記憶體一次，每個範本作為一個工作交給進程池 (workers <= 1 時在本進程依序計算)；
+    回傳每個範本的 [(候選索引, 距離)]，與對該子集合呼叫 top_n_dtw_search 的結果相同。
+    """
+    workers = default_worker_count() if workers is None else max(1, int(workers))
+    total = len(templates)
+    out: List[List[Tuple[int, float]]] = [[] for _ in range(total)]
+    if total == 0 or len(candidates) == 0: return out
+    mat, lengths = _pad([np.asarray(c, dtype=np.float64) for c in candidates])
+    jobs = []
+    for i, (template, rows) in enumerate(zip(templates, candidate_rows)):
+        q, rows = np.asarray(template, dtype=np.float64), np.asarray(rows, dtype=np.int64)
+        k = len(rows) if top_n is None else int(top_n)
+        if len(q) and len(rows) and k > 0: jobs.append((i, q, rows, k))
+    if workers <= 1:
+        for done, (i, q, rows, k) in enumerate(jobs, 1):
+            out[i] = _search_padded(q, mat[rows], lengths[rows], k, window, ids=rows)
+            if progress_callback is not None: progress_callback(done, len(jobs))
+        return out
+
+    mat_shm = shared_memory.SharedMemory(create=True, size=max(1, mat.nbytes))
+    len_shm = shared_memory.SharedMemory(create=True, size=max(1, lengths.nbytes))
+    try:
+        np.ndarray(mat.shape, dtype=np.float64, buffer=mat_shm.buf)[:] = mat
+        np.ndarray(lengths.shape, dtype=np.int64, buffer=len_shm.buf)[:] = lengths
+        executor = _get_executor(workers)
+        futures = {executor.submit(_score_shard, mat_shm.name, mat.shape, len_shm.name, q, rows, k, window): i for i, q, rows, k in jobs}
+        for done, future in enumerate(as_completed(futures), 1):
+            out[futures[future]] = future.result()
+            if progress_callback is not None: progress_callback(done, len(jobs))
+    finally:
+        mat_shm.close(); mat_shm.unlink()
+        len_shm.close(); len_shm.unlink()
+    return out
+
+
+# --- 串流 / 可取消的背景搜尋 ---
+
+def _score_rows(mat_name: str, shape: Tuple[int, int], lengths_name: str, q: np.ndarray, rows: np.ndarray,
+                window: Optional[int], cutoff: float) -> np.ndarray:
+    """子進程入口：計算 rows 指定候選的 DTW 距離 (超過 cutoff 提前放棄為 inf)"""
+    mat_shm, len_shm = shared_memory.SharedMemory(name=mat_name), shared_memory.SharedMemory(name=lengths_name)
+    try:
+        mat = np.ndarray(shape, dtype=np.float64, buffer=mat_shm.buf)
+        lengths = np.ndarray((shape[0],), dtype=np.int64, buffer=len_shm.buf)
+        shard_mat, shard_lengths = mat[rows], lengths[rows]
+        del mat, lengths
+        return _dtw_batch(q, shard_mat, shard_lengths, window, cutoff)
+    finally:
+        mat_shm.close(); len_shm.close()
+
+
+@dataclass
+class JobSnapshot:
+    results: List[Tuple[int, float]]   # 目前的排行榜 [(候選索引, 距離)]，依 (距離, 索引) 排序
+    done: int                          # 已處理 (評分或經下界排除) 的候選數
+    total: int
+    finished: bool
+    cancelled: bool
+    elapsed: float
+    error: Optional[BaseException] = None
+
+
+class SimilarityJob:
+    """在背景執行緒中執行 Top-N DTW 搜尋，每批完成即更新排行榜快照。
+
+    候選依下界由小到大切成每批 batch_size 筆：workers <= 1 或候選數少於 min_parallel 時在本進程逐批計算，
+    否則同時交給常駐進程池 workers × 2 批，每完成一批就以目前第 N 名分數作為後續批次的剪枝門檻再送出下一批。
+    cancel() 後不再送出新批次 (已送出的批次完成後合併)，結果保留為取消當下的最佳 N 筆；
+    完整跑完時結果與 top_n_dtw_search 相同。
+    """
+
+    def __init__(self, template: np.ndarray, candidates: Sequence[np.ndarray], top_n: Optional[int] = None,
+                 window: Optional[int] = None, workers: Optional[int] = None, batch_size: int = 64, min_parallel: int = 200):
+        self.q = np.asarray(template, dtype=np.float64)
+        self.total = len(candidates)
+        self.k = self.total if top_n is None else int(top_n)
+        self.window, self.batch_size = window, max(1, int(batch_size))
+        self.workers = default_worker_count() if workers is None else max(1, int(workers))
+        self.parallel = self.workers > 1 and self.total >= min_parallel
+        self._candidates = candidates
+        self._heap: List[Tuple[float, int]] = []
+        self._done = 0
+        self._lock = threading.Lock()
+        self._cancel, self._finished = threading.Event(), threading.Event()
+        self._error: Optional[BaseException] = None
+        self._t0 = self._t1 = None
+        self._thread = threading.Thread(target=self._run, name="similarity-job", daemon=True)
+
+    def start(self) -> "SimilarityJob":
+        self._t0 = time.perf_counter()
+        self._thread.start()
+        return self
+
+    def cancel(self):
+        self._cancel.set()
+
+    def wait(self, timeout: Optional[float] = None) -> bool:
+        return self._finished.wait(timeout)
+
+    def result(self) -> List[Tuple[int, float]]:
+        self.wait()
+        if self._error is not None: raise self._error
+        return self.snapshot().results
+
+    def snapshot(self) -> JobSnapshot:
+        with self._lock:
+            results, done = _heap_results(self._heap), self._done
+        finished = self._finished.is_set()
+        end = self._t1 if finished and self._t1 is not None else time.perf_counter()
+        return JobSnapshot(results, done, self.total, finished, self._cancel.is_set() and done < self.total,
+                           (end - self._t0) if self._t0 is not None else 0.0, self._error)
+
+    # --- 背景執行 ---
+
+    def _worst(self) -> float:
+        with self._lock:
+            return -self._heap[0][0] if len(self._heap) >= self.k else np.inf
+
+    def _merge(self, rows: np.ndarray, scores: np.ndarray, processed: int):
+        with self._lock:
+            for idx, score in zip(rows.tolist(), scores.tolist()):
+                _push_top_k(self._heap, self.k, idx, score)
+            self._done += processed
+
+    def _next_batch(self, order: np.ndarray, bounds: np.ndarray, pos: int) -> Tuple[Optional[np.ndarray], int]:
+        """從 pos 起取下一批仍可能進入前 N 名的候選；回傳 (列索引, 新位置)，其餘候選都已被下界排除時為 (None, 總數)"""
+        worst = self._worst()
+        while pos < len(order):
+            chunk = order[pos:pos + self.batch_size]
+            if not (np.isfinite(bounds[chunk[0]]) and bounds[chunk[0]] <= worst):  # 依下界排序：第一筆已超過門檻，之後全部排除
+                with self._lock: self._done += len(order) - pos
+                return None, len(order)
+            rows = chunk[np.isfinite(bounds[chunk]) & (bounds[chunk] <= worst)]
+            with self._lock: self._done += len(chunk) - len(rows)
+            pos += len(chunk)
+            if len(rows): return rows, pos
+        return None, pos
+
+    def _run(self):
+        try:
+            if self.total == 0 or self.k <= 0 or len(self.q) == 0:
+                with self._lock: self._done = self.total
+                return
+            mat, lengths = _pad([np.asarray(c, dtype=np.float64) for c in self._candidates])
+            bounds = _lower_bounds(self.q, mat, lengths, self.window)
+            order = np.argsort(bounds, kind="stable")
+            if self.parallel: self._run_pool(mat, lengths, bounds, order)
+            else: self._run_local(mat, lengths, bounds, order)
+        except BaseException as e:
+            self._error = e
+        finally:
+            self._t1 = time.perf_counter()
+            self._finished.set()
+
+    def _run_local(self, mat, lengths, bounds, order):
+        pos = 0
+        while pos < len(order) and not self._cancel.is_set():
+            rows, pos = self._next_batch(order, bounds, pos)
+            if rows is None: break
+            self._merge(rows, _dtw_batch(self.q, mat[rows], lengths[rows], self.window, self._worst()), len(rows))
+
+    def _run_pool(self, mat, lengths, bounds, order):
+        mat_shm = shared_memory.SharedMemory(create=True, size=max(1, mat.nbytes))
+        len_shm = shared_memory.SharedMemory(create=True, size=max(1, lengths.nbytes))
+        try:
+            np.ndarray(mat.shape, dtype=np.float64, buffer=mat_shm.buf)[:] = mat
+            np.ndarray(lengths.shape, dtype=np.int64, buffer=len_shm.buf)[:] = lengths
+            executor = _get_executor(self.workers)
+            in_flight, pos = {}, 0
+
+            def submit():
+                nonlocal pos
+                rows, pos = self._next_batch(order, bounds, pos)
+                if rows is not None:
+                    in_flight[executor.submit(_score_rows, mat_shm.name, mat.shape, len_shm.name, self.q, rows, self.window, self._worst())] = rows
+
+            while len(in_flight) < self.workers * 2 and pos < len(order): submit()
+            while in_flight:
+                completed, _ = wait(list(in_flight), timeout=0.2, return_when=FIRST_COMPLETED)
+                for future in completed:
+                    rows = in_flight.pop(future)
+                    self._merge(rows, future.result(), len(rows))
+                    if not self._cancel.is_set() and pos < len(order): submit()
+                if self._cancel.is_set():
+                    for future in list(in_flight):
+                        if future.cancel(): in_flight.pop(future)
+        finally:
+            mat_shm.close(); mat_shm.unlink()
+            len_shm.close(); len_shm.unlink()
@@ -0,0 +1,88 @@
+# 檔案：subsequence_search.py (任意時段子序列搜尋，MASS 距離剖面)
+"""把範本 (某日某時間窗的 FT價格) 在每個交易日的整天分鐘網格上滑動，找出形狀最接近的 (日期, 起始分鐘)。
+
+距離為 z-正規化歐氏距離 (只比較形狀，與漲跌幅度無關)。每一天的距離剖面以 MASS 計算：
+滑動內積用 FFT 一次求出 (O(n log n))，滑動平均 / 標準差用累積和，所有交易日以二維陣列一次向量化。
+
+分鐘網格以曆日 00:00 ~ 23:59 為準 (同 feature_store)；含缺漏分鐘的位置 (例如跨越 05:00 ~ 08:45、
+13:45 ~ 15:00 的休市時段) 不列入比對，因此比對只發生在同一個連續交易時段內，也不會跨越午夜。
+"""
+from dataclasses import dataclass
+from typing import List, Optional
+
+import numpy as np
+
+from feature_store import FeatureMatrix
+
+__all__ = ["SubsequenceMatch", "distance_profiles", "search_subsequences", "template_window"]
+
+_FLAT_VAR = 1e-6  # 變異數低於此值視為常數序列
+
+
+@dataclass
+class SubsequenceMatch:
+    day_index: int
+    start_minute: int    # 當日 00:00 起算的分鐘
+    length: int          # 分鐘數
+    distance: float
+
+
+def template_window(fm: FeatureMatrix, day_index: int, start_minute: int, end_minute: int) -> Optional[np.ndarray]:
+    """取出範本 [start_minute, end_minute] 的價格；缺漏分鐘以線性內插補齊，有效分鐘少於 5 筆時回傳 None"""
+    vals = np.asarray(fm.prices[day_index, start_minute:end_minute + 1], dtype=np.float64)
+    ok = ~np.isnan(vals)
+    if ok.sum() < 5: return None
+    x = np.arange(len(vals))
+    return np.interp(x, x[ok], vals[ok])
+
+
+def distance_profiles(prices: np.ndarray, template: np.ndarray) -> np.ndarray:
+    """prices (天數 × 分鐘) 中每個長度 m 的子序列與 template 的 z-正規化歐氏距離，形狀 (天數 × (分鐘 - m + 1))。
+
+    子序列含 NaN 或為常數時距離為 inf；template 為常數時無法 z-正規化，全部為 inf。
+    """
+    q = np.asarray(template, dtype=np.float64)
+    m = len(q)
+    days, n = prices.shape
+    if m < 2 or m > n or days == 0: return np.full((days, max(n - m + 1, 0)), np.inf)
+    x = np.asarray(prices, dtype=np.float64)
+    valid = ~np.isnan(x)
+    # 先減去每日平均以降低累積和的數值誤差 (z-正規化距離不受平移影響)
+    counts = valid.sum(axis=1, keepdims=True)
+    offset = np.where(valid, x, 0.0).sum(axis=1, keepdims=True) / np.maximum(counts, 1)
+    x = np.where(valid, x - offset, 0.0)
+
+    # 滑動內積 QT[i] = sum_j x[i + j] q[j]：與反轉後的 q 做 FFT 摺積
+    size = 1 << int(np.ceil(np.log2(n + m)))
+    qt = np.fft.irfft(np.fft.rfft(x, size, axis=1) * np.fft.rfft(q[::-1], size)[None, :], size, axis=1)[:, m - 1:n]
+
+    def rolling_sum(a):
+        c = np.concatenate([np.zeros((days, 1)), np.cumsum(a, axis=1)], axis=1)
+        return c[:, m:] - c[:, :-m]
+
+    complete = rolling_sum(valid.astype(np.float64)) > m - 0.5
+    mu = rolling_sum(x) / m
+    var = rolling_sum(x * x) / m - mu * mu
+    mu_q, var_q = q.mean(), q.var()
+    if var_q < _FLAT_VAR: return np.full(qt.shape, np.inf)
+    flat = var < _FLAT_VAR
+    with np.errstate(invalid="ignore", divide="ignore"):
+        corr = (qt - m * mu * mu_q) / (m * np.sqrt(np.where(flat, 1.0, var) * var_q))
+    dist = np.sqrt(np.maximum(2.0 * m * (1.0 - corr), 0.0))
+    dist[~complete | flat] = np.inf
+    return dist
+
+
+def search_subsequences(fm: FeatureMatrix, template: np.ndarray, top_n: Optional[int] = None,
+                        exclude_days: Optional[List[int]] = None, day_rows: Optional[np.ndarray] = None) -> List[SubsequenceMatch]:
+    """每個交易日取距離最小的起始分鐘，再依距離取前 top_n 天 (None 為全部)；day_rows 限定比對的列，exclude_days 排除的列"""
+    rows = np.arange(len(fm.dates)) if day_rows is None else np.asarray(day_rows, dtype=np.int64)
+    if exclude_days: rows = rows[~np.isin(rows, exclude_days)]
+    if len(rows) == 0: return []
+    dist = distance_profiles(np.asarray(fm.prices[rows]), template)
+    if dist.shape[1] == 0: return []
+    best_start = dist.argmin(axis=1)
+    best = dist[np.arange(len(rows)), best_start]
+    order = [i for i in np.lexsort((rows, best)) if np.isfinite(best[i])]
+    if top_n is not None: order = order[:int(top_n)]
+    return [SubsequenceMatch(int(rows[i]), int(best_start[i]), len(template), float(best[i])) for i in order]
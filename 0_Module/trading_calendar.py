@@ -0,0 +1,88 @@
+# 檔案：trading_calendar.py (交易日曆索引)
+"""由 _get_all_unique_dates 建立的已排序交易日清單 (05:01 之後有資料的日期，排除只有前一日夜盤延續資料的週六)，
+以 bisect 在 O(log n) 內回答：
+
+    n_trading_days(X, N)    X (含) 之後的 N 個交易日 (X 不是交易日時從下一個交易日起算)
+    next_day / previous_day 下一個 / 上一個交易日
+    session_day(X)          X 的資料所屬的交易日 (X 本身，或 X 只有凌晨夜盤資料時的前一個交易日)
+
+交易日 D 的資料涵蓋 D 05:01 至次一曆日 05:01 (夜盤延續到次日凌晨 05:00，同 T_PLUS_1_CUTOFF)，
+session_bounds 回傳連續 N 個交易日 (含最後一天夜盤) 的單一時間戳記半開區間。
+日曆依 (後端, 資料表, mode) 快取在行程內，該 mode 的資料版本 (data_version) 改變時重建。
+"""
+import threading
+from bisect import bisect_left, bisect_right
+from dataclasses import dataclass
+from datetime import datetime, timedelta
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+import pandas as pd
+
+from daily_seamless_trend import T_PLUS_1_CUTOFF, _get_all_unique_dates
+from data_version import get_data_version
+from repository import get_repository
+
+__all__ = ["TradingCalendar", "get_trading_calendar"]
+
+_LOCK = threading.Lock()
+_CALENDARS: Dict[tuple, "TradingCalendar"] = {}
+
+
+def _day(value) -> str:
+    return pd.Timestamp(value).strftime("%Y-%m-%d")
+
+
+@dataclass(frozen=True)
+class TradingCalendar:
+    days: Tuple[str, ...]   # 'YYYY-MM-DD'，遞增
+    watermark: Any = None
+
+    def __len__(self) -> int:
+        return len(self.days)
+
+    def __contains__(self, day) -> bool:
+        d = _day(day); i = bisect_left(self.days, d)
+        return i < len(self.days) and self.days[i] == d
+
+    def next_day(self, day) -> Optional[str]:
+        """day 之後 (不含) 的第一個交易日"""
+        i = bisect_right(self.days, _day(day))
+        return self.days[i] if i < len(self.days) else None
+
+    def previous_day(self, day) -> Optional[str]:
+        """day 之前 (不含) 的最後一個交易日"""
+        i = bisect_left(self.days, _day(day))
+        return self.days[i - 1] if i > 0 else None
+
+    def session_day(self, day) -> Optional[str]:
+        """day 的資料所屬的交易日：day 本身是交易日時為 day，否則為前一個交易日 (例如週六凌晨屬於週五夜盤)"""
+        return _day(day) if day in self else self.previous_day(day)
+
+    def n_trading_days(self, start, n: int) -> List[str]:
+        """start (含) 起的 n 個交易日；資料不足時回傳現有的部分"""
+        i = bisect_left(self.days, _day(start))
+        return list(self.days[i:i + max(int(n), 0)])
+
+    @staticmethod
+    def session_bounds(days: Sequence[str]) -> Optional[Tuple[str, str]]:
+        """連續交易日 days 的資料範圍 [第一天 05:01, 最後一天的次一曆日 05:01)；days 為空時回傳 None"""
+        if not days: return None
+        first, last = pd.Timestamp(days[0]), pd.Timestamp(days[-1]) + timedelta(days=1)
+        fmt = lambda d: datetime.combine(d.date(), T_PLUS_1_CUTOFF).strftime("%Y-%m-%d %H:%M:%S")
+        return fmt(first), fmt(last)
+
+
+def get_trading_calendar(table: str, date_col: str, mode: str) -> TradingCalendar:
+    """取得 (表, mode) 的交易日曆；資料版本與快取相同時直接沿用，無法取得版本時沿用既有日曆"""
+    repo = get_repository(table, date_col)
+    key = (repo.name, table, date_col, str(mode).strip().lower())
+    watermark = get_data_version(repo).for_range(mode=mode)
+    with _LOCK:
+        cached = _CALENDARS.get(key)
+        if cached is not None and (watermark is None or cached.watermark == watermark):
+            return cached
+    days = _get_all_unique_dates(table, date_col, mode, watermark, session_start=T_PLUS_1_CUTOFF)
+    calendar = TradingCalendar(tuple(sorted(days)), watermark)
+    with _LOCK:
+        _CALENDARS[key] = calendar
+    return calendar
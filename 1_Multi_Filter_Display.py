@@ -7,12 +7,18 @@ from typing import List
 from five_standard import render as render_five
 from output_multi_filter import render_output
 from Trend import TrendOptions, make_trend
-from daily_seamless_trend import _fetch_intraday_data as _fetch_trend_data_for_days
+import prefetch
+from artifact_cache import ARTIFACT_CACHE, artifact_token
+from trading_calendar import get_trading_calendar
 
 TABLE = "atm"
 DATE_COL = "時間戳記"
 DEFAULT_MODE = "1344"
 FT_COL = "FT價格"
+TREND_COLUMNS = [DATE_COL, FT_COL, "FT漲跌", "價平和(價平)"]  # 趨勢圖只需要這些欄位
+MAX_POINTS_OPTIONS = [None, 2000, 4000, 8000]
+DEFAULT_MAX_POINTS = 4000
+VIEW_RANGES = {"全部": None, "最後 1 天": timedelta(days=1), "最後 6 小時": timedelta(hours=6), "最後 1 小時": timedelta(hours=1)}
 
 def render_page():
     st.subheader("1. 基礎篩選 (日期/Mode/星期)")
@@ -78,18 +84,23 @@ def render_page():
     else: st.error("🚨 錯誤：基礎篩選模組 **five_standard** 執行失敗或未返回有效結果。")
     date_choices = date_choices if isinstance(date_choices, list) else []
     if date_choices:
-        st.markdown("---"); st.subheader("4. 趨勢圖顯示"); default_day = date_choices[0]; n_days_options = [1, 2, 3, 5, 7, 10]; c1, c2 = st.columns([1, 1])
+        st.markdown("---"); st.subheader("4. 趨勢圖顯示"); default_day = date_choices[0]; n_days_options = [1, 2, 3, 5, 7, 10]; c1, c2, c3, c4 = st.columns([1, 1, 1, 1])
         base_day_key = st.session_state.get('trend_base_day', default_day)
         base_day_index = date_choices.index(base_day_key) if base_day_key in date_choices else 0
         with c1: base_day = st.selectbox("選擇繪圖起始日", date_choices, index=base_day_index, key="trend_base_day")
         with c2: n_days = st.selectbox("顯示天數", n_days_options, key="trend_n_days", format_func=lambda x: f"{x} 天")
-        n_days_int = int(n_days); start_dt = pd.to_datetime(base_day, errors='coerce').normalize(); need_days = []
-        if pd.notna(start_dt):
-            for i in range(n_days_int): need_days.append((start_dt + timedelta(days=i)).strftime('%Y-%m-%d'))
+        with c3: max_points = st.selectbox("繪圖點數上限", MAX_POINTS_OPTIONS, index=MAX_POINTS_OPTIONS.index(DEFAULT_MAX_POINTS), key="trend_max_points", format_func=lambda x: "不降採樣" if x is None else f"{x:,} 點", help="以 LTTB 降採樣長區間趨勢圖，保留每日最高/最低點；選擇檢視範圍時自動改為完整解析度。")
+        with c4: view_range = st.selectbox("檢視範圍", list(VIEW_RANGES.keys()), key="trend_view_range", help="只顯示最後一段時間並以完整解析度繪製 (圖上的 1h/6h/1d 按鈕僅在瀏覽器端縮放)。")
+        n_days_int = int(n_days); mode_val = fs.get('mode', DEFAULT_MODE)
+        # 起始日 (只有凌晨夜盤資料時為其所屬交易日) 起的 N 個交易日，跨週末 / 假日也湊滿 N 天；以單一時間戳記範圍取回 (含最後一天夜盤)
+        calendar = get_trading_calendar(TABLE, DATE_COL, mode_val)
+        first_day = calendar.session_day(base_day) if pd.notna(pd.to_datetime(base_day, errors='coerce')) else None
+        need_days = calendar.n_trading_days(first_day, n_days_int) if first_day else []
         if not need_days: st.warning(f"無法從選定起始日 {base_day} 計算出連續交易日。")
-        mode_val = fs.get('mode', DEFAULT_MODE)
-        rows_df = _fetch_trend_data_for_days(TABLE, DATE_COL, mode_val, need_days)
-        if rows_df.empty: st.warning(f"在選定的 {len(need_days)} 個日曆天中，沒有資料符合篩選條件。")
+        rows_df = prefetch.trend_window(TABLE, DATE_COL, mode_val, need_days, TREND_COLUMNS, calendar)
+        # 使用者通常逐日切換起始日：在背景預取前後幾個符合日期的同天數資料
+        prefetch.prefetch_neighbors(TABLE, DATE_COL, mode_val, date_choices, base_day, n_days_int, TREND_COLUMNS, calendar)
+        if rows_df.empty: st.warning(f"在選定的 {len(need_days)} 個交易日中，沒有資料符合篩選條件。")
         else:
             try:
                 ft_base_price = None
@@ -102,6 +113,10 @@ def render_page():
                             ft_base_price = ft_price - ft_change
                             st.caption(f"📈 Y 軸基準點已設為：{ft_base_price:,.0f} (來自 {first_row[DATE_COL]} 的價格 {ft_price:,.0f} 與漲跌 {ft_change:+.0f})")
                 except (IndexError, KeyError) as e: st.warning(f"無法計算 Y 軸基準點，將使用預設範圍。錯誤：{e}")
-                opts = TrendOptions(start_date=base_day, days=n_days_int, time_col="dt", ft_col="FT價格", kph_cols=["價平和(價平)"], ft_base_price=ft_base_price)
-                fig = make_trend(rows_df, opts); st.plotly_chart(fig, use_container_width=True)
+                view_delta = VIEW_RANGES[view_range]
+                if view_delta is not None: rows_df = rows_df[rows_df['dt'] >= rows_df['dt'].max() - view_delta]
+                opts = TrendOptions(start_date=need_days[0], days=len(need_days), time_col="dt", ft_col="FT價格", kph_cols=["價平和(價平)"], ft_base_price=ft_base_price, fast_render=True, max_points=(max_points if view_delta is None else None))
+                # 趨勢圖以 (交易日範圍, 欄位, 繪圖參數, 資料版本) 為快取鍵，來回切換起始日時不重建也不雜湊 rows_df
+                token = artifact_token("trend_figure", TABLE, DATE_COL, mode_val, *calendar.session_bounds(need_days), TREND_COLUMNS, params=(view_range, max_points, ft_base_price))
+                fig = ARTIFACT_CACHE.get_or_build(token, lambda: make_trend(rows_df, opts)); st.plotly_chart(fig, use_container_width=True)
             except ValueError as e: st.error(f"繪製趨勢圖失敗：{e}")
\ No newline at end of file
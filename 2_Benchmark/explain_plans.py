@@ -0,0 +1,118 @@
+# -*- coding: utf-8 -*-
+# 檔案：explain_plans.py (查詢計畫檢查：舊條件 vs query_builder)
+"""對分時資料的主要查詢印出 EXPLAIN，確認 query_builder 產生的條件能以索引範圍掃描：
+
+    python 2_Benchmark/explain_plans.py                                  # 合成 SQLite (複製到暫存檔後遷移)
+    python 2_Benchmark/explain_plans.py --url mysql+pymysql://user:pw@127.0.0.1/atm_test   # 本機 MySQL (會執行遷移)
+
+每個查詢依序列出：舊版條件 (LOWER(TRIM(mode))、DATE(ts) IN、TIME(ts))、遷移前的 query_builder 條件、
+migrate_table 之後的 query_builder 條件。遷移後仍有全表掃描 (SQLite 的 SCAN <table>、MySQL 的 type=ALL) 時結束碼為 1。
+"""
+import argparse
+import os
+import shutil
+import sys
+import tempfile
+from datetime import time
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, BENCH_DIR)
+from run_benchmarks import MODULE_DIR, DATE_COL, MODE, TABLE, _db_path  # noqa: E402
+
+sys.path.insert(0, MODULE_DIR)
+import pandas as pd  # noqa: E402
+from sqlalchemy import create_engine, text  # noqa: E402
+
+import query_builder  # noqa: E402
+
+
+def _legacy_queries(q, days):
+    ts = q(DATE_COL)
+    placeholders = ", ".join(f":date_{i}" for i in range(len(days)))
+    params = {"mode": MODE, **{f"date_{i}": d for i, d in enumerate(days)}}
+    return {
+        "fetch_days": (f"SELECT * FROM {q(TABLE)} WHERE LOWER(TRIM(mode)) = LOWER(TRIM(:mode)) AND DATE({ts}) IN ({placeholders}) ORDER BY {ts}", params),
+        "fetch_range": (f"SELECT * FROM {q(TABLE)} WHERE LOWER(TRIM(mode)) = LOWER(TRIM(:mode)) AND {ts} >= :start AND {ts} < :end "
+                        f"AND TIME({ts}) BETWEEN :start_time AND :end_time ORDER BY {ts}",
+                        {"mode": MODE, "start": days[0], "end": days[-1], "start_time": "09:00:00", "end_time": "10:00:00"}),
+        "unique_dates": (f"SELECT DISTINCT DATE({ts}) AS d FROM {q(TABLE)} WHERE LOWER(TRIM(mode)) = LOWER(TRIM(:mode)) ORDER BY d", {"mode": MODE}),
+        "date_bounds": (f"SELECT MIN(DATE({ts})) AS min_d, MAX(DATE({ts})) AS max_d FROM {q(TABLE)}", {}),
+        "tail_stats": (f"SELECT mode, COUNT(*) AS n, MAX({ts}) AS wm FROM {q(TABLE)} WHERE {ts} >= :since GROUP BY mode", {"since": days[-1]}),
+    }
+
+
+def _builder_queries(schema: query_builder.TableSchema, days):
+    q, ts, mode = schema.q, schema.q(DATE_COL), query_builder.normalize_mode(MODE)
+    days_sql, days_params = schema.days_predicate(days)
+    window_sql, window_params = schema.time_window_predicate(time(9, 0), time(10, 0))
+    return {
+        "fetch_days": (f"SELECT {schema.select_list()} FROM {q(TABLE)} WHERE {days_sql} ORDER BY {ts}", {"mode": mode, **days_params}),
+        "fetch_range": (f"SELECT {schema.select_list()} FROM {q(TABLE)} WHERE {schema.mode_predicate()} AND {schema.range_predicate()} AND {window_sql} ORDER BY {ts}",
+                        {"mode": mode, "start": days[0], "end": days[-1], **window_params}),
+        "unique_dates": (f"SELECT DISTINCT DATE({ts}) AS d FROM {q(TABLE)} WHERE {schema.mode_predicate()} ORDER BY d", {"mode": mode}),
+        "date_bounds": (schema.bounds_select(), {}),
+        "tail_stats": (schema.tail_stats_select(), {"since": days[-1]}),
+    }
+
+
+def _explain(engine, sql: str, params: dict):
+    """回傳 (計畫說明清單, 是否有全表掃描)"""
+    with engine.connect() as c:
+        if engine.dialect.name == "mysql":
+            plan = pd.read_sql(text("EXPLAIN " + sql), c, params=params)
+            lines = [f"{r['table']}: type={r['type']} key={r['key']} rows={r['rows']} {r['Extra'] or ''}".strip() for _, r in plan.iterrows()]
+            return lines, bool((plan["type"] == "ALL").any())
+        plan = c.execute(text("EXPLAIN QUERY PLAN " + sql), params).fetchall()
+        lines = [row[-1] for row in plan]
+        return lines, any(line.startswith(f"SCAN {TABLE}") for line in lines)  # SCAN (含 USING INDEX) 為整個表 / 索引掃描
+
+
+def main():
+    parser = argparse.ArgumentParser(description="分時資料查詢的 EXPLAIN (舊條件 vs query_builder)")
+    parser.add_argument("--url", help="SQLAlchemy 連線字串 (例如本機 MySQL)；未指定時使用合成 SQLite 的暫存副本")
+    parser.add_argument("--years", type=float, default=0.25)
+    parser.add_argument("--seed", type=int, default=2088)
+    args = parser.parse_args()
+
+    tmp = None
+    if args.url:
+        engine = create_engine(args.url)
+    else:
+        db = _db_path(args.years, args.seed)
+        if not os.path.exists(db):
+            import synthetic_atm
+            synthetic_atm.load_sqlite(synthetic_atm.generate_atm(args.years, seed=args.seed), db)
+        tmp = tempfile.mkdtemp()
+        shutil.copy(db, os.path.join(tmp, "explain.db"))
+        engine = create_engine(f"sqlite:///{os.path.join(tmp, 'explain.db')}")
+    try:
+        with engine.connect() as c:
+            last = str(c.execute(text(f"SELECT MAX({query_builder.table_schema(engine, TABLE, DATE_COL).q(DATE_COL)}) FROM {TABLE}")).scalar())[:10]
+        # 最後 10 個曆日中挑不連續的幾天 (模擬多日趨勢圖的日期清單)
+        days = [d.strftime("%Y-%m-%d") for d in pd.date_range(end=last, periods=10)][::3]
+
+        schema = query_builder.table_schema(engine, TABLE, DATE_COL, refresh=True)
+        plans = {}  # 查詢名稱 → [(階段, 計畫, 是否全表掃描)]
+        for label, queries in (("舊條件", _legacy_queries(schema.q, days)), ("query_builder (未遷移)", _builder_queries(schema, days))):
+            for name, (sql, params) in queries.items(): plans.setdefault(name, []).append((label, *_explain(engine, sql, params)))
+        print("遷移：")
+        for sql in query_builder.migrate_table(engine, TABLE, DATE_COL): print(f"  {sql}")
+        for name, (sql, params) in _builder_queries(query_builder.table_schema(engine, TABLE, DATE_COL), days).items():
+            plans[name].append(("query_builder (已遷移)", *_explain(engine, sql, params)))
+
+        full_scans = [name for name, stages in plans.items() if stages[-1][2]]
+        for name, stages in plans.items():
+            print(f"\n=== {name} ===")
+            for label, lines, scan in stages:
+                print(f"  [{label}]{'  ⚠️ 全表掃描' if scan else ''}")
+                for line in lines: print(f"      {line}")
+    finally:
+        engine.dispose()
+        if tmp: shutil.rmtree(tmp, ignore_errors=True)
+    if full_scans:
+        print(f"\n⚠️ 遷移後仍為全表掃描：{'、'.join(full_scans)}")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
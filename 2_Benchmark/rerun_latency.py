@@ -0,0 +1,74 @@
+# -*- coding: utf-8 -*-
+# 檔案：rerun_latency.py (主程式啟動 / rerun 延遲量測)
+"""以 streamlit.testing 的 AppTest 執行 4_ATM_merge_interactive.py，比較正式模式 (頁面只匯入一次)
+與開發模式 (ATM_DEV_RELOAD=1，每次 rerun 重新載入頁面) 的延遲：
+
+    python 2_Benchmark/rerun_latency.py                     # 兩種模式 × 兩個頁面
+    python 2_Benchmark/rerun_latency.py --reruns 20
+
+資料使用 run_benchmarks.py 產生的合成 SQLite 資料庫 (不存在時自動產生)。每種模式在獨立子進程中執行，
+「首次執行」包含 Python 模組匯入成本；「rerun」為之後每次重新執行整個腳本 (等同使用者操作元件) 的中位數。
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+ROOT = os.path.dirname(BENCH_DIR)
+sys.path.insert(0, BENCH_DIR)
+from run_benchmarks import MODULE_DIR, _db_path  # noqa: E402
+
+APP = os.path.join(ROOT, "4_ATM_merge_interactive.py")
+
+
+def _run_worker(page_index: int, reruns: int) -> dict:
+    sys.path[:0] = [ROOT, MODULE_DIR]  # streamlit run 會把主程式所在目錄加入 sys.path
+    from streamlit.testing.v1 import AppTest
+    at = AppTest.from_file(APP, default_timeout=300)
+    t0 = time.perf_counter(); at.run(); first = time.perf_counter() - t0
+    radio = at.radio(key="selected_module_name")
+    if page_index:
+        t0 = time.perf_counter(); radio.set_value(radio.options[page_index]).run(); first = time.perf_counter() - t0
+    times = []
+    for _ in range(reruns):
+        t0 = time.perf_counter(); at.run(); times.append(time.perf_counter() - t0)
+    if at.exception: raise RuntimeError(at.exception[0].value)
+    return {"page": radio.options[page_index], "first": first, "rerun": statistics.median(times)}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="主程式 rerun 延遲量測 (正式模式 vs 開發熱重載)")
+    parser.add_argument("--reruns", type=int, default=10)
+    parser.add_argument("--years", type=float, default=1)
+    parser.add_argument("--seed", type=int, default=2088)
+    parser.add_argument("--worker", type=int, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.worker is not None:
+        print(json.dumps(_run_worker(args.worker, args.reruns), ensure_ascii=False))
+        return
+
+    db = _db_path(args.years, args.seed)
+    if not os.path.exists(db):
+        sys.path.insert(0, MODULE_DIR)
+        import synthetic_atm
+        synthetic_atm.load_sqlite(synthetic_atm.generate_atm(args.years, seed=args.seed), db)
+    print(f"{'頁面':<24}{'模式':<10}{'首次執行':>12}{'rerun 中位數':>14}")
+    for page_index in (0, 1):
+        for label, dev in (("正式", "0"), ("開發重載", "1")):
+            with tempfile.TemporaryDirectory() as store:
+                env = {**os.environ, "ATM_DATA_BACKEND": "sqlite", "ATM_SQLITE_PATH": db, "ATM_DEV_RELOAD": dev,
+                       "ATM_FEATURE_STORE_DIR": store, "ATM_MIRROR_DIR": os.path.join(store, "no_mirror")}
+                out = subprocess.run([sys.executable, os.path.abspath(__file__), "--worker", str(page_index), "--reruns", str(args.reruns)],
+                                     env=env, capture_output=True, text=True, check=True)
+            res = json.loads(out.stdout.strip().splitlines()[-1])
+            print(f"{res['page'][:22]:<24}{label:<10}{res['first'] * 1000:>10.0f} ms{res['rerun'] * 1000:>12.1f} ms")
+
+
+if __name__ == "__main__":
+    main()
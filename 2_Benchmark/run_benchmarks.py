@@ -0,0 +1,194 @@
+# -*- coding: utf-8 -*-
+# 檔案：run_benchmarks.py (熱點路徑效能量測)
+"""以合成資料 (0_Module/synthetic_atm.py) 量測各熱點路徑，完全離線 (ATM_DATA_BACKEND=sqlite)。
+
+    python 2_Benchmark/run_benchmarks.py                  # 1 / 3 / 10 年資料各跑一次
+    python 2_Benchmark/run_benchmarks.py --years 1 --repeat 5
+    python 2_Benchmark/run_benchmarks.py --no-save       # 只顯示，不寫入 results.jsonl
+
+合成資料庫快取在 2_Benchmark/data/ (不納入版控)。每次結果附上 git commit 追加到
+2_Benchmark/results.jsonl，並與同一資料量、不同 commit 的上一筆結果比較，變慢超過
+--threshold (預設 25%) 時標示出來。每個資料量在獨立子進程中執行，避免模組層級快取互相影響。
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from dataclasses import replace
+from datetime import datetime, time as dtime
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+ROOT = os.path.dirname(BENCH_DIR)
+MODULE_DIR = os.path.join(ROOT, "0_Module")
+DATA_DIR = os.path.join(BENCH_DIR, "data")
+RESULTS_PATH = os.path.join(BENCH_DIR, "results.jsonl")
+TABLE, DATE_COL, MODE = "atm", "時間戳記", "1344"
+
+
+def _db_path(years: float, seed: int) -> str:
+    return os.path.join(DATA_DIR, f"synthetic_{years:g}y_seed{seed}.db")
+
+
+def _timeit(fn, repeat: int):
+    """回傳 (中位數秒數, 最後一次的回傳值)"""
+    times, result = [], None
+    for _ in range(repeat):
+        t0 = time.perf_counter(); result = fn(); times.append(time.perf_counter() - t0)
+    return statistics.median(times), result
+
+
+# --- 1. 子進程：對單一資料量執行所有量測 ---
+
+TREND_COLUMNS = ["FT價格", "FT漲跌", "價平和(價平)"]  # 同 1_Multi_Filter_Display 趨勢圖
+
+
+def _memory_report(repo, days, compact) -> dict:
+    """10 日分時資料的記憶體 (deep)：舊版 SELECT * + 逐欄 to_datetime / to_numeric，與欄位投影 + 精簡型別"""
+    import pandas as pd
+    legacy = repo.fetch_intraday(MODE, dates=days)
+    legacy["dt"] = pd.to_datetime(legacy[DATE_COL], errors="coerce")
+    for c in ("FT價格", "價平和(價平)", "FT漲跌", "價平和漲跌(價平)"):
+        if c in legacy.columns: legacy[c] = pd.to_numeric(legacy[c], errors="coerce")
+    return {"legacy": int(legacy.memory_usage(deep=True).sum()), "compact": int(compact.memory_usage(deep=True).sum()),
+            "rows": len(compact), "legacy_columns": len(legacy.columns), "compact_columns": len(compact.columns)}
+
+def _run_worker(years: float, seed: int, repeat: int) -> dict:
+    sys.path.insert(0, MODULE_DIR)
+    import synthetic_atm
+    db = _db_path(years, seed)
+    if not os.path.exists(db):
+        synthetic_atm.load_sqlite(synthetic_atm.generate_atm(years, seed=seed), db)
+
+    import pandas as pd
+    from daily_seamless_trend import _fetch_intraday_data, _prepare_seamless_data
+    from feature_store import get_feature_matrix, window_series, day_frame
+    from repository import DailyFilter, get_repository
+    from similarity_search import parallel_top_n_dtw_search
+    from Trend import TrendOptions, make_trend
+
+    repo = get_repository(TABLE, DATE_COL)
+    all_days = repo.unique_dates(MODE)
+    first_day, last_day = all_days[0], all_days[-1]
+    trend_days = pd.date_range(end=last_day, periods=10).strftime("%Y-%m-%d").tolist()
+    results = {"rows": None, "days": len(all_days)}
+
+    def bench(name, fn):
+        seconds, value = _timeit(fn, repeat)
+        results[name] = seconds
+        return value
+
+    rows = bench("fetch_intraday_data_10d", lambda: _fetch_intraday_data(TABLE, DATE_COL, MODE, trend_days, columns=TREND_COLUMNS))
+    results["memory"] = _memory_report(repo, trend_days, rows)
+    results["rows"] = int(repo._query(f'SELECT COUNT(*) AS n FROM "{TABLE}"').at[0, "n"])
+    bench("daily_filter_full_range", lambda: repo.daily_filter(DailyFilter(first_day, last_day, MODE)))
+    bench("daily_filter_time_window", lambda: repo.daily_filter(DailyFilter(first_day, last_day, MODE, time_range=("09:00", "10:30"))))
+    bench("prepare_seamless_10d", lambda: _prepare_seamless_data(rows, trend_days[0], trend_days[-1]))
+    # 快取命中的查詢成本：舊版 st.cache_data 每次雜湊整個 rows，artifact_cache 只比對 token
+    import streamlit as st
+    from artifact_cache import artifact_token
+    legacy_prepare = st.cache_data(show_spinner=False)(_prepare_seamless_data)
+    legacy_prepare(rows, trend_days[0], trend_days[-1])
+    bench("prepare_seamless_10d_cache_data_hit", lambda: legacy_prepare(rows, trend_days[0], trend_days[-1]))
+    token = artifact_token("seamless", TABLE, DATE_COL, MODE, trend_days[0], trend_days[-1], TREND_COLUMNS)
+    _prepare_seamless_data(rows, trend_days[0], trend_days[-1], token=token)
+    bench("prepare_seamless_10d_token_hit", lambda: _prepare_seamless_data(rows, trend_days[0], trend_days[-1], token=token))
+    base = TrendOptions(start_date=trend_days[0], days=10, time_col="dt", ft_col="FT價格", kph_cols=["價平和(價平)"])
+    bench("make_trend_10d_legacy", lambda: make_trend(rows, base))
+    bench("make_trend_10d_fast", lambda: make_trend(rows, replace(base, fast_render=True, max_points=4000)))
+
+    # 相似度分析完整流程 (同 5_Trend_Similarity_Analyzer)：特徵矩陣 → 時間窗正規化 → Top-N DTW → 結果圖資料
+    def similarity_run():
+        fm = get_feature_matrix(TABLE, DATE_COL, MODE, first_day, last_day)
+        start_t, end_t = dtime(9, 0), dtime(10, 0)
+        norm, counts = window_series(fm, start_t, end_t, "Relative Magnitude")
+        day_strs = fm.day_strings; template_idx = day_strs.index(last_day)
+        cand = [i for i in range(len(day_strs)) if i != template_idx and counts[i] >= 5]
+        ranked = parallel_top_n_dtw_search(norm[template_idx], [norm[i] for i in cand], top_n=15)
+        return [day_frame(fm, cand[i], start_t, end_t) for i, _ in ranked]
+
+    store = os.environ["ATM_FEATURE_STORE_DIR"]
+    def similarity_cold():
+        import shutil
+        shutil.rmtree(store, ignore_errors=True)
+        return similarity_run()
+    bench("similarity_full_cold_store", similarity_cold)
+    bench("similarity_full_warm_store", similarity_run)
+    return results
+
+
+# --- 2. 主進程：產生資料、逐一資料量執行、比較並保存 ---
+
+def _git_commit() -> str:
+    try:
+        sha = subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], cwd=ROOT, text=True).strip()
+        dirty = subprocess.run(["git", "diff", "--quiet", "HEAD"], cwd=ROOT).returncode != 0
+        return sha + ("-dirty" if dirty else "")
+    except Exception:
+        return "unknown"
+
+
+def _previous(records, years, bench, commit):
+    for r in reversed(records):
+        if r["years"] == years and r["bench"] == bench and r["commit"] != commit:
+            return r
+    return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description="ATM 熱點路徑效能量測")
+    parser.add_argument("--years", type=float, nargs="+", default=[1, 3, 10])
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--seed", type=int, default=2088)
+    parser.add_argument("--threshold", type=float, default=0.25, help="與上一筆結果相比變慢超過此比例時標示")
+    parser.add_argument("--no-save", action="store_true")
+    parser.add_argument("--worker", action="store_true", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.worker:
+        print(json.dumps(_run_worker(args.years[0], args.seed, args.repeat)))
+        return
+
+    os.makedirs(DATA_DIR, exist_ok=True)
+    records = []
+    if os.path.exists(RESULTS_PATH):
+        with open(RESULTS_PATH, "r", encoding="utf-8") as f:
+            records = [json.loads(line) for line in f if line.strip()]
+    commit, stamp, new_records, regressions = _git_commit(), datetime.now().isoformat(timespec="seconds"), [], []
+    for years in args.years:
+        with tempfile.TemporaryDirectory() as store:
+            env = {**os.environ, "ATM_DATA_BACKEND": "sqlite", "ATM_SQLITE_PATH": _db_path(years, args.seed),
+                   "ATM_FEATURE_STORE_DIR": store, "ATM_MIRROR_DIR": os.path.join(store, "no_mirror")}
+            out = subprocess.run([sys.executable, os.path.abspath(__file__), "--worker", "--years", str(years), "--repeat", str(args.repeat), "--seed", str(args.seed)],
+                                 env=env, capture_output=True, text=True, check=True)
+        res = json.loads(out.stdout.strip().splitlines()[-1])
+        print(f"\n=== {years:g} 年 ({res['rows']:,} 列, {res['days']} 個交易日) ===")
+        mem = res["memory"]
+        print(f"  {'記憶體 fetch_intraday_data_10d':<24} {mem['legacy'] / 2**20:8.2f} MiB ({mem['legacy_columns']} 欄) → "
+              f"{mem['compact'] / 2**20:.2f} MiB ({mem['compact_columns']} 欄, {mem['rows']:,} 列)")
+        for bench, seconds in res.items():
+            if bench in ("rows", "days", "memory"): continue
+            prev = _previous(records, years, bench, commit)
+            note = ""
+            if prev:
+                ratio = seconds / prev["seconds"] if prev["seconds"] else float("inf")
+                note = f"  vs {prev['commit']}: {ratio:.2f}x"
+                if ratio > 1 + args.threshold:
+                    note += "  ⚠️ 變慢"; regressions.append((years, bench, ratio))
+            print(f"  {bench:<36} {seconds * 1000:10.1f} ms{note}")
+            new_records.append({"commit": commit, "time": stamp, "years": years, "rows": res["rows"], "bench": bench,
+                                "seconds": round(seconds, 6), "repeat": args.repeat, "python": sys.version.split()[0]})
+    if not args.no_save:
+        with open(RESULTS_PATH, "a", encoding="utf-8") as f:
+            for r in new_records: f.write(json.dumps(r, ensure_ascii=False) + "\n")
+        print(f"\n結果已追加至 {os.path.relpath(RESULTS_PATH, ROOT)}")
+    if regressions:
+        print(f"\n⚠️ {len(regressions)} 項變慢超過 {args.threshold:.0%}：" + "、".join(f"{b} ({y:g} 年, {r:.2f}x)" for y, b, r in regressions))
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
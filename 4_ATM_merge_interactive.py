@@ -15,6 +15,28 @@ MODULE_DIR = os.path.join(ROOT, "0_Module")
 if MODULE_DIR not in sys.path:
     sys.path.insert(0, MODULE_DIR)
 
+import perf_trace
+from artifact_cache import ARTIFACT_CACHE
+from streamlit.runtime.scriptrunner import get_script_run_ctx
+
+# --- 執行模式 ---
+# 預設 (正式)：每個頁面模組只在第一次開啟時匯入，之後的 rerun 直接沿用 (模組層級的快取也保留)；
+# 開發時設定 ATM_DEV_RELOAD=1 (或 secrets.toml 的 dev_reload = true)，每次 rerun 都重新載入頁面以便熱更新。
+def _dev_reload_enabled() -> bool:
+    value = os.environ.get("ATM_DEV_RELOAD")
+    if value is None:
+        try: value = st.secrets.get("dev_reload")
+        except Exception: value = None
+    return str(value or "").strip().lower() in ("1", "true", "yes", "on")
+
+DEV_RELOAD = _dev_reload_enabled()
+
+# --- 啟動暖機 ---
+# 行程內第一次執行時在背景預先建立交易日曆並查詢日期範圍 / 年份 (prefetch.warm_up 只執行一次)，
+# 第一位使用者開啟頁面時不必等待冷啟動查詢；ATM_PREFETCH_WORKERS=0 時停用。
+import prefetch
+prefetch.warm_up()
+
 # --- 可用模組（已移除「趨勢圖批次生成與存檔」） ---
 MODULES = {
     "🎯 1. 多條件篩選與趨勢圖顯示": "1_Multi_Filter_Display",
@@ -50,12 +72,16 @@ with st.sidebar:
         on_click=_clear_and_reset,
         use_container_width=True,
     )
+    show_perf_panel = st.checkbox("⏱️ 顯示效能面板", key="show_perf_panel", help="列出本次執行中每個資料庫查詢與主要階段的耗時、列數、資料量與快取命中情形。")
 
 # --- 載入與執行所選模組 ---
 def load_module_and_render(module_name: str):
     try:
-        module = importlib.import_module(module_name)
-        importlib.reload(module)
+        first_import = module_name not in sys.modules
+        with perf_trace.span(f"import:{module_name}", first_import=first_import, dev_reload=DEV_RELOAD):
+            module = importlib.import_module(module_name)  # 頁面的重量級相依 (plotly、DTW 搜尋等) 在第一次開啟該頁時才載入
+            if DEV_RELOAD and not first_import:
+                importlib.reload(module)
 
         # 兩個模組的慣例入口
         if hasattr(module, "render_page"):
@@ -68,5 +94,23 @@ def load_module_and_render(module_name: str):
         st.error(f"❌ 執行模組 '{module_name}' 時發生錯誤！")
         st.exception(e)
 
+def render_perf_panel():
+    """側欄效能面板：本次執行記錄到的查詢與階段"""
+    spans = perf_trace.current_spans()
+    with st.sidebar:
+        st.markdown("---"); st.subheader("⏱️ 效能面板")
+        for kind, a in ARTIFACT_CACHE.stats().items():  # 行程累計：各衍生產物的命中率與以 token 查詢省下的時間
+            st.caption(f"產物快取 {kind}：命中 {a.hits} / 未命中 {a.misses} (命中率 {a.hit_rate:.0%})｜省下 {a.saved_seconds * 1000:,.0f} ms，查詢共 {a.lookup_seconds * 1000:,.2f} ms")
+        if not spans: st.caption("本次執行沒有記錄到查詢或階段。"); return
+        db = [sp for sp in spans if sp.kind == "db"]
+        hits = sum(sp.cache == "hit" for sp in db)
+        top = sum(sp.seconds for sp in spans if sp.depth == 0)
+        st.caption(f"總耗時 {top * 1000:,.0f} ms｜資料庫查詢 {len(db)} 次 (快取命中 {hits}、未命中 {len(db) - hits})，共 {sum(sp.seconds for sp in db) * 1000:,.0f} ms")
+        st.dataframe(perf_trace.spans_frame(spans), hide_index=True, use_container_width=True)
+
+ctx = get_script_run_ctx()
+perf_trace.start_run(page=MODULES[selected_module_name], session=ctx.session_id if ctx else None)
 st.subheader(selected_module_name)
-load_module_and_render(MODULES[selected_module_name])
+with perf_trace.span(f"page:{MODULES[selected_module_name]}"):
+    load_module_and_render(MODULES[selected_module_name])
+if show_perf_panel: render_perf_panel()
@@ -1,4 +1,5 @@
 # 檔案：5_Trend_Similarity_Analyzer.py (雲端資料庫版本)
+import os
 import streamlit as st
 import pandas as pd
 import numpy as np
@@ -6,9 +7,14 @@ import plotly.graph_objs as go
 from datetime import time, datetime
 import calendar
 
-from daily_seamless_trend import _fetch_intraday_data, _get_all_unique_dates
-try: from dtw import dtw
-except ImportError: st.error("錯誤：缺少 'dtw-python' 套件。請在終端機執行 `pip install dtw-python` 後再試一次。"); st.stop()
+from artifact_cache import ARTIFACT_CACHE, artifact_token
+from daily_seamless_trend import _get_all_unique_dates
+from data_version import version_for
+from feature_store import get_feature_matrix, window_series, day_frame
+from similarity_index import get_window_index, paa_vectors, recall_at_n, shortlist_size
+from similarity_search import SimilarityJob, default_worker_count
+from subsequence_search import search_subsequences, template_window
+import perf_trace
 
 TABLE = "atm"
 DATE_COL = "時間戳記"
@@ -16,15 +22,9 @@ DEFAULT_MODE = "1344"
 FT_COL = "FT價格"
 CHARTS_PER_ROW = 3
 WEEKDAYS_CH = ['一', '二', '三', '四', '五', '六', '日']
-
-def _normalize_series(series: pd.Series, method: str) -> pd.Series:
-    if series.empty or len(series) < 2: return pd.Series(dtype=np.float64)
-    if method == "Relative Magnitude": return series / series.iloc[0]
-    elif method == "Pure Shape":
-        min_val, max_val = series.min(), series.max()
-        if max_val == min_val: return pd.Series(np.zeros(len(series)), index=series.index)
-        return (series - min_val) / (max_val - min_val)
-    return pd.Series(dtype=np.float64)
+JOB_KEY = "__similarity_job__"
+SEARCH_MODES = ["精確", "快速", "任意時段"]
+POLL_SECONDS = 0.3
 
 def _plot_comparison_chart(df: pd.DataFrame, title: str):
     if df.empty: return go.Figure().update_layout(title="無數據")
@@ -37,7 +37,7 @@ def display_results(template_df, template_date, top_results):
     st.markdown("---"); st.subheader("📈 分析結果"); col1, col2 = st.columns([1, 2])
     with col1: st.markdown(f"#### 基準範本"); st.plotly_chart(_plot_comparison_chart(template_df, f"日期: {template_date}"), use_container_width=True)
     with col2:
-        st.markdown("#### 相似度排行榜 (分數越低越相似)"); display_df = pd.DataFrame(top_results)[['date', 'similarity_score']]; display_df['similarity_score'] = display_df['similarity_score'].round(4)
+        st.markdown("#### 相似度排行榜 (分數越低越相似)"); display_df = pd.DataFrame(top_results); display_df = display_df[[c for c in ['date', 'window', 'similarity_score'] if c in display_df.columns]]; display_df['similarity_score'] = display_df['similarity_score'].round(4)
         st.dataframe(display_df, use_container_width=True, hide_index=True)
     st.markdown("---")
     if top_results:
@@ -45,12 +45,69 @@ def display_results(template_df, template_date, top_results):
         for i in range(0, num_results, CHARTS_PER_ROW):
             cols = st.columns(CHARTS_PER_ROW); row_results = top_results[i : i + CHARTS_PER_ROW]
             for j, result in enumerate(row_results):
-                with cols[j]: st.plotly_chart(_plot_comparison_chart(result['raw_data'], f"{result['date']} (Score: {result['similarity_score']:.2f})"), use_container_width=True)
+                with cols[j]: st.plotly_chart(_plot_comparison_chart(result['raw_data'], f"{result['date']}{' ' + result['window'] if 'window' in result else ''} (Score: {result['similarity_score']:.2f})"), use_container_width=True)
+
+def _job_results(state, ranked, with_frames: bool = True):
+    fm, day_strs, cand = state["fm"], state["day_strs"], state["candidate_idx"]
+    return [{"date": day_strs[cand[idx]], "similarity_score": score, **({"raw_data": day_frame(fm, cand[idx], state["start_time"], state["end_time"])} if with_frames else {})} for idx, score in ranked]
+
+def _minute_time(minute: int) -> time:
+    return time(minute // 60, minute % 60)
+
+def _show_subsequence(state):
+    """任意時段模式：每個交易日最相似的片段 (日期 + 起訖時間)"""
+    fm, day_strs, matches = state["fm"], state["day_strs"], state["subsequence"]
+    st.caption(f"🧭 任意時段：在 {state['days']} 個交易日的完整交易時段上滑動範本，耗時 {state['seconds'] * 1000:.0f} ms (z-正規化距離，只比較形狀)。")
+    if not matches: st.warning("找不到任何可用於比對的歷史數據。"); return
+    results = [{"date": day_strs[m.day_index], "window": f"{_minute_time(m.start_minute):%H:%M}~{_minute_time(m.start_minute + m.length - 1):%H:%M}", "similarity_score": m.distance,
+                "raw_data": day_frame(fm, m.day_index, _minute_time(m.start_minute), _minute_time(m.start_minute + m.length - 1))} for m in matches]
+    display_results(state["template_df"], state["template_date"], results)
+
+def _follow_job(state):
+    """背景搜尋進行中時由 _job_progress 片段輪詢進度 (頁面其餘部分照常顯示)；完成或停止後顯示 (目前) 最佳結果"""
+    if "subsequence" in state: _show_subsequence(state); return
+    job = state["job"]
+    if state.get("fast_fallback"): st.info("ℹ️ 快速模式需要限制結果數量；目前為「不限制」，已改用精確搜尋 (對所有交易日計算 DTW)。")
+    if not job.wait(0): _job_progress(state); return
+    snap = job.snapshot()
+    with perf_trace.span("similarity:dtw_scoring", workers=job.workers, parallel=job.parallel, job_seconds=round(snap.elapsed, 3)) as sp: sp.observe(snap.results)
+    if snap.error is not None: st.error(f"相似度分析失敗：{snap.error}"); return
+    if snap.cancelled: st.warning(f"分析已停止：已比對 {snap.done}/{snap.total} 個交易日 ({snap.elapsed:.1f} 秒)，以下為目前找到的最佳結果。")
+    if "fast" in state: st.caption(f"⚡ 快速模式：索引挑出 {state['fast']['shortlist']} / {state['fast']['total']} 個交易日 ({state['fast']['seconds'] * 1000:.0f} ms)，DTW 重新排序 {snap.elapsed:.2f} 秒。")
+    if "exact_job" in state: _report_recall(state, snap)
+    if not snap.results: st.warning("找不到任何可用於比對的歷史數據。")
+    else: display_results(state["template_df"], state["template_date"], _job_results(state, snap.results))
+
+@st.fragment(run_every=POLL_SECONDS)
+def _job_progress(state):
+    """每 POLL_SECONDS 秒只重新執行此片段：讀取一次 snapshot 顯示進度與暫定排行榜；搜尋結束時重新執行整頁以顯示結果"""
+    job = state["job"]
+    if st.button("⏹️ 停止分析", key="similarity_cancel", help="停止後保留目前為止找到的最佳結果。"): job.cancel(); job.wait()
+    snap = job.snapshot()
+    if snap.finished: st.rerun()
+    st.progress(snap.done / max(snap.total, 1), text=f"正在比對 {snap.done}/{snap.total} 個交易日... ({snap.elapsed:.1f} 秒，可隨時停止或重新設定參數)")
+    if snap.results: st.dataframe(pd.DataFrame(_job_results(state, snap.results, with_frames=False)).round({"similarity_score": 4}), use_container_width=True, hide_index=True, height=250)
+
+def _report_recall(state, snap):
+    """背景精確搜尋完成後，回報快速模式結果的召回率 (進行中時由 _recall_progress 片段輪詢)"""
+    exact_job = state["exact_job"]
+    if snap.cancelled: exact_job.cancel()
+    if not exact_job.wait(0): _recall_progress(exact_job); return
+    exact = exact_job.snapshot()
+    if exact.cancelled or exact.error is not None: st.caption("📏 精確搜尋未完成，無法計算召回率。"); return
+    fast_days = [state["candidate_idx"][i] for i, _ in snap.results]; exact_days = [state["exact_candidate_idx"][i] for i, _ in exact.results]
+    st.caption(f"📏 召回率 (相對精確模式)：{recall_at_n(fast_days, exact_days):.0%} (前 {len(exact_days)} 名)｜精確搜尋耗時 {exact.elapsed:.2f} 秒，快速模式 {state['fast']['seconds'] + snap.elapsed:.2f} 秒")
+
+@st.fragment(run_every=POLL_SECONDS)
+def _recall_progress(exact_job):
+    done = exact_job.snapshot()
+    if done.finished: st.rerun()
+    st.caption(f"📏 精確搜尋進行中 ({done.done}/{done.total})，完成後回報召回率...")
 
 def render_page_similarity_analyzer():
     st.markdown("##### 透過選擇「基準範本」與「時間區間」，找出歷史上走勢最相似的交易日。")
     with st.container(border=True):
-        all_days = _get_all_unique_dates(TABLE, DATE_COL, DEFAULT_MODE); all_days_set = set(all_days)
+        all_days = _get_all_unique_dates(TABLE, DATE_COL, DEFAULT_MODE, version_for(TABLE, DATE_COL, mode=DEFAULT_MODE)); all_days_set = set(all_days)
         if not all_days: st.error("無法從資料庫讀取有效的交易日清單。"); return
         c1, c2, c3 = st.columns([2, 1, 1])
         with c1:
@@ -62,9 +119,14 @@ def render_page_similarity_analyzer():
             template_date = f"{selected_year}-{selected_month}-{selected_day}"
         with c2: st.markdown("**2. 設定開始時間**"); start_time = st.time_input("開始時間", value=time(9, 0), key="start_time_selector", label_visibility="collapsed")
         with c3: st.markdown("**3. 設定結束時間**"); end_time = st.time_input("結束時間", value=time(10, 0), key="end_time_selector", label_visibility="collapsed")
-        c4, c5, c6 = st.columns([2, 2, 1])
+        c4, c5, c7, c8, c9, c6 = st.columns([2, 2, 1, 1, 1, 1])
         with c4: norm_method = st.selectbox("**4. 分析方法 (功力旋鈕)**", options=["Relative Magnitude", "Pure Shape"], index=0, help="**Relative Magnitude**: 注重相對漲跌幅度與力道。\n\n**Pure Shape**: 只看走勢形狀，忽略波動大小。", key="norm_method_selector")
         with c5: top_n_selection = st.selectbox("**5. 顯示結果數量**", options=[15, 30, 45, "不限制"], index=3, key="top_n_selector")
+        with c7: dtw_window = st.number_input("**6. DTW 視窗 (分)**", min_value=0, max_value=600, value=0, step=1, help="Sakoe-Chiba 視窗寬度，限制對齊時最多可錯開的分鐘數；0 表示不限制 (與原 dtw-python 結果相同)。", key="dtw_window_selector")
+        with c8: n_workers = st.number_input("**7. 平行核心數**", min_value=1, max_value=max(1, os.cpu_count() or 1), value=min(default_worker_count(), max(1, os.cpu_count() or 1)), step=1, help="DTW 評分使用的子進程數量；1 表示在目前進程內計算。預設值可由環境變數 ATM_SIMILARITY_WORKERS 設定。", key="n_workers_selector")
+        with c9:
+            search_mode = st.selectbox("**8. 搜尋模式**", SEARCH_MODES, index=0, help="**精確**：對所有交易日計算 DTW。\n\n**快速**：先以 PAA 特徵索引挑出候選短名單 (結果數量 × 5，至少 50 天)，再對短名單計算精確 DTW；結果可能略有不同。結果數量為「不限制」時沒有短名單，改用精確搜尋。\n\n**任意時段**：把範本在每個交易日的整個交易時段上滑動 (FFT 距離剖面)，找出任何時間點形狀最接近的片段；距離為 z-正規化歐氏距離，只比較形狀 (不使用分析方法與 DTW 視窗)。", key="search_mode_selector")
+            report_recall = st.checkbox("比較召回率", value=False, help="快速模式下同時在背景執行精確搜尋，完成後回報快速結果的召回率 (需限制結果數量)。", key="report_recall_checkbox", disabled=(search_mode != "快速" or top_n_selection == "不限制"))
         with c6: st.markdown("<br/>", unsafe_allow_html=True); run_analysis = st.button("🚀 開始分析", type="primary", use_container_width=True)
         st.caption(f"✅ 日期 `{template_date}` 是有效交易日" if template_date in all_days_set else f"⚠️ 日期 `{template_date}` 非資料庫中的交易日")
     if run_analysis:
@@ -72,20 +134,38 @@ def render_page_similarity_analyzer():
         top_n = None if top_n_selection == "不限制" else top_n_selection; start_dt, end_dt = datetime.combine(datetime.strptime(template_date, '%Y-%m-%d'), start_time), datetime.combine(datetime.strptime(template_date, '%Y-%m-%d'), end_time)
         if start_dt >= end_dt: st.error("錯誤：開始時間必須早於結束時間。")
         else:
-            progress_bar = st.progress(0, text="正在初始化分析..."); template_df_raw = _fetch_intraday_data(TABLE, DATE_COL, DEFAULT_MODE, [template_date]); template_df = template_df_raw[(template_df_raw['dt'] >= start_dt) & (template_df_raw['dt'] <= end_dt)]
-            if len(template_df) < 5: st.warning(f"基準範本 ({template_date}) 在指定時間區間內的數據不足 (少於5筆)，請更換日期或擴大時間區間。")
+            progress_bar = st.progress(0, text="正在載入每日分鐘特徵矩陣..."); fm = perf_trace.traced("similarity:feature_matrix")(get_feature_matrix)(TABLE, DATE_COL, DEFAULT_MODE, all_days[0], all_days[-1]); day_strs = fm.day_strings; day_pos = {d: i for i, d in enumerate(day_strs)}
+            series_token = artifact_token("window_series", TABLE, DATE_COL, DEFAULT_MODE, all_days[0], all_days[-1], [FT_COL], params=(start_time, end_time, norm_method))
+            window_norm, window_counts = ARTIFACT_CACHE.get_or_build(series_token, lambda: window_series(fm, start_time, end_time, norm_method)); template_idx = day_pos.get(template_date); progress_bar.empty()
+            if template_idx is None or window_counts[template_idx] < 5: st.warning(f"基準範本 ({template_date}) 在指定時間區間內的數據不足 (少於5筆)，請更換日期或擴大時間區間。")
             else:
-                template_series_norm = _normalize_series(template_df[FT_COL].reset_index(drop=True), norm_method); results = []; total_days = len(all_days)
-                for i, day in enumerate(all_days):
-                    progress_bar.progress((i + 1) / total_days, text=f"正在比對 {day}...");
-                    if day == template_date: continue
-                    day_dt_obj, day_start_dt, day_end_dt = datetime.strptime(day, '%Y-%m-%d'), datetime.combine(datetime.strptime(day, '%Y-%m-%d'), start_time), datetime.combine(datetime.strptime(day, '%Y-%m-%d'), end_time)
-                    historical_df_raw = _fetch_intraday_data(TABLE, DATE_COL, DEFAULT_MODE, [day]); historical_df = historical_df_raw[(historical_df_raw['dt'] >= day_start_dt) & (historical_df_raw['dt'] <= day_end_dt)]
-                    if len(historical_df) >= 5:
-                        historical_series_norm = _normalize_series(historical_df[FT_COL].reset_index(drop=True), norm_method)
-                        distance = dtw(template_series_norm.values, historical_series_norm.values, distance_only=True).distance
-                        results.append({"date": day, "similarity_score": distance, "raw_data": historical_df})
-                progress_bar.empty()
-                if not results: st.warning("找不到任何可用於比對的歷史數據。")
-                else: display_results(template_df, template_date, sorted(results, key=lambda x: x['similarity_score'])[:top_n])
-    else: st.info("請設定好以上參數後，點擊「開始分析」按鈕。")
\ No newline at end of file
+                previous = st.session_state.pop(JOB_KEY, None)
+                for old_job in ((previous or {}).get("job"), (previous or {}).get("exact_job")):
+                    if old_job is not None: old_job.cancel()  # 重新設定參數時直接放棄上一次尚未完成的搜尋
+                candidate_idx = [i for i, d in enumerate(day_strs) if i != template_idx and window_counts[i] >= 5 and d in all_days_set]
+                template, dtw_w, state = window_norm[template_idx], (int(dtw_window) or None), {}
+                if search_mode == "任意時段":
+                    lo, hi = start_time.hour * 60 + start_time.minute, end_time.hour * 60 + end_time.minute
+                    with perf_trace.span("similarity:subsequence") as sp:
+                        matches = sp.observe(search_subsequences(fm, template_window(fm, template_idx, lo, hi), top_n, exclude_days=[template_idx], day_rows=[i for i, d in enumerate(day_strs) if d in all_days_set]))
+                    st.session_state[JOB_KEY] = {"subsequence": matches, "seconds": sp.seconds, "days": len(all_days_set), "fm": fm, "day_strs": day_strs,
+                                                 "template_date": template_date, "template_df": day_frame(fm, template_idx, start_time, end_time)}
+                elif search_mode == "快速" and top_n:
+                    with perf_trace.span("similarity:index_shortlist") as sp:
+                        index = get_window_index((TABLE, DEFAULT_MODE, start_time, end_time, norm_method), fm.dates, window_norm, window_counts)
+                        allowed = set(candidate_idx)
+                        shortlist = [i for i in index.query(paa_vectors([template])[0], shortlist_size(top_n, len(candidate_idx)) + len(day_strs) - len(allowed) - 1, exclude=[template_idx]) if i in allowed][:shortlist_size(top_n, len(candidate_idx))]
+                        sp.observe(shortlist)
+                    state = {"fast": {"shortlist": len(shortlist), "total": len(candidate_idx), "seconds": sp.seconds}}
+                    if report_recall:
+                        state["exact_job"] = SimilarityJob(template, [window_norm[i] for i in candidate_idx], top_n=top_n, window=dtw_w, workers=int(n_workers)).start()
+                        state["exact_candidate_idx"] = candidate_idx
+                    candidate_idx = shortlist
+                elif search_mode == "快速":
+                    state = {"fast_fallback": True}  # 不限制結果數量時沒有短名單可挑
+                if search_mode != "任意時段":
+                    job = SimilarityJob(template, [window_norm[i] for i in candidate_idx], top_n=top_n, window=dtw_w, workers=int(n_workers)).start()
+                    st.session_state[JOB_KEY] = {**state, "job": job, "fm": fm, "day_strs": day_strs, "candidate_idx": candidate_idx, "start_time": start_time, "end_time": end_time,
+                                                 "template_date": template_date, "template_df": day_frame(fm, template_idx, start_time, end_time)}
+    if JOB_KEY in st.session_state: _follow_job(st.session_state[JOB_KEY])
+    elif not run_analysis: st.info("請設定好以上參數後，點擊「開始分析」按鈕。")
\ No newline at end of file
@@ -0,0 +1,136 @@
+# 檔案：test_daily_seamless_trend.py (夜盤 / 日盤縫合資料與原逐列迴圈的一致性)
+"""以合成資料比對 _prepare_seamless_data / _prepare_day_session_data 與原本逐列插入斷層列的實作：
+
+    python -m pytest -q tests
+"""
+import os
+import sys
+from datetime import timedelta
+
+import numpy as np
+import pandas as pd
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "0_Module"))
+from daily_seamless_trend import (FT_COL, KPH_COL, T_PLUS_1_CUTOFF, TARGET_END_TIME_DAY, _compact_intraday,  # noqa: E402
+                                  _prepare_day_session_data, _prepare_seamless_data, time)
+from synthetic_atm import generate_atm  # noqa: E402
+
+MAX_GAP_SEC = 10 * 60
+
+
+# --- 1. 原逐列實作 (對照組) ---
+
+def _legacy_gap_loop(dff: pd.DataFrame, nan_cols) -> pd.DataFrame:
+    rows, x_counter = [], 0
+    for i in range(len(dff)):
+        current_row = dff.iloc[i].copy()
+        if i > 0:
+            prev_dt = dff.iloc[i - 1]['dt']
+            if (current_row['dt'] - prev_dt).total_seconds() > MAX_GAP_SEC:
+                nan_row = dff.iloc[i - 1].copy()
+                nan_row[nan_cols] = np.nan
+                nan_row['dt'] = prev_dt + timedelta(minutes=1)
+                nan_row['x_sequence'] = x_counter
+                rows.append(nan_row)
+                x_counter += 1
+        current_row['x_sequence'] = x_counter
+        rows.append(current_row)
+        x_counter += 1
+    return pd.DataFrame(rows).reset_index(drop=True)
+
+
+def _legacy_seamless(df: pd.DataFrame, start_date_str: str, end_date_str: str) -> pd.DataFrame:
+    if df.empty: return df
+    df = df.copy()
+    df['dt_date'] = df['dt'].dt.strftime('%Y-%m-%d')
+    df['dt_time'] = df['dt'].dt.time
+    cond1 = (df['dt_date'] == start_date_str) & (df['dt_time'] >= time(15, 0))
+    cond2 = (df['dt_date'] == end_date_str) & (df['dt_time'] < T_PLUS_1_CUTOFF)
+    dff = df[cond1 | cond2].copy()
+    if dff.empty: return dff
+    dff['x_sequence'] = dff.index
+    dff = dff.sort_values('dt').reset_index(drop=True)
+    return _legacy_gap_loop(dff, [FT_COL, KPH_COL])
+
+
+def _legacy_day_session(df: pd.DataFrame) -> pd.DataFrame:
+    if df.empty: return df
+    df = df.copy()
+    df['dt_date'] = df['dt'].dt.strftime('%Y-%m-%d')
+    df['dt_time'] = df['dt'].dt.time
+    dff = df[(df['dt_time'] >= time(8, 45)) & (df['dt_time'] <= TARGET_END_TIME_DAY)].copy()
+    if dff.empty: return dff
+    dff['x_sequence'] = np.arange(len(dff))
+    dff = dff.sort_values('dt').reset_index(drop=True)
+    return _legacy_gap_loop(dff, [FT_COL])
+
+
+# --- 2. 合成資料 ---
+
+@pytest.fixture(scope="module")
+def intraday() -> pd.DataFrame:
+    raw = generate_atm(years=0.1, seed=2088)
+    df = _compact_intraday(raw[raw["mode"] == "1344"].reset_index(drop=True), "時間戳記")
+    # 人為斷層：刪除第一個交易日 10:00~10:30 與 20:00~21:00 (日盤 / 夜盤各一個超過 10 分鐘的缺口)
+    first = df['dt'].dt.normalize().iloc[0]
+    cut = df['dt'].between(first + pd.Timedelta("10:00:00"), first + pd.Timedelta("10:30:00")) | \
+        df['dt'].between(first + pd.Timedelta("20:00:00"), first + pd.Timedelta("21:00:00"))
+    return df[~cut].reset_index(drop=True)
+
+
+def _assert_same(new: pd.DataFrame, old: pd.DataFrame):
+    assert len(new) == len(old)
+    if old.empty: return
+    new = new[old.columns]
+    pd.testing.assert_series_equal(new['dt'], old['dt'].astype(new['dt'].dtype), check_names=False)
+    np.testing.assert_array_equal(new['x_sequence'].to_numpy(np.int64), old['x_sequence'].to_numpy(np.int64))
+    for col in (FT_COL, KPH_COL, 'dt_date', 'dt_time'):
+        if col in old.columns:
+            assert new[col].astype(object).where(new[col].notna(), None).tolist() == \
+                old[col].astype(object).where(old[col].notna(), None).tolist(), col
+
+
+# --- 3. 測試 ---
+
+def test_seamless_matches_legacy_for_consecutive_days(intraday):
+    days = sorted(intraday['dt'].dt.strftime('%Y-%m-%d').unique())
+    for start, end in zip(days, days[1:]):
+        _assert_same(_prepare_seamless_data(intraday, start, end), _legacy_seamless(intraday, start, end))
+
+
+def test_seamless_inserts_gap_rows(intraday):
+    day = intraday['dt'].dt.strftime('%Y-%m-%d').iloc[0]
+    nxt = (pd.Timestamp(day) + pd.Timedelta(days=1)).strftime('%Y-%m-%d')
+    out = _prepare_seamless_data(intraday, day, nxt)
+    assert out[FT_COL].isna().any()
+    _assert_same(out, _legacy_seamless(intraday, day, nxt))
+
+
+def test_seamless_empty_selection(intraday):
+    # 週六 → 週一等沒有夜盤資料的組合：回傳空表，不可回傳全部列
+    out = _prepare_seamless_data(intraday, "1999-01-02", "1999-01-04")
+    assert out.empty
+    _assert_same(out, _legacy_seamless(intraday, "1999-01-02", "1999-01-04"))
+
+
+def test_day_session_matches_legacy(intraday):
+    day_rows = intraday[intraday['dt'].dt.date == intraday['dt'].dt.date.iloc[0]]
+    out = _prepare_day_session_data(day_rows)
+    assert out[FT_COL].isna().any()
+    _assert_same(out, _legacy_day_session(day_rows))
+
+
+def test_day_session_empty_selection(intraday):
+    night = intraday[intraday['dt'].dt.time >= time(15, 0)]
+    out = _prepare_day_session_data(night)
+    assert out.empty
+    _assert_same(out, _legacy_day_session(night))
+
+
+def test_does_not_modify_input(intraday):
+    before = intraday.columns.tolist()
+    day = intraday['dt'].dt.strftime('%Y-%m-%d').iloc[0]
+    _prepare_seamless_data(intraday, day, day)
+    _prepare_day_session_data(intraday)
+    assert intraday.columns.tolist() == before